@@ -1,14 +1,36 @@
 # lostmatch-model-server/image-match-api.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import numpy as np
 import cv2
+import struct
+import threading
 from flask_cors import CORS
 
 app = Flask(__name__)
 
 CORS(app)
 
+# Binary feature format shared with rubust-image-matching-server/wire_format.py:
+# 32-byte header, float32 keypoints (x, y, size, angle), then raw descriptors.
+# The descriptor kind code marks the blobs as ORB (orb-32-u8 there), not raw SIFT
+FEATURES_MEDIA_TYPE = "application/x-lostmatch-features"
+FEATURES_HEADER = struct.Struct("<4sBBHIIIIII")
+FEATURES_MAGIC = b"LMF1"
+UINT8_DTYPE_CODE = 2
+ORB_KIND_CODE = 2
+
+ORB_NFEATURES = 500
+
+# One ORB detector per request thread, created on first use instead of per request
+_thread_local = threading.local()
+
+def get_orb():
+    orb = getattr(_thread_local, "orb", None)
+    if orb is None:
+        orb = _thread_local.orb = cv2.ORB_create(nfeatures=ORB_NFEATURES)
+    return orb
+
 def process_image(image_bytes: bytes):
     npimg = np.frombuffer(image_bytes, np.uint8)
     img = cv2.imdecode(npimg, cv2.IMREAD_GRAYSCALE)
@@ -18,6 +40,70 @@ def process_image(image_bytes: bytes):
     img = cv2.GaussianBlur(img, (3, 3), 0)
     return img
 
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:  # NumPy < 2.0
+    POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        return POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def as_words(descriptors: np.ndarray) -> np.ndarray:
+    """View uint8 descriptors as uint64 words, zero-padding rows to a multiple of 8 bytes"""
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+    padding = -descriptors.shape[1] % 8
+    if padding:
+        descriptors = np.hstack([descriptors, np.zeros((len(descriptors), padding), dtype=np.uint8)])
+    return descriptors.view(np.uint64)
+
+def hamming_distance_matrix(desc1: np.ndarray, desc2: np.ndarray) -> np.ndarray:
+    """
+    All-pairs Hamming distances between two uint8 ORB descriptor matrices
+    popcount(a ^ b) summed over the 64-bit words of the descriptors (4 for ORB)
+    """
+    words1 = as_words(desc1)
+    # Each word of all desc2 rows is contiguous
+    words2 = np.ascontiguousarray(as_words(desc2).T)
+    dist = np.zeros((len(words1), len(desc2)), dtype=np.uint16)
+    for word in range(words1.shape[1]):
+        dist += popcount(words1[:, word, None] ^ words2[word, None, :])
+    return dist
+
+def cross_check_matches(dist: np.ndarray, max_distance: float):
+    """
+    Vectorized equivalent of BFMatcher(NORM_HAMMING, crossCheck=True).match
+    followed by the distance threshold: keep mutual nearest neighbours closer than max_distance
+    """
+    nn12 = dist.argmin(axis=1)
+    nn21 = dist.argmin(axis=0)
+    mutual = nn21[nn12] == np.arange(len(dist))
+    good = mutual & (dist[np.arange(len(dist)), nn12] < max_distance)
+    return int(good.sum())
+
+def pack_features(keypoints, descriptors: np.ndarray, image_shape) -> bytes:
+    kp_array = np.array([(kp.pt[0], kp.pt[1], kp.size, kp.angle) for kp in keypoints], dtype=np.float32)
+    rows, dim = descriptors.shape if descriptors is not None and len(descriptors) else (0, 0)
+    header = FEATURES_HEADER.pack(
+        FEATURES_MAGIC, 1, UINT8_DTYPE_CODE, ORB_KIND_CODE,
+        rows, dim, len(kp_array), image_shape[0], image_shape[1], 0
+    )
+    body = descriptors.tobytes() if rows else b""
+    return header + kp_array.tobytes() + body
+
+def unpack_descriptors(buffer: bytes, offset: int = 0):
+    """
+    Read the descriptors of one binary feature blob as a zero-copy uint8 view
+    Returns (descriptors, next_offset)
+    """
+    magic, version, dtype_code, kind_code, rows, dim, kp_count, _, _, _ = FEATURES_HEADER.unpack_from(buffer, offset)
+    if magic != FEATURES_MAGIC or version != 1 or dtype_code != UINT8_DTYPE_CODE or kind_code != ORB_KIND_CODE:
+        raise ValueError("Not an ORB feature blob")
+    offset += FEATURES_HEADER.size + kp_count * 4 * 4
+    if len(buffer) < offset + rows * dim:
+        raise ValueError("Truncated feature blob")
+    descriptors = np.frombuffer(buffer, dtype=np.uint8, count=rows * dim, offset=offset).reshape(rows, dim)
+    return descriptors, offset + rows * dim
+
 def serialize_keypoints(keypoints):
     return [
         {
@@ -54,8 +140,9 @@ def extract_features():
         print(f"Received file: {file.filename}")
         image_bytes = file.read()
         img = process_image(image_bytes)
-        orb = cv2.ORB_create(nfeatures=500)
-        keypoints, descriptors = orb.detectAndCompute(img, None)
+        keypoints, descriptors = get_orb().detectAndCompute(img, None)
+        if request.accept_mimetypes.best_match(["application/json", FEATURES_MEDIA_TYPE]) == FEATURES_MEDIA_TYPE:
+            return Response(pack_features(keypoints, descriptors, img.shape), mimetype=FEATURES_MEDIA_TYPE)
         if descriptors is None:
             descriptors = []
         return jsonify({
@@ -68,23 +155,26 @@ def extract_features():
 @app.route("/compare-features", methods=["POST"])
 def compare_features():
     try:
-        data = request.get_json()
-        keypoints1 = data.get("keypoints1", [])
-        descriptors1 = data.get("descriptors1", [])
-        keypoints2 = data.get("keypoints2", [])
-        descriptors2 = data.get("descriptors2", [])
-        desc1 = np.array(descriptors1, dtype=np.uint8)
-        desc2 = np.array(descriptors2, dtype=np.uint8)
+        if request.mimetype == FEATURES_MEDIA_TYPE:
+            # Two concatenated binary blobs, loaded without copying
+            body = request.get_data()
+            desc1, offset = unpack_descriptors(body)
+            desc2, _ = unpack_descriptors(body, offset)
+        else:
+            data = request.get_json()
+            keypoints1 = data.get("keypoints1", [])
+            descriptors1 = data.get("descriptors1", [])
+            keypoints2 = data.get("keypoints2", [])
+            descriptors2 = data.get("descriptors2", [])
+            desc1 = np.array(descriptors1, dtype=np.uint8)
+            desc2 = np.array(descriptors2, dtype=np.uint8)
         if len(desc1) == 0 or len(desc2) == 0:
             return jsonify({"similarity": 0.0, "matches": 0})
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(desc1, desc2)
-        matches = sorted(matches, key=lambda x: x.distance)
-        good_matches = [m for m in matches if m.distance < 50]
-        similarity = len(good_matches) / min(len(desc1), len(desc2))
+        good_matches = cross_check_matches(hamming_distance_matrix(desc1, desc2), 50)
+        similarity = good_matches / min(len(desc1), len(desc2))
         return jsonify({
             "similarity": similarity,
-            "matches": len(good_matches)
+            "matches": good_matches
         })
     except Exception as e:
         return jsonify({"detail": str(e)}), 400
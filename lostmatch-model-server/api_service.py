@@ -2,31 +2,239 @@
 
     # api_service.py
 from flask import Flask, request, jsonify
-from sentence_transformers import SentenceTransformer
-import torch
+from collections import OrderedDict
+from embedding_store import EmbeddingStore
+from report_filter import ReportFilter, parse_metadata
+from micro_batcher import MicroBatcher
+import numpy as np
+import threading
+import time
 import os
 
+PROCESS_STARTED = time.perf_counter()
+
 app = Flask(__name__)
 
+# Encoding configuration
+ENCODE_BATCH_SIZE = int(os.environ.get("ENCODE_BATCH_SIZE", 64))
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 50000))
+EMBEDDING_STORE_DIR = os.environ.get("EMBEDDING_STORE_DIR", "./embedding_store")
+EMBEDDING_STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float16")
+# Deleted/replaced rows are tombstoned; the store is compacted in the background past this share
+EMBEDDING_STORE_COMPACT_DEAD_FRACTION = float(os.environ.get("EMBEDDING_STORE_COMPACT_DEAD_FRACTION", 0.3))
+# Concurrent requests are coalesced into one forward pass of up to MICRO_BATCH_MAX_SIZE texts,
+# waiting at most MICRO_BATCH_MAX_WAIT_MS for company; a wait of 0 encodes in the request thread
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", 64))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get("MICRO_BATCH_MAX_WAIT_MS", 5))
+MICRO_BATCH_TIMEOUT = float(os.environ.get("MICRO_BATCH_TIMEOUT", 30))
+
 # Define the path where the model is saved
 model_path = "./trained_model"
 
-# Load the model (load it once when the service starts)
-try:
-    model = SentenceTransformer(model_path)
-    print(f"Sentence Transformer model loaded from {model_path}")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    model = None # Handle the case where the model fails to load
+# Inference backend: "torch" (SentenceTransformer) or "onnx" (int8 export made by onnx_backend.py)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "torch")
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH", "./trained_model_onnx")
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", 0))
+
+# Model loading: "eager" loads and warms up the model at import, before the port is bound;
+# "background" binds the port at once and loads in a thread (poll /ready); "preload" loads the
+# weights at import without warming up, for gunicorn --preload (see gunicorn.conf.py), and each
+# worker warms up after the fork with start_warmup()
+MODEL_LOAD_MODE = os.environ.get("MODEL_LOAD_MODE", "eager")
+if MODEL_LOAD_MODE not in ("eager", "background", "preload"):
+    raise ValueError(f"Unknown MODEL_LOAD_MODE: {MODEL_LOAD_MODE}")
+
+# Dummy batch of mixed lengths, so the first real request does not pay for lazy kernel initialization
+WARMUP_TEXTS = [
+    "lost wallet",
+    "black leather wallet with two bank cards and a student ID card inside",
+    "found a red backpack near the main library entrance on Monday morning",
+    "keys"
+] * 4
+
+model = None
+model_state = {"status": "loading", "mode": MODEL_LOAD_MODE, "backend": MODEL_BACKEND, "error": None, "timings": {}}
+
+def load_model():
+    """Import the configured backend and load its weights, recording both times"""
+    started = time.perf_counter()
+    if MODEL_BACKEND == "onnx":
+        from onnx_backend import OnnxEncoder
+        imported = time.perf_counter()
+        loaded = OnnxEncoder(ONNX_MODEL_PATH, num_threads=ONNX_THREADS)
+    elif MODEL_BACKEND == "torch":
+        # Imported here so the port can be bound before torch is loaded
+        from sentence_transformers import SentenceTransformer
+        imported = time.perf_counter()
+        loaded = SentenceTransformer(model_path)
+    else:
+        raise ValueError(f"Unknown MODEL_BACKEND: {MODEL_BACKEND}")
+    model_state["timings"]["import_seconds"] = round(imported - started, 3)
+    model_state["timings"]["load_seconds"] = round(time.perf_counter() - imported, 3)
+    return loaded
+
+def warm_up(loaded):
+    started = time.perf_counter()
+    loaded.encode(WARMUP_TEXTS, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+    model_state["timings"]["warmup_seconds"] = round(time.perf_counter() - started, 3)
+
+def mark_ready():
+    model_state["status"] = "ready"
+    model_state["timings"]["ready_after_seconds"] = round(time.perf_counter() - PROCESS_STARTED, 3)
+
+def initialize_model(warmup=True):
+    """Load (and warm up) the model; failures are kept in model_state for /ready"""
+    global model
+    try:
+        loaded = load_model()
+        if warmup:
+            warm_up(loaded)
+        model = loaded
+        if warmup:
+            mark_ready()
+        else:
+            model_state["status"] = "warming_up"
+        print(f"{MODEL_BACKEND} model loaded in {model_state['timings']}")
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        model_state["status"] = "failed"
+        model_state["error"] = str(e)
+
+def start_warmup():
+    """Warm up a preloaded model in a background thread of this worker"""
+    def run():
+        try:
+            warm_up(model)
+            mark_ready()
+        except Exception as e:
+            print(f"Error warming up model: {e}")
+            model_state["status"] = "failed"
+            model_state["error"] = str(e)
+
+    if model is not None and model_state["status"] == "warming_up":
+        threading.Thread(target=run, name="model-warmup", daemon=True).start()
+
+if MODEL_LOAD_MODE == "background":
+    threading.Thread(target=initialize_model, name="model-loader", daemon=True).start()
+else:
+    initialize_model(warmup=MODEL_LOAD_MODE == "eager")
+
+def model_unavailable():
+    """Response for requests arriving before the model is loaded and warmed up"""
+    if model_state["status"] == "failed":
+        return jsonify({"error": f"Model failed to load: {model_state['error']}"}), 500
+    return jsonify({"error": f"Model is not ready ({model_state['status']})"}), 503, {"Retry-After": "5"}
+
+# Registered report descriptions, memory-mapped from disk instead of re-embedded at startup
+embedding_store = EmbeddingStore(
+    EMBEDDING_STORE_DIR, dtype=EMBEDDING_STORE_DTYPE, compact_dead_fraction=EMBEDDING_STORE_COMPACT_DEAD_FRACTION
+)
+
+def parse_top_k(value, default):
+    """top_k of a request as a positive int (default when absent); raises ValueError otherwise"""
+    if value is None:
+        return default
+    try:
+        if isinstance(value, bool):
+            raise TypeError(value)
+        top_k = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("top_k must be an integer")
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1")
+    return top_k
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different copies of a description share one embedding"""
+    return " ".join(str(text).split())
+
+class EmbeddingCache:
+    """LRU cache of L2-normalized embeddings keyed by normalized text"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+
+def encode_batch(texts):
+    """L2-normalized float32 embeddings of texts, in one model call"""
+    return model.encode(
+        texts,
+        batch_size=ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    ).astype(np.float32)
+
+micro_batcher = None
+if MICRO_BATCH_MAX_WAIT_MS > 0:
+    micro_batcher = MicroBatcher(encode_batch, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS, MICRO_BATCH_TIMEOUT)
+
+def encode_texts(texts):
+    """
+    Return an (n, dim) float32 matrix of L2-normalized embeddings
+    Cached texts are reused; the rest are encoded together in batches of ENCODE_BATCH_SIZE,
+    along with the texts of concurrent requests when the micro-batcher is enabled
+    """
+    keys = [normalize_text(text) for text in texts]
+    vectors = [embedding_cache.get(key) for key in keys]
+
+    missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+    if missing:
+        encoded = micro_batcher.encode(missing) if micro_batcher is not None else encode_batch(missing)
+        fresh = dict(zip(missing, encoded))
+        for key, vector in fresh.items():
+            embedding_cache.put(key, vector)
+        vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+    return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "backend": MODEL_BACKEND,
+        "model": model_state["status"],
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_store": embedding_store.stats(),
+        "micro_batcher": micro_batcher.stats() if micro_batcher is not None else None
+    }
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before (or after a failure)"""
+    state = dict(model_state, timings=dict(model_state["timings"]), pid=os.getpid())
+    return jsonify(state), 200 if model_state["status"] == "ready" else 503
 
 @app.route('/compare_items', methods=['POST'])
 def compare_items():
-    if model is None:
-        return jsonify({"error": "Model not loaded"}), 500
+    if model_state["status"] != "ready":
+        return model_unavailable()
 
     data = request.get_json()
     if not data or 'description1' not in data or 'description2' not in data:
@@ -36,18 +244,147 @@ def compare_items():
     text2 = data['description2']
 
     try:
-        # Encode the texts
-        embeddings1 = model.encode([text1], convert_to_tensor=True)
-        embeddings2 = model.encode([text2], convert_to_tensor=True)
-
-        # Compute cosine similarity
-        cosine_score = torch.nn.functional.cosine_similarity(embeddings1, embeddings2).item()
+        # Encode the texts (cached, one batch) and take the cosine of the normalized vectors
+        embeddings = encode_texts([text1, text2])
+        cosine_score = float(embeddings[0] @ embeddings[1])
 
         return jsonify({"similarity": cosine_score})
 
     except Exception as e:
         return jsonify({"error": f"An error occurred during processing: {e}"}), 500
 
+@app.route('/compare_items_batch', methods=['POST'])
+def compare_items_batch():
+    """
+    Compare one description against many candidate descriptions in one request
+    Input: {"description": "...", "candidates": ["...", ...] or [{"id": ..., "description": "..."}, ...],
+            "top_k": optional}
+    Registered reports can be referenced with "candidate_ids": [...] instead of sending their text
+    Returns the similarity of every candidate (input order), plus a ranked list when top_k is given
+    """
+    if model_state["status"] != "ready":
+        return model_unavailable()
+
+    data = request.get_json()
+    try:
+        top_k = parse_top_k(data.get('top_k'), None) if data else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid top_k: {e}"}), 400
+    if data and isinstance(data.get('candidate_ids'), list) and 'description' in data:
+        return compare_registered_candidates(data, top_k)
+    if not data or 'description' not in data or not isinstance(data.get('candidates'), list):
+        return jsonify({"error": "Invalid input. Provide 'description' and a 'candidates' list."}), 400
+
+    candidates = data['candidates']
+    ids = []
+    texts = []
+    for index, candidate in enumerate(candidates):
+        if isinstance(candidate, dict):
+            if 'description' not in candidate:
+                return jsonify({"error": f"Candidate {index} has no 'description'."}), 400
+            ids.append(candidate.get('id', index))
+            texts.append(candidate['description'])
+        else:
+            ids.append(index)
+            texts.append(candidate)
+
+    try:
+        embeddings = encode_texts([data['description']] + texts)
+        # One matrix-vector product for every candidate
+        similarities = embeddings[1:] @ embeddings[0] if texts else np.empty(0, dtype=np.float32)
+
+        return jsonify(ranked_response(ids, similarities, top_k))
+
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during processing: {e}"}), 500
+
+def ranked_response(ids, similarities, top_k):
+    """Similarities in input order, plus the top_k best (a validated int, or None for no ranking)"""
+    results = [{"id": i, "similarity": float(s)} for i, s in zip(ids, similarities)]
+    response = {"results": results, "count": len(results)}
+    if top_k is not None:
+        response["ranked"] = sorted(results, key=lambda r: r["similarity"], reverse=True)[:top_k]
+    return response
+
+def compare_registered_candidates(data, top_k):
+    """Score a query against registered reports by ID, using their stored embeddings"""
+    candidate_ids = [str(i) for i in data['candidate_ids']]
+    unknown = [i for i in candidate_ids if i not in embedding_store]
+    if unknown:
+        return jsonify({"error": "Unknown candidate ids", "unknown_ids": unknown}), 404
+    try:
+        query = encode_texts([data['description']])[0]
+        similarities = embedding_store.get(candidate_ids) @ query
+        return jsonify(ranked_response(candidate_ids, similarities, top_k))
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during processing: {e}"}), 500
+
+@app.route('/register_descriptions', methods=['POST'])
+def register_descriptions():
+    """
+    Embed report descriptions once and keep them in the persistent embedding store
+    Input: {"items": [{"id": "...", "description": "...", "metadata": {...}}, ...]}
+    metadata (optional): {"category", "report_type", "date_from", "date_to"} used by search filters
+    Registering an existing id replaces its embedding and metadata
+    """
+    if model_state["status"] != "ready":
+        return model_unavailable()
+
+    data = request.get_json()
+    items = data.get('items') if data else None
+    if not isinstance(items, list) or not all(isinstance(i, dict) and 'id' in i and 'description' in i for i in items):
+        return jsonify({"error": "Invalid input. Provide 'items' as a list of {'id', 'description'}."}), 400
+    try:
+        metadata = [parse_metadata(item.get('metadata')) for item in items]
+    except ValueError as e:
+        return jsonify({"error": f"Invalid metadata: {e}"}), 400
+
+    try:
+        if items:
+            embeddings = encode_texts([item['description'] for item in items])
+            embedding_store.upsert([item['id'] for item in items], embeddings, metadata)
+        return jsonify({"registered": len(items), "store": embedding_store.stats()})
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during processing: {e}"}), 500
+
+@app.route('/descriptions/<report_id>', methods=['DELETE'])
+def remove_description(report_id):
+    """Remove a report from the embedding store"""
+    if not embedding_store.remove(report_id):
+        return jsonify({"error": f"Report {report_id} is not registered"}), 404
+    return jsonify({"removed": report_id, "store": embedding_store.stats()})
+
+@app.route('/search_similar', methods=['POST'])
+def search_similar():
+    """
+    Top-k registered reports for a query description
+    Input: {"description": "...", "top_k": 10, "filter": {...}}
+    filter (optional): {"category", "report_type", "date_from", "date_to"}; only matching reports are scored
+    """
+    if model_state["status"] != "ready":
+        return model_unavailable()
+
+    data = request.get_json()
+    if not data or 'description' not in data:
+        return jsonify({"error": "Invalid input. Provide 'description'."}), 400
+    try:
+        report_filter = ReportFilter.parse(data.get('filter'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+    try:
+        top_k = parse_top_k(data.get('top_k'), 10)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid top_k: {e}"}), 400
+
+    try:
+        query = encode_texts([data['description']])[0]
+        results = embedding_store.search(query, top_k, report_filter)
+        return jsonify({"results": results, "store_size": len(embedding_store)})
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during processing: {e}"}), 500
+
 if __name__ == '__main__':
+    if MODEL_LOAD_MODE == "preload":
+        start_warmup()
     # Production configuration
     app.run(host='0.0.0.0', port=8000, debug=False)
\ No newline at end of file
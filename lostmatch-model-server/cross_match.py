@@ -0,0 +1,155 @@
+# lostmatch-model-server/cross_match.py
+
+"""
+Nightly all-pairs cross-matching of the registered report descriptions
+
+Instead of calling /compare_items once per (lost, found) pair, this job scores
+every query report against every candidate report of the embedding store with
+blocked matrix multiplies, and writes the top-k candidates of each query
+report as one JSON line:
+
+    python cross_match.py --store ./embedding_store --output text_candidates.jsonl
+    python cross_match.py --store ./embedding_store --output out.jsonl --top-k 50 --workers 8 \\
+        --queries '{"report_type": "lost"}' --candidates '{"report_type": "found", "date_from": "2024-05-01"}'
+
+    {"id": "report-17", "candidates": [{"id": "report-42", "similarity": 0.8731}]}
+
+Queries and candidates are chosen by metadata filters (report_filter.py), lost
+against found reports by default; a report never matches itself. Each task
+scores one block of query rows against the candidates, one candidate block at
+a time, keeping a running top-k per query row, so memory per task is bounded
+by the two float32 blocks and their score matrix whatever the store size.
+Tasks run on a thread pool sharing the store's mapping; NumPy releases the GIL
+in the matrix products and selections.
+
+The output is written to a temporary file and renamed when the run completes.
+rubust-image-matching-server/cross_match.py is the same job for images; as
+with report_filter.py, each service is deployed from its own directory, so
+write_candidates is a copy of the one there. Keep the two in sync.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding_store import MANIFEST_FILE, EmbeddingStore
+from report_filter import ReportFilter
+
+DEFAULT_QUERY_BLOCK_ROWS = 1024
+# Scores of one block pair are query_block x candidate_block float32 (64MB by default)
+DEFAULT_CANDIDATE_BLOCK_ROWS = 16384
+PROGRESS_SECONDS = 5.0
+
+
+def write_candidates(output, tasks, total, workers):
+    """
+    Run tasks (callables returning JSON lines) on a thread pool and write their
+    lines to output in task order, reporting progress
+    Returns (reports, seconds)
+    """
+    started = last_report = time.time()
+    done = 0
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "w") as out, ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        for future in futures:
+            lines = future.result()
+            out.writelines(line + "\n" for line in lines)
+            done += len(lines)
+            if time.time() - last_report >= PROGRESS_SECONDS:
+                rate = done / (time.time() - started)
+                print(f"{done}/{total} reports, {rate:.1f} reports/s, ETA {(total - done) / rate:.0f}s", file=sys.stderr)
+                last_report = time.time()
+    os.replace(tmp_path, output)
+    return done, time.time() - started
+
+
+def top_candidates(matrix, query_rows, candidate_rows, top_k, candidate_block_rows):
+    """
+    (candidate rows, similarities) of the top_k candidates of every query row, best first
+    Shape (len(query_rows), k) each, k = min(top_k, candidates); a row never matches itself
+    """
+    queries = np.asarray(matrix[query_rows], dtype=np.float32)
+    best = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(candidate_rows), candidate_block_rows):
+        rows = candidate_rows[start:start + candidate_block_rows]
+        scores = queries @ np.asarray(matrix[rows], dtype=np.float32).T
+        scores[query_rows[:, None] == rows[None, :]] = -np.inf
+        scores = np.concatenate([best, scores], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(rows, (len(queries), len(rows)))], axis=1)
+        # Blocks narrower than top_k are kept whole until enough candidates have been merged
+        k = min(top_k, scores.shape[1])
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best = np.take_along_axis(scores, keep, axis=1)
+        best_rows = np.take_along_axis(rows, keep, axis=1)
+    order = np.argsort(-best, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def match_block(matrix, ids, query_rows, candidate_rows, top_k, candidate_block_rows):
+    """JSON lines of one block of query rows"""
+    rows, similarities = top_candidates(matrix, query_rows, candidate_rows, top_k, candidate_block_rows)
+    return [
+        json.dumps({
+            "id": ids[query_row],
+            "candidates": [
+                {"id": ids[row], "similarity": round(float(similarity), 4)}
+                for row, similarity in zip(rows[i], similarities[i]) if similarity > -np.inf
+            ]
+        })
+        for i, query_row in enumerate(query_rows)
+    ]
+
+
+def cross_match(store, output, query_filter, candidate_filter, top_k, workers, query_block_rows,
+                candidate_block_rows):
+    """Write the candidates of every query report to output; returns (reports, seconds)"""
+    matrix, ids, query_rows = store.select(query_filter)
+    _, _, candidate_rows = store.select(candidate_filter)
+    print(f"{len(query_rows)} query reports against {len(candidate_rows)} candidate reports", file=sys.stderr)
+    tasks = [
+        lambda start=start: match_block(matrix, ids, query_rows[start:start + query_block_rows], candidate_rows,
+                                        top_k, candidate_block_rows)
+        for start in range(0, len(query_rows), query_block_rows)
+    ] if len(candidate_rows) else []
+    return write_candidates(output, tasks, len(query_rows), workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-match the registered reports of an embedding store")
+    parser.add_argument("--store", default=os.environ.get("EMBEDDING_STORE_DIR", "./embedding_store"))
+    parser.add_argument("--output", required=True, help="JSON lines file of top-k candidates per query report")
+    parser.add_argument("--queries", default='{"report_type": "lost"}', help="metadata filter of the query reports")
+    parser.add_argument("--candidates", default='{"report_type": "found"}',
+                        help="metadata filter of the candidate reports")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--query-block-rows", type=int, default=DEFAULT_QUERY_BLOCK_ROWS)
+    parser.add_argument("--candidate-block-rows", type=int, default=DEFAULT_CANDIDATE_BLOCK_ROWS)
+    args = parser.parse_args()
+    for name in ("top_k", "workers", "query_block_rows", "candidate_block_rows"):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+
+    try:
+        query_filter = ReportFilter.parse(args.queries)
+        candidate_filter = ReportFilter.parse(args.candidates)
+    except ValueError as e:
+        parser.error(str(e))
+    if not os.path.exists(os.path.join(args.store, MANIFEST_FILE)):
+        parser.error(f"No embedding store in {args.store}")
+
+    store = EmbeddingStore(args.store)
+    total, elapsed = cross_match(store, args.output, query_filter, candidate_filter, args.top_k, args.workers,
+                                 args.query_block_rows, args.candidate_block_rows)
+    print(f"Matched {total} reports in {elapsed:.1f}s with {args.workers} workers, "
+          f"{total / max(elapsed, 1e-9):.1f} reports/s; candidates written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# lostmatch-model-server/embedding_store.py
+
+import base64
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from report_filter import MetadataColumns
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+VECTORS_FILE = "embeddings.bin"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+
+# Rows converted to float32 at a time when scoring a float16 store
+SCORE_CHUNK_ROWS = 65536
+# Share of tombstoned rows at which the background compaction rewrites the vectors file
+DEFAULT_COMPACT_DEAD_FRACTION = 0.3
+# Filters leaving at most this share of the rows score a gathered copy of those rows only
+FILTER_GATHER_FRACTION = 0.25
+
+
+class EmbeddingStore:
+    """
+    Persistent matrix of L2-normalized description embeddings keyed by report ID
+
+    Vectors live in a raw float16/float32 file that is memory-mapped, so a
+    restart maps the existing matrix instead of re-encoding every description.
+    A small JSON manifest holds the row order (report IDs), dimension and dtype.
+    Workers sharing the directory reload when the manifest is replaced.
+
+    Rows are append-only. Updating a report appends its new row, and deleting
+    one sets its bit in a tombstone bitmap kept in the manifest; searches mask
+    tombstoned rows, so no published row is ever overwritten while another
+    worker reads it. Once the tombstoned share reaches compact_dead_fraction, a
+    background thread copies the live rows to a new vectors file and publishes
+    it; searches keep using the old mapping until then.
+
+    Reports may carry metadata (see report_filter.py), kept in the manifest. A
+    search filter becomes a row mask before any scoring, and a selective one
+    is scored on the gathered matching rows only.
+    """
+
+    def __init__(self, directory, dim=None, dtype="float16", compact_dead_fraction=DEFAULT_COMPACT_DEAD_FRACTION):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.compact_dead_fraction = compact_dead_fraction
+        self.compactions = 0
+        # _lock guards the in-memory state and is only held briefly; _writer serializes writers
+        self._lock = threading.RLock()
+        self._writer = threading.RLock()
+        self._file = VECTORS_FILE
+        self._generation = 0  # bumped by every compaction, names the vectors file
+        self._ids = []  # report ID of every row, tombstoned rows included
+        self._rows = {}  # report ID -> live row
+        self._metadata = {}  # report ID -> category, report_type and date window
+        self._columns = None  # MetadataColumns over the rows, built by the first filtered search
+        self._dead = np.zeros(0, dtype=bool)
+        self._count = 0
+        self._capacity = 0
+        self._matrix = None
+        self._manifest_version = None
+        self._compacting = False
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _write_lock(self):
+        with self._writer:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _map(self, capacity, name=None, mode="r+"):
+        if capacity == 0:
+            return None
+        return np.memmap(self._path(name or self._file), dtype=self.dtype, mode=mode, shape=(capacity, self.dim))
+
+    def refresh(self):
+        """Map the stored matrix, again only if another worker replaced the manifest"""
+        for _ in range(3):
+            try:
+                stat = os.stat(self._path(MANIFEST_FILE))
+            except FileNotFoundError:
+                return
+            version = (stat.st_ino, stat.st_mtime_ns)
+            with self._lock:
+                if version == self._manifest_version:
+                    return
+                with open(self._path(MANIFEST_FILE)) as f:
+                    manifest = json.load(f)
+                try:
+                    matrix = self._load(manifest)
+                except FileNotFoundError:
+                    # A compaction replaced the vectors file after we read the manifest
+                    continue
+                self._matrix = matrix
+                self._manifest_version = version
+                return
+
+    def _load(self, manifest):
+        self.dim = manifest["dim"]
+        self.dtype = np.dtype(manifest["dtype"])
+        self._file = manifest.get("file", VECTORS_FILE)
+        self._generation = manifest.get("generation", 0)
+        self._capacity = manifest["capacity"]
+        self._ids = manifest["ids"]
+        self._count = len(self._ids)
+        self._dead = np.zeros(self._capacity, dtype=bool)
+        if manifest.get("tombstones"):
+            bits = np.frombuffer(base64.b64decode(manifest["tombstones"]), dtype=np.uint8)
+            self._dead[:self._count] = np.unpackbits(bits, count=self._count).astype(bool)
+        self._rows = {report_id: row for row, report_id in enumerate(self._ids) if not self._dead[row]}
+        self._metadata = manifest.get("metadata", {})
+        self._columns = None
+        return self._map(self._capacity)
+
+    def _write_manifest(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+        manifest = {
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "file": self._file,
+            "generation": self._generation,
+            "capacity": self._capacity,
+            "ids": self._ids,
+            "tombstones": base64.b64encode(np.packbits(self._dead[:self._count]).tobytes()).decode("ascii"),
+            "metadata": self._metadata,
+        }
+        tmp_path = self._path(MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path(MANIFEST_FILE))
+        stat = os.stat(self._path(MANIFEST_FILE))
+        self._manifest_version = (stat.st_ino, stat.st_mtime_ns)
+
+    def _ensure_capacity(self, rows):
+        if rows <= self._capacity:
+            return
+        capacity = max(rows, 2 * self._capacity, 1024)
+        # Growing the file keeps existing rows in place; only the mapping changes
+        with open(self._path(self._file), "ab") as f:
+            f.truncate(capacity * self.dim * self.dtype.itemsize)
+        dead = np.zeros(capacity, dtype=bool)
+        dead[:self._count] = self._dead[:self._count]
+        with self._lock:
+            self._matrix = self._map(capacity)
+            self._dead = dead
+            self._capacity = capacity
+
+    def upsert(self, report_ids, vectors, metadata=None):
+        """
+        Register or replace the embeddings of several reports; replaced rows become tombstones
+        metadata is an optional list of per-report metadata dicts (or None), aligned with report_ids
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(report_ids):
+            raise ValueError("Expected one embedding row per report id")
+        if metadata is None:
+            metadata = [None] * len(report_ids)
+        with self._write_lock():
+            self.refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch: got {vectors.shape[1]}, store has {self.dim}")
+
+            self._ensure_capacity(self._count + len(report_ids))
+            start = self._count
+            # Rows past the published count are not read by anyone yet
+            self._matrix[start:start + len(vectors)] = vectors
+            with self._lock:
+                for row, (report_id, report_metadata) in enumerate(zip(report_ids, metadata), start):
+                    report_id = str(report_id)
+                    old = self._rows.get(report_id)
+                    if old is not None:
+                        self._dead[old] = True
+                    self._ids.append(report_id)
+                    self._rows[report_id] = row
+                    if report_metadata:
+                        self._metadata[report_id] = report_metadata
+                    else:
+                        self._metadata.pop(report_id, None)
+                self._count = start + len(vectors)
+                self._columns = None
+            self._write_manifest()
+        self._maybe_compact()
+
+    def remove(self, report_id):
+        """Tombstone a report's row, returns False if unknown"""
+        report_id = str(report_id)
+        with self._write_lock():
+            self.refresh()
+            with self._lock:
+                row = self._rows.pop(report_id, None)
+                if row is None:
+                    return False
+                self._dead[row] = True
+                self._metadata.pop(report_id, None)
+            self._write_manifest()
+        self._maybe_compact()
+        return True
+
+    def dead_fraction(self):
+        count = self._count
+        return float(np.count_nonzero(self._dead[:count])) / count if count else 0.0
+
+    def compact(self, min_dead_fraction=None):
+        """
+        Copy the live rows to a new vectors file and publish it, if the tombstoned
+        share reached min_dead_fraction (compact_dead_fraction by default)
+        Searches keep running on the old mapping meanwhile. Returns the number of rows dropped
+        """
+        threshold = self.compact_dead_fraction if min_dead_fraction is None else min_dead_fraction
+        with self._write_lock():
+            self.refresh()
+            count = self._count
+            if count == 0 or self.dead_fraction() < threshold:
+                return 0
+            live = np.flatnonzero(~self._dead[:count])
+            ids = [self._ids[row] for row in live]
+            capacity = max(len(ids), 1024)
+            name = f"embeddings-{self._generation + 1}.bin"
+            matrix = self._map(capacity, name, mode="w+")
+            for start in range(0, len(live), SCORE_CHUNK_ROWS):
+                rows = live[start:start + SCORE_CHUNK_ROWS]
+                matrix[start:start + len(rows)] = self._matrix[rows]
+
+            old_file = self._file
+            with self._lock:
+                self._file = name
+                self._generation += 1
+                self._matrix = matrix
+                self._capacity = capacity
+                self._ids = ids
+                self._rows = {report_id: row for row, report_id in enumerate(ids)}
+                self._dead = np.zeros(capacity, dtype=bool)
+                self._count = len(ids)
+                self._columns = None
+            self._write_manifest()
+            self.compactions += 1
+            try:
+                # Workers still mapping the old file keep it until they refresh
+                os.remove(self._path(old_file))
+            except OSError:
+                pass
+            return count - len(ids)
+
+    def _maybe_compact(self):
+        if self._compacting or self.dead_fraction() < self.compact_dead_fraction:
+            return
+        self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Embedding store compaction failed: {e}", file=sys.stderr)
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="embedding-compaction", daemon=True).start()
+
+    def _view(self):
+        """Consistent (matrix, row IDs, tombstones, row count) of the current version"""
+        with self._lock:
+            return self._matrix, self._ids, self._dead, self._count
+
+    def _filter_mask(self, ids, count, report_filter):
+        """Rows (among the first count of ids) whose report matches a ReportFilter"""
+        with self._lock:
+            columns = self._columns
+            if columns is None or len(columns.category) < count:
+                columns = MetadataColumns([self._metadata.get(report_id) for report_id in ids[:count]])
+                self._columns = columns
+        return columns.mask(report_filter)[:count]
+
+    def select(self, report_filter=None):
+        """
+        (matrix, row IDs, rows) of the current version: rows are the live rows
+        whose report matches report_filter, all live rows without one
+        """
+        self.refresh()
+        matrix, ids, dead, count = self._view()
+        selected = ~dead[:count]
+        if report_filter is not None:
+            selected &= self._filter_mask(ids, count, report_filter)
+        return matrix, ids, np.flatnonzero(selected)
+
+    def get(self, report_ids):
+        """Embeddings of the given report IDs as float32 rows (KeyError if unknown)"""
+        self.refresh()
+        with self._lock:
+            rows = [self._rows[str(i)] for i in report_ids]
+            matrix = self._matrix
+        if not rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.asarray(matrix[rows], dtype=np.float32)
+
+    def __contains__(self, report_id):
+        return str(report_id) in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def stats(self):
+        return {
+            "count": len(self._rows),
+            "rows": self._count,
+            "tombstones": int(np.count_nonzero(self._dead[:self._count])),
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "capacity": self._capacity,
+            "compactions": self.compactions,
+        }
+
+    def scores(self, query, matrix=None, count=None):
+        """Cosine similarity of a normalized query vector with every stored row, tombstones included"""
+        query = np.asarray(query, dtype=np.float32)
+        if matrix is None:
+            matrix, _, _, count = self._view()
+        if self.dtype == np.float32:
+            return np.asarray(matrix[:count]) @ query
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_CHUNK_ROWS):
+            block = np.asarray(matrix[start:min(start + SCORE_CHUNK_ROWS, count)], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        return scores
+
+    def search(self, query, top_k=10, report_filter=None):
+        """
+        Top-k report IDs for a normalized query vector, among the reports matching
+        report_filter (a report_filter.ReportFilter) if given
+        One matrix-vector product, then argpartition to avoid sorting the whole store
+        """
+        if top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        self.refresh()
+        matrix, ids, dead, count = self._view()
+        selected = ~dead[:count]
+        if report_filter is not None:
+            selected &= self._filter_mask(ids, count, report_filter)
+        live = int(np.count_nonzero(selected))
+        if live == 0:
+            return []
+        top_k = min(top_k, live)
+
+        if report_filter is not None and live <= FILTER_GATHER_FRACTION * count:
+            # Selective filter: score the matching rows only
+            rows = np.flatnonzero(selected)
+            scores = np.asarray(matrix[rows], dtype=np.float32) @ np.asarray(query, dtype=np.float32)
+        else:
+            rows = None
+            scores = self.scores(query, matrix, count)
+            scores[~selected] = -np.inf
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if rows is not None:
+            return [{"id": ids[rows[i]], "similarity": float(scores[i])} for i in top]
+        return [{"id": ids[row], "similarity": float(scores[row])} for row in top]
@@ -0,0 +1,33 @@
+# lostmatch-model-server/gunicorn.conf.py
+#
+#   gunicorn -c gunicorn.conf.py api_service:app
+#
+# The model is loaded once in the master and the workers are forked from it, so
+# its weights are shared copy-on-write instead of loaded again by every worker.
+
+import gc
+import os
+
+# Load the weights in the master, but leave warm-up (and torch's thread pools) to the workers
+os.environ.setdefault("MODEL_LOAD_MODE", "preload")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 120
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    # Move everything allocated while loading into the permanent generation, so the
+    # workers' garbage collections never write to (and so copy) those shared pages
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import api_service
+
+    api_service.start_warmup()
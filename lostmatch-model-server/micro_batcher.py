@@ -0,0 +1,142 @@
+# lostmatch-model-server/micro_batcher.py
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+# Batches kept for the latency percentiles reported by stats()
+RECENT_BATCHES = 1024
+
+
+class _Job:
+    def __init__(self, texts):
+        self.texts = texts
+        self.enqueued = time.perf_counter()
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Coalesces encode calls from concurrent requests into one model call
+
+    Requests queue their texts and block. A single background thread takes the
+    oldest job, keeps collecting jobs until the batch holds max_batch_size texts
+    or max_wait_ms have passed since the oldest job arrived, encodes the
+    distinct texts of the whole batch with one encode_fn call and hands each
+    request its own rows. Many small concurrent requests then share one forward
+    pass instead of each running its own, and the model is only ever called
+    from one thread.
+    """
+
+    def __init__(self, encode_fn, max_batch_size=64, max_wait_ms=5.0, timeout=30.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._recent = deque(maxlen=RECENT_BATCHES)
+        self.batches = 0
+        self.jobs = 0
+        self.texts = 0
+        self.max_seen = 0
+        self.failures = 0
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so a forked worker starts its own
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def encode(self, texts):
+        """(len(texts), dim) embeddings, encoded together with the texts of concurrent callers"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self._ensure_thread()
+        job = _Job(list(texts))
+        self._queue.put(job)
+        return job.future.result(timeout=self.timeout)
+
+    def _collect(self):
+        """Block for the oldest job, then gather more until the batch is full or its wait is over"""
+        jobs = [self._queue.get()]
+        size = len(jobs[0].texts)
+        deadline = jobs[0].enqueued + self.max_wait
+        while size < self.max_batch_size:
+            # Jobs already queued join without waiting, even once the deadline has passed
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            started = time.perf_counter()
+            unique = list(dict.fromkeys(text for job in jobs for text in job.texts))
+            try:
+                rows = dict(zip(unique, self.encode_fn(unique)))
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            encode_seconds = time.perf_counter() - started
+
+            for job in jobs:
+                job.future.set_result(np.stack([rows[text] for text in job.texts]))
+            self._record(jobs, len(unique), started - jobs[0].enqueued, encode_seconds)
+
+    def _record(self, jobs, unique, wait_seconds, encode_seconds):
+        size = sum(len(job.texts) for job in jobs)
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(jobs)
+            self.texts += size
+            self.max_seen = max(self.max_seen, size)
+            self._recent.append((len(jobs), size, unique, wait_seconds, encode_seconds))
+
+    def stats(self):
+        with self._lock:
+            recent = list(self._recent)
+            stats = {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "requests": self.jobs,
+                "texts": self.texts,
+                "largest_batch": self.max_seen,
+                "failed_batches": self.failures,
+                "queued": self._queue.qsize()
+            }
+        if recent:
+            jobs, sizes, unique, waits, encodes = (np.array(column, dtype=np.float64) for column in zip(*recent))
+            stats["recent"] = {
+                "batches": len(recent),
+                "mean_requests_per_batch": round(float(jobs.mean()), 2),
+                "mean_batch_size": round(float(sizes.mean()), 2),
+                "mean_unique_texts": round(float(unique.mean()), 2),
+                "queue_wait_ms": _percentiles(waits),
+                "encode_ms": _percentiles(encodes)
+            }
+        return stats
+
+
+def _percentiles(seconds):
+    p50, p95, p99 = np.percentile(seconds * 1000.0, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
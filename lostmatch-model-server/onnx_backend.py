@@ -0,0 +1,303 @@
+# lostmatch-model-server/onnx_backend.py
+
+"""
+ONNX Runtime inference backend for the sentence-transformer model
+
+Export the trained model once, with dynamic int8 quantization of its weights,
+and check how far its embeddings drift from the PyTorch ones:
+
+    python onnx_backend.py export --model ./trained_model --output ./trained_model_onnx
+    python onnx_backend.py parity --model ./trained_model --onnx ./trained_model_onnx --texts samples.txt
+
+Both need the optional packages of requirements-onnx.txt:
+
+    pip install -r requirements-onnx.txt
+
+Then start api_service.py with MODEL_BACKEND=onnx. The exported directory
+holds model.onnx, the tokenizer and backend_config.json (pooling mode and
+maximum sequence length), so serving needs neither torch nor
+sentence-transformers.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:  # only needed for MODEL_BACKEND=onnx
+    onnxruntime = None
+
+MISSING_PACKAGES = "install the optional ONNX packages: pip install -r requirements-onnx.txt"
+
+MODEL_FILE = "model.onnx"
+CONFIG_FILE = "backend_config.json"
+POOLING_MODES = ("mean", "cls")
+# Sentence-transformers modules the export reproduces
+SUPPORTED_MODULES = ("Transformer", "Pooling", "Normalize")
+
+SAMPLE_TEXTS = [
+    "Black leather wallet with two bank cards and a student ID",
+    "Lost a red backpack near the main library entrance",
+    "Silver iPhone 12 in a blue silicone case, cracked screen",
+    "Set of three keys on a green carabiner keyring",
+    "Brown wallet found at the bus station on Monday morning",
+    "Grey hoodie with university logo left in lecture hall B",
+    "Gold wedding ring, engraved inside",
+    "Found a black phone with a cracked screen in the cafeteria",
+    "Navy blue umbrella with a wooden handle",
+    "Passport and national identity card in a plastic sleeve",
+    "Pair of prescription glasses in a hard black case",
+    "Laptop charger, 65W, left in the computer lab",
+]
+
+
+def read_pooling_config(model_path):
+    """Pooling mode and maximum sequence length of a saved SentenceTransformer directory"""
+    modules_path = os.path.join(model_path, "modules.json")
+    if os.path.exists(modules_path):
+        with open(modules_path) as f:
+            modules = json.load(f)
+        for module in modules:
+            kind = module["type"].rsplit(".", 1)[-1]
+            if kind not in SUPPORTED_MODULES:
+                raise ValueError(f"Cannot export module {module['type']}; supported: {', '.join(SUPPORTED_MODULES)}")
+
+    mode = "mean"
+    pooling_path = os.path.join(model_path, "1_Pooling", "config.json")
+    if os.path.exists(pooling_path):
+        with open(pooling_path) as f:
+            pooling = json.load(f)
+        if pooling.get("pooling_mode_cls_token"):
+            mode = "cls"
+        elif not pooling.get("pooling_mode_mean_tokens", True):
+            raise ValueError(f"Unsupported pooling configuration in {pooling_path}")
+
+    max_seq_length = 256
+    bert_config_path = os.path.join(model_path, "sentence_bert_config.json")
+    if os.path.exists(bert_config_path):
+        with open(bert_config_path) as f:
+            max_seq_length = json.load(f).get("max_seq_length") or max_seq_length
+    return mode, max_seq_length
+
+
+def export_onnx(model_path, output_dir, quantize=True, opset=14):
+    """
+    Export the transformer of a SentenceTransformer directory to ONNX, with int8 weights if quantize
+    Pooling and normalization run in NumPy at inference time
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    try:
+        import onnx  # torch.onnx.export needs it
+    except ImportError:
+        raise ImportError(f"Exporting to ONNX requires the onnx package; {MISSING_PACKAGES}")
+    if quantize and onnxruntime is None:
+        raise ImportError(f"Quantizing requires the onnxruntime package; {MISSING_PACKAGES}")
+
+    pooling, max_seq_length = read_pooling_config(model_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    transformer = AutoModel.from_pretrained(model_path).eval()
+    os.makedirs(output_dir, exist_ok=True)
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(*inputs)[0]
+
+    sample = tokenizer(SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    # Positional order of the Hugging Face forward() signature
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]}
+
+    model_file = os.path.join(output_dir, MODEL_FILE)
+    float_file = os.path.join(output_dir, "model-fp32.onnx") if quantize else model_file
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer),
+            tuple(sample[name] for name in input_names),
+            float_file,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(float_file, model_file, weight_type=QuantType.QInt8)
+        os.remove(float_file)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump({
+            "source": os.path.abspath(model_path),
+            "pooling": pooling,
+            "max_seq_length": max_seq_length,
+            "quantized": quantize
+        }, f, indent=2)
+    return model_file
+
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for the SentenceTransformer.encode calls made by api_service.py,
+    running an exported model on ONNX Runtime's CPU provider
+    """
+
+    def __init__(self, model_dir, num_threads=0):
+        if onnxruntime is None:
+            raise ImportError(f"MODEL_BACKEND=onnx requires the onnxruntime package; {MISSING_PACKAGES}")
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            config = json.load(f)
+        self.pooling = config["pooling"]
+        self.max_seq_length = config["max_seq_length"]
+        self.quantized = config.get("quantized", False)
+        if self.pooling not in POOLING_MODES:
+            raise ValueError(f"Unsupported pooling mode: {self.pooling}")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def get_sentence_embedding_dimension(self):
+        return self.session.get_outputs()[0].shape[-1]
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.pooling == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[..., None].astype(np.float32)
+        return (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = None
+        # Longest first, so each batch pads to similar lengths (as SentenceTransformer does)
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            tokens = self.tokenizer(
+                [sentences[i] for i in rows], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            feeds = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            pooled = self._pool(self.session.run(None, feeds)[0], tokens["attention_mask"])
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), pooled.shape[1]), dtype=np.float32)
+            embeddings[rows] = pooled
+
+        if embeddings is None:
+            embeddings = np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def parity_check(model_path, onnx_dir, texts, batch_size=32):
+    """
+    Cosine drift of the ONNX embeddings from the PyTorch ones, and the encode latency of both
+    pairwise_drift is the change of the text-to-text similarities the API actually returns
+    """
+    from sentence_transformers import SentenceTransformer
+
+    started = time.perf_counter()
+    reference_model = SentenceTransformer(model_path, device="cpu")
+    torch_load = time.perf_counter() - started
+    started = time.perf_counter()
+    onnx_model = OnnxEncoder(onnx_dir)
+    onnx_load = time.perf_counter() - started
+
+    timings = {}
+    embeddings = {}
+    for name, model in (("torch", reference_model), ("onnx", onnx_model)):
+        model.encode(texts[:batch_size], batch_size=batch_size)  # warmup
+        started = time.perf_counter()
+        embeddings[name] = np.asarray(
+            model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True),
+            dtype=np.float32
+        )
+        timings[name] = (time.perf_counter() - started) / len(texts)
+
+    reference, candidate = embeddings["torch"], embeddings["onnx"]
+    cosine = (reference * candidate).sum(axis=1)
+    pairwise_drift = np.abs(reference @ reference.T - candidate @ candidate.T)
+    return {
+        "texts": len(texts),
+        "cosine_mean": round(float(cosine.mean()), 6),
+        "cosine_min": round(float(cosine.min()), 6),
+        "pairwise_drift_mean": round(float(pairwise_drift.mean()), 6),
+        "pairwise_drift_max": round(float(pairwise_drift.max()), 6),
+        "torch_ms_per_text": round(timings["torch"] * 1000, 3),
+        "onnx_ms_per_text": round(timings["onnx"] * 1000, 3),
+        "torch_load_seconds": round(torch_load, 2),
+        "onnx_load_seconds": round(onnx_load, 2),
+        "torch_model_bytes": directory_size(model_path),
+        "onnx_model_bytes": directory_size(os.path.join(onnx_dir, MODEL_FILE))
+    }
+
+
+def read_texts(path):
+    if not path:
+        return SAMPLE_TEXTS
+    with open(path, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    if not texts:
+        raise ValueError(f"No texts in {path}")
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the sentence-transformer to int8 ONNX and check parity")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export and quantize, then run the parity check")
+    export.add_argument("--no-quantize", action="store_true", help="keep float32 weights")
+    export.add_argument("--output", default="./trained_model_onnx")
+    parity = commands.add_parser("parity", help="compare the embeddings of an exported model with PyTorch")
+    parity.add_argument("--onnx", default="./trained_model_onnx")
+    for command in (export, parity):
+        command.add_argument("--model", default="./trained_model")
+        command.add_argument("--texts", help="file with one text per line (default: built-in samples)")
+    args = parser.parse_args()
+
+    try:
+        texts = read_texts(args.texts)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    onnx_dir = args.onnx if args.command == "parity" else args.output
+    if args.command == "export":
+        started = time.time()
+        model_file = export_onnx(args.model, args.output, quantize=not args.no_quantize)
+        print(f"Exported {args.model} to {model_file} in {time.time() - started:.1f}s", file=sys.stderr)
+
+    print(json.dumps(parity_check(args.model, onnx_dir, texts), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# lostmatch-model-server/report_filter.py
+
+"""
+Report metadata and search filters
+
+Registered reports may carry a category, a report type (lost or found) and a
+date window (when the item was lost or found). A search filter names any of
+them; it is resolved to a boolean mask over the registered reports before any
+embedding is scored, so reports that could never be a match cost nothing.
+
+    metadata: {"category": "phone", "report_type": "lost", "date_from": "2024-05-01", "date_to": "2024-05-03"}
+    filter:   {"category": ["phone", "tablet"], "report_type": "found", "date_from": "2024-05-01"}
+
+A report matches a filter when its category and report type are among the
+filter's, and its date window overlaps the filter's. Reports without a
+category or type never match a filter on it; a missing date bound is open.
+
+This is a copy of rubust-image-matching-server/report_filter.py: each service
+is built and deployed from its own directory, so they cannot import one
+module. Keep the two in sync (tests/test_report_filter.py compares them).
+"""
+import json
+from datetime import date
+
+import numpy as np
+
+REPORT_TYPES = ("lost", "found")
+FIELDS = ("category", "report_type", "date_from", "date_to")
+
+# Open ends of a date window, as day numbers
+_NO_START = np.iinfo(np.int64).min
+_NO_END = np.iinfo(np.int64).max
+
+
+def _as_object(value, name):
+    """A JSON object given directly, or as a JSON string (multipart form fields)"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValueError(f"{name} must be a JSON object")
+    if not isinstance(value, dict):
+        raise ValueError(f"{name} must be a JSON object")
+    unknown = sorted(set(value) - set(FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown {name} fields: {', '.join(unknown)} (allowed: {', '.join(FIELDS)})")
+    return value
+
+
+def _day(value, field):
+    try:
+        return date.fromisoformat(str(value)).toordinal()
+    except ValueError:
+        raise ValueError(f"{field} must be a date formatted YYYY-MM-DD, got {value!r}")
+
+
+def _window(data, name):
+    start = _day(data["date_from"], "date_from") if data.get("date_from") else None
+    end = _day(data["date_to"], "date_to") if data.get("date_to") else None
+    if start is not None and end is not None and start > end:
+        raise ValueError(f"{name} date_from is after date_to")
+    return start, end
+
+
+def parse_metadata(value):
+    """
+    Validated metadata of one report, with only the fields that were given
+    Dates are kept as YYYY-MM-DD strings so they can be stored in JSON manifests
+    """
+    if value is None:
+        return None
+    data = _as_object(value, "metadata")
+    metadata = {}
+    if data.get("category") is not None:
+        if not isinstance(data["category"], str):
+            raise ValueError("metadata category must be a string")
+        metadata["category"] = data["category"].strip().lower()
+    if data.get("report_type") is not None:
+        if data["report_type"] not in REPORT_TYPES:
+            raise ValueError(f"report_type must be one of: {', '.join(REPORT_TYPES)}")
+        metadata["report_type"] = data["report_type"]
+    start, end = _window(data, "metadata")
+    if start is not None:
+        metadata["date_from"] = date.fromordinal(start).isoformat()
+    if end is not None:
+        metadata["date_to"] = date.fromordinal(end).isoformat()
+    return metadata or None
+
+
+class ReportFilter:
+    """Parsed search filter; None fields do not restrict"""
+
+    def __init__(self, categories=None, report_types=None, start=None, end=None):
+        self.categories = categories
+        self.report_types = report_types
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, value):
+        """ReportFilter of a request's filter object, None when it is absent or empty"""
+        if value is None or value == "":
+            return None
+        data = _as_object(value, "filter")
+
+        def names(field):
+            values = data.get(field)
+            if values is None:
+                return None
+            values = [values] if isinstance(values, str) else values
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"filter {field} must be a string or a list of strings")
+            return {v.strip().lower() if field == "category" else v for v in values}
+
+        report_types = names("report_type")
+        if report_types and not report_types <= set(REPORT_TYPES):
+            raise ValueError(f"report_type must be one of: {', '.join(REPORT_TYPES)}")
+        start, end = _window(data, "filter")
+        report_filter = cls(names("category"), report_types, start, end)
+        return None if report_filter.is_empty() else report_filter
+
+    def is_empty(self):
+        return self.categories is None and self.report_types is None and self.start is None and self.end is None
+
+
+class MetadataColumns:
+    """
+    Metadata of a list of reports stored as columns (category and type codes,
+    date windows as day numbers), so a filter resolves to a mask over the
+    reports with a few vectorized comparisons
+    """
+
+    def __init__(self, metadata):
+        self._categories = {}
+        self.category = np.empty(len(metadata), dtype=np.int32)
+        self.report_type = np.empty(len(metadata), dtype=np.int8)
+        self.start = np.empty(len(metadata), dtype=np.int64)
+        self.end = np.empty(len(metadata), dtype=np.int64)
+        for i, entry in enumerate(metadata):
+            entry = entry or {}
+            category = entry.get("category")
+            self.category[i] = -1 if category is None else self._categories.setdefault(category, len(self._categories))
+            report_type = entry.get("report_type")
+            self.report_type[i] = REPORT_TYPES.index(report_type) if report_type in REPORT_TYPES else -1
+            self.start[i] = _day(entry["date_from"], "date_from") if entry.get("date_from") else _NO_START
+            self.end[i] = _day(entry["date_to"], "date_to") if entry.get("date_to") else _NO_END
+
+    def mask(self, report_filter):
+        """Boolean mask of the reports matching report_filter"""
+        mask = np.ones(len(self.category), dtype=bool)
+        if report_filter.categories is not None:
+            codes = [self._categories[c] for c in report_filter.categories if c in self._categories]
+            mask &= np.isin(self.category, codes)
+        if report_filter.report_types is not None:
+            mask &= np.isin(self.report_type, [REPORT_TYPES.index(t) for t in report_filter.report_types])
+        # Windows overlap unless one ends before the other starts
+        if report_filter.start is not None:
+            mask &= self.end >= report_filter.start
+        if report_filter.end is not None:
+            mask &= self.start <= report_filter.end
+        return mask
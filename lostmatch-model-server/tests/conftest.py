@@ -0,0 +1,12 @@
+# lostmatch-model-server/tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# The server modules are flat files next to api_service.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing api_service opens its embedding store and loads the model: keep the store out of the
+# working tree and load in the background, so a missing model only marks the service as failed
+os.environ.setdefault("EMBEDDING_STORE_DIR", tempfile.mkdtemp(prefix="embedding_store-"))
+os.environ.setdefault("MODEL_LOAD_MODE", "background")
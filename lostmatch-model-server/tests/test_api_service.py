@@ -0,0 +1,81 @@
+# lostmatch-model-server/tests/test_api_service.py
+
+import numpy as np
+import pytest
+
+import api_service
+from embedding_store import EmbeddingStore
+
+DIM = 8
+
+
+def fake_embeddings(texts):
+    """Deterministic unit vectors standing in for the model"""
+    vectors = np.stack([np.random.default_rng(sum(map(ord, text))).normal(size=DIM) for text in texts])
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    encoded = []
+
+    def encode_texts(texts):
+        encoded.append(list(texts))
+        return fake_embeddings(texts)
+
+    store = EmbeddingStore(str(tmp_path / "store"), dtype="float32")
+    texts = ["black wallet", "red backpack", "car keys", "blue umbrella"]
+    store.upsert([f"report-{i}" for i in range(len(texts))], fake_embeddings(texts))
+    monkeypatch.setattr(api_service, "embedding_store", store)
+    monkeypatch.setattr(api_service, "encode_texts", encode_texts)
+    monkeypatch.setitem(api_service.model_state, "status", "ready")
+    test_client = api_service.app.test_client()
+    test_client.encoded = encoded
+    return test_client
+
+
+@pytest.mark.parametrize("top_k", [0, -1, "ten", True, [3]])
+def test_search_similar_rejects_bad_top_k(client, top_k):
+    response = client.post("/search_similar", json={"description": "black wallet", "top_k": top_k})
+    assert response.status_code == 400
+    assert "top_k" in response.get_json()["error"]
+    # Rejected before the description is encoded
+    assert client.encoded == []
+
+
+def test_search_similar(client):
+    response = client.post("/search_similar", json={"description": "car keys", "top_k": "2"})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results) == 2
+    assert results[0]["id"] == "report-2"
+
+
+def test_store_search_rejects_top_k_below_one(tmp_path):
+    store = EmbeddingStore(str(tmp_path), dtype="float32")
+    store.upsert(["a", "b"], fake_embeddings(["a", "b"]))
+    with pytest.raises(ValueError, match="top_k must be at least 1"):
+        store.search(fake_embeddings(["a"])[0], top_k=-1)
+
+
+@pytest.mark.parametrize("top_k", [0, -1, "ten", True])
+@pytest.mark.parametrize("candidates", [{"candidates": ["red backpack", "car keys"]},
+                                        {"candidate_ids": ["report-1", "report-2"]}])
+def test_compare_items_batch_rejects_bad_top_k(client, candidates, top_k):
+    response = client.post("/compare_items_batch", json=dict(candidates, description="car keys", top_k=top_k))
+    assert response.status_code == 400
+    assert "top_k" in response.get_json()["error"]
+    assert client.encoded == []
+
+
+@pytest.mark.parametrize("candidates", [{"candidates": ["red backpack", "car keys", "black wallet"]},
+                                        {"candidate_ids": ["report-1", "report-2", "report-0"]}])
+def test_compare_items_batch_ranks_top_k(client, candidates):
+    response = client.post("/compare_items_batch", json=dict(candidates, description="car keys", top_k=2))
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["count"] == 3
+    assert len(body["ranked"]) == 2
+    assert body["ranked"][0]["similarity"] == max(r["similarity"] for r in body["results"])
+    response = client.post("/compare_items_batch", json=dict(candidates, description="car keys"))
+    assert "ranked" not in response.get_json()
@@ -0,0 +1,72 @@
+# lostmatch-model-server/tests/test_cross_match.py
+
+import json
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import cross_match
+from embedding_store import EmbeddingStore
+from report_filter import ReportFilter
+
+
+def brute_force(matrix, query_rows, candidate_rows, top_k):
+    """Candidate rows of each query row sorted by similarity, itself excluded, top_k at most"""
+    expected = []
+    for query_row in query_rows:
+        rows = [row for row in candidate_rows if row != query_row]
+        rows.sort(key=lambda row: -float(matrix[query_row] @ matrix[row]))
+        expected.append(rows[:top_k])
+    return expected
+
+
+@pytest.mark.parametrize("candidates, top_k, block_rows", [
+    (50, 5, 16),
+    (50, 10, 3),   # candidate blocks narrower than top_k
+    (4, 10, 16),   # fewer candidates than top_k
+    (7, 10, 2),
+    (1, 3, 1),
+])
+def test_top_candidates(candidates, top_k, block_rows):
+    matrix = np.random.default_rng(candidates).normal(size=(60, 8)).astype(np.float32)
+    query_rows = np.arange(0, 60, 7)
+    # Some queries are candidates too and must not match themselves
+    candidate_rows = np.arange(0, 60, 60 // candidates)[:candidates]
+
+    rows, similarities = cross_match.top_candidates(matrix, query_rows, candidate_rows, top_k, block_rows)
+    assert rows.shape == similarities.shape == (len(query_rows), min(top_k, candidates))
+    for i, expected in enumerate(brute_force(matrix, query_rows, candidate_rows, top_k)):
+        assert rows[i][similarities[i] > -np.inf].tolist() == expected
+
+
+def test_cross_match(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(30, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"report-{i}" for i in range(30)]
+    metadata = [{"report_type": "lost" if i < 10 else "found"} for i in range(30)]
+    store = EmbeddingStore(str(tmp_path / "store"), dtype="float32")
+    store.upsert(ids, vectors, metadata)
+
+    output = str(tmp_path / "text.jsonl")
+    total, _ = cross_match.cross_match(
+        store, output, ReportFilter.parse({"report_type": "lost"}), ReportFilter.parse({"report_type": "found"}),
+        top_k=8, workers=2, query_block_rows=3, candidate_block_rows=5
+    )
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+    assert total == 10
+    assert [line["id"] for line in lines] == ids[:10]
+    for line, expected in zip(lines, brute_force(vectors, range(10), range(10, 30), 8)):
+        assert [candidate["id"] for candidate in line["candidates"]] == [ids[row] for row in expected]
+
+
+def test_cli_rejects_block_rows_below_one(tmp_path):
+    result = subprocess.run(
+        [sys.executable, cross_match.__file__, "--store", str(tmp_path), "--output", str(tmp_path / "out"),
+         "--candidate-block-rows", "0"],
+        capture_output=True, text=True
+    )
+    assert result.returncode == 2
+    assert "--candidate-block-rows must be at least 1" in result.stderr
@@ -0,0 +1,91 @@
+# lostmatch-model-server/tests/test_embedding_store.py
+
+import os
+
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+from report_filter import ReportFilter
+
+DIM = 8
+
+
+def embeddings(seed, rows):
+    vectors = np.random.default_rng(seed).normal(size=(rows, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def open_store(directory, dtype="float32"):
+    # Background compaction never triggers; the tests call compact() themselves
+    return EmbeddingStore(str(directory), dtype=dtype, compact_dead_fraction=2.0)
+
+
+def ids(first, last):
+    return [f"report-{i}" for i in range(first, last)]
+
+
+@pytest.mark.parametrize("dtype", ["float16", "float32"])
+def test_capacity_grows_and_rows_survive_a_reload(tmp_path, dtype):
+    store = open_store(tmp_path, dtype)
+    vectors = embeddings(0, 2500)
+    for start in range(0, 2500, 500):
+        store.upsert(ids(start, start + 500), vectors[start:start + 500])
+        assert store.stats()["capacity"] >= start + 500
+    assert store.stats()["capacity"] == 4096
+    tolerance = 1e-3 if dtype == "float16" else 0
+    np.testing.assert_allclose(store.get(["report-0", "report-1800"]), vectors[[0, 1800]], atol=tolerance)
+
+    reopened = open_store(tmp_path, dtype)
+    assert len(reopened) == 2500
+    assert reopened.stats()["dtype"] == dtype
+    np.testing.assert_allclose(reopened.get(ids(1020, 1030)), vectors[1020:1030], atol=tolerance)
+    assert reopened.search(vectors[2499], top_k=1)[0]["id"] == "report-2499"
+
+
+def test_removed_and_replaced_rows_are_tombstones(tmp_path):
+    store = open_store(tmp_path)
+    vectors = embeddings(1, 20)
+    store.upsert(ids(0, 20), vectors)
+    assert store.remove("report-3")
+    assert not store.remove("report-3")
+    replacement = embeddings(2, 1)
+    store.upsert(["report-5"], replacement)
+
+    assert store.stats() == dict(store.stats(), count=19, rows=21, tombstones=2)
+    assert "report-3" not in store
+    assert "report-3" not in [r["id"] for r in store.search(vectors[3], top_k=20)]
+    assert store.search(replacement[0], top_k=1)[0]["id"] == "report-5"
+    with pytest.raises(KeyError):
+        store.get(["report-3"])
+
+    reopened = open_store(tmp_path)
+    assert reopened.stats()["tombstones"] == 2
+    assert "report-3" not in reopened
+    np.testing.assert_allclose(reopened.get(["report-5"]), replacement)
+
+
+def test_compact_drops_tombstones(tmp_path):
+    store = open_store(tmp_path)
+    vectors = embeddings(3, 40)
+    store.upsert(ids(0, 40), vectors, [{"report_type": "lost" if i % 2 else "found"} for i in range(40)])
+    assert store.compact(min_dead_fraction=0.3) == 0
+    for i in range(0, 40, 3):
+        store.remove(f"report-{i}")
+    query = embeddings(4, 1)[0]
+    before = store.search(query, top_k=5)
+
+    assert store.compact(min_dead_fraction=0.3) == 14
+    assert store.stats() == dict(store.stats(), count=26, rows=26, tombstones=0, compactions=1)
+    assert store.search(query, top_k=5) == before
+    np.testing.assert_allclose(store.get(["report-1", "report-38"]), vectors[[1, 38]])
+    assert sorted(os.listdir(tmp_path)) == [".lock", "embeddings-1.bin", "manifest.json"]
+
+    lost = ReportFilter.parse({"report_type": "lost"})
+    _, row_ids, rows = store.select(lost)
+    assert sorted(row_ids[row] for row in rows) == sorted(f"report-{i}" for i in range(1, 40, 2) if i % 3)
+
+    reopened = open_store(tmp_path)
+    assert len(reopened) == 26
+    assert reopened.search(query, top_k=5) == before
+    assert {r["id"] for r in reopened.search(query, top_k=26, report_filter=lost)} == {row_ids[row] for row in rows}
@@ -0,0 +1,11 @@
+# lostmatch-model-server/tests/test_onnx_backend.py
+
+import pytest
+
+import onnx_backend
+
+
+def test_missing_onnxruntime_names_the_requirements_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(onnx_backend, "onnxruntime", None)
+    with pytest.raises(ImportError, match="pip install -r requirements-onnx.txt"):
+        onnx_backend.OnnxEncoder(str(tmp_path))
@@ -0,0 +1,70 @@
+# lostmatch-model-server/tests/test_report_filter.py
+
+import importlib.util
+import os
+
+import pytest
+
+import report_filter
+
+IMAGE_SERVER_COPY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "rubust-image-matching-server", "report_filter.py"
+)
+
+METADATA = [
+    {"category": "phone", "report_type": "lost", "date_from": "2024-05-01", "date_to": "2024-05-02"},
+    {"category": "Phone ", "report_type": "found", "date_from": "2024-05-04"},
+    {"category": "bag", "report_type": "found", "date_to": "2024-04-30"},
+    None,
+    {"report_type": "stolen"},
+    {"colour": "red"},
+    {"date_from": "2024-05-03", "date_to": "2024-05-01"},
+    "not json",
+]
+
+FILTERS = [
+    None,
+    "",
+    {"category": "phone"},
+    {"category": ["phone", "bag"], "report_type": "found"},
+    {"date_from": "2024-05-02"},
+    '{"date_to": "2024-05-01"}',
+    {"category": ["phone", 3]},
+    {"report_type": ["lost", "stolen"]},
+    {"owner": "me"},
+    {"date_to": "yesterday"},
+]
+
+
+@pytest.fixture(scope="module")
+def image_server_copy():
+    if not os.path.exists(IMAGE_SERVER_COPY):
+        pytest.skip("rubust-image-matching-server is not checked out next to this service")
+    spec = importlib.util.spec_from_file_location("image_server_report_filter", IMAGE_SERVER_COPY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def outcome(function, value):
+    try:
+        return function(value)
+    except ValueError as e:
+        return f"ValueError: {e}"
+
+
+def test_same_behaviour_as_the_image_server_copy(image_server_copy):
+    for value in METADATA:
+        assert outcome(report_filter.parse_metadata, value) == outcome(image_server_copy.parse_metadata, value)
+
+    valid = [report_filter.parse_metadata(m) for m in METADATA[:4]]
+    columns = report_filter.MetadataColumns(valid)
+    image_server_columns = image_server_copy.MetadataColumns(valid)
+    for value in FILTERS:
+        parsed = outcome(report_filter.ReportFilter.parse, value)
+        expected = outcome(image_server_copy.ReportFilter.parse, value)
+        if isinstance(parsed, str) or parsed is None:
+            assert parsed == expected
+        else:
+            assert vars(parsed) == vars(expected)
+            assert columns.mask(parsed).tolist() == image_server_columns.mask(expected).tolist()
@@ -1,222 +1,608 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import cv2
 import numpy as np
 import base64
 import os
-import tempfile
 import json
+import time
 from werkzeug.utils import secure_filename
-import uuid
+from werkzeug.wsgi import get_input_stream
 from datetime import datetime
+from bulk_ingest import bounded_map, iter_multipart_images, iter_tar_images
+from feature_cache import LRUCache, content_hash, raw_features_size
+from gallery import DescriptorGallery
+from report_filter import ReportFilter, parse_metadata
+from geometric_verification import MIN_MATCHES, verify_matches
+from global_signature import codebook_id, load_codebook, vlad_signature
+from descriptor_codec import RAW_FORMAT, DescriptorCodec, parse_format, storage_dtype
+from extraction_pool import ExtractionPool, PoolSaturated, compute_features
+from extractors import EXTRACTORS, extractor_for_format, get_extractor
+from image_io import read_image_bytes
+import metrics
+from vector_matching import good_match_counts, good_match_pairs
+import wire_format
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration - Reduced limits for memory efficiency
 app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024  # Reduced to 8MB max file size
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 
-# Create upload directory
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Feature extractor: 'sift', or the cheaper binary 'orb' / 'akaze' matched by Hamming distance
+# (see extractors.py; its detector parameters are part of the feature cache key)
+EXTRACTOR = os.environ.get('EXTRACTOR', 'sift')
+extractor = get_extractor(EXTRACTOR)
+MAX_DIMENSION = 1024
+
+# Descriptor storage: raw SIFT ('sift') or RootSIFT + PCA ('rootsift-pca-f16', 'rootsift-pca-u8')
+# with the projection trained offline by descriptor_codec.py
+DESCRIPTOR_FORMAT = os.environ.get('DESCRIPTOR_FORMAT', 'sift')
+PCA_PATH = os.environ.get('PCA_PATH', 'pca.npz')
+if DESCRIPTOR_FORMAT == 'sift':
+    codec = None
+elif DESCRIPTOR_FORMAT in ('rootsift-pca-f16', 'rootsift-pca-u8'):
+    codec = DescriptorCodec.load(PCA_PATH, DESCRIPTOR_FORMAT.rsplit('-', 1)[1])
+else:
+    raise ValueError(f'Unknown DESCRIPTOR_FORMAT: {DESCRIPTOR_FORMAT}')
+if codec is not None and extractor.name != 'sift':
+    raise ValueError(f'DESCRIPTOR_FORMAT={DESCRIPTOR_FORMAT} compresses SIFT descriptors, not {extractor.name}')
+STORED_FORMAT = codec.format if codec is not None else extractor.format
+
+# Caches for repeated extractions (by image bytes) and comparisons (by descriptor hashes)
+feature_cache = LRUCache(
+    max_entries=int(os.environ.get('FEATURE_CACHE_ENTRIES', 2048)),
+    max_bytes=int(os.environ.get('FEATURE_CACHE_MB', 64)) * 1024 * 1024,
+    sizeof=raw_features_size
+)
+pair_cache = LRUCache(max_entries=int(os.environ.get('PAIR_CACHE_ENTRIES', 16384)))
+
+# Optional process pool for decode + detection; 0 workers extracts in the request thread
+EXTRACTION_POOL_WORKERS = int(os.environ.get('EXTRACTION_POOL_WORKERS', 0))
+extraction_pool = None
+if EXTRACTION_POOL_WORKERS > 0:
+    extraction_pool = ExtractionPool(
+        workers=EXTRACTION_POOL_WORKERS,
+        queue_depth=int(os.environ.get('EXTRACTION_QUEUE_DEPTH', 2 * EXTRACTION_POOL_WORKERS)),
+        timeout=float(os.environ.get('EXTRACTION_TIMEOUT', 60)),
+        detector=extractor.detector,
+        params=extractor.params
+    )
+
+# /extract-features/bulk: images extracted concurrently per request, and the limit of its streamed
+# body (each image is still limited to MAX_CONTENT_LENGTH)
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', EXTRACTION_POOL_WORKERS or 2))
+BULK_MAX_CONTENT_LENGTH = int(os.environ.get('BULK_MAX_MB', 2048)) * 1024 * 1024
+TAR_MIMETYPES = {'application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-gtar'}
+
+# Optional VLAD codebook for global signatures and the /match-candidates shortlist
+# (trained offline with global_signature.py, SIFT only)
+CODEBOOK_PATH = os.environ.get('CODEBOOK_PATH', 'codebook.npy')
+codebook = load_codebook(CODEBOOK_PATH) if extractor.name == 'sift' else None
+CODEBOOK_ID = codebook_id(codebook) if codebook is not None else None
+
+# Optional RANSAC verification of ratio-test matches ('homography' or 'fundamental')
+# Candidates with fewer than VERIFY_MIN_MATCHES good matches are rejected before RANSAC,
+# and a verified match needs at least VERIFY_MIN_INLIERS inliers
+VERIFY_MODEL = os.environ.get('VERIFY_MODEL', 'homography')
+VERIFY_MIN_MATCHES = int(os.environ.get('VERIFY_MIN_MATCHES', 10))
+VERIFY_MIN_INLIERS = int(os.environ.get('VERIFY_MIN_INLIERS', 12))
+if VERIFY_MODEL not in MIN_MATCHES:
+    raise ValueError(f'Unknown VERIFY_MODEL: {VERIFY_MODEL}')
+
+# Server-side descriptor gallery for /search, memory-mapped from GALLERY_FOLDER by every worker
+# GALLERY_SEARCH: 'flann' (per-worker FLANN indexes) or 'exact' (scans the shared mapping, no private copy)
+# Deleted reports are masked until their segment's deleted share reaches GALLERY_COMPACT_DEAD_FRACTION,
+# then the segment is compacted in the background
+GALLERY_FOLDER = os.environ.get('GALLERY_FOLDER', 'gallery')
+gallery = DescriptorGallery(
+    GALLERY_FOLDER,
+    dim=codec.dim if codec is not None else extractor.dim,
+    descriptor_format=STORED_FORMAT,
+    norm=extractor.norm,
+    search=os.environ.get('GALLERY_SEARCH', 'flann'),
+    compact_dead_fraction=float(os.environ.get('GALLERY_COMPACT_DEAD_FRACTION', 0.3))
+)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_sift_features(image_path):
+def pool_saturated_response(e):
+    """Fast 503 when the extraction pool queue is full, so clients can retry elsewhere"""
+    response = jsonify({
+        'success': False,
+        'error': str(e)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def detect_sift_features(image):
     """
-    Extract SIFT features from an image with memory optimization
-    Returns keypoints and descriptors in a serializable format
+    Extract features from an image with the configured extractor (SIFT by default)
+    image: encoded image bytes, a file-like object or a file path
+    Returns keypoints as an (n, 4) float32 array of x, y, size, angle and the raw descriptors
     """
-    import gc
     try:
-        # Read image with reduced size to save memory
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            raise ValueError("Could not load image")
-        
-        # Resize large images to reduce memory usage
-        max_dimension = 1024
-        if max(img.shape) > max_dimension:
-            scale = max_dimension / max(img.shape)
-            new_width = int(img.shape[1] * scale)
-            new_height = int(img.shape[0] * scale)
-            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-        
-        # Initialize SIFT detector with reduced features
-        sift = cv2.SIFT_create(nfeatures=200, contrastThreshold=0.08)  # Further reduced features
-        
-        # Detect keypoints and compute descriptors
-        keypoints, descriptors = sift.detectAndCompute(img, None)
-        
-        # Clear image from memory immediately
-        img = None
-        gc.collect()
-        
-        if descriptors is None or len(keypoints) == 0:
-            return {
-                'keypoints_count': 0,
-                'keypoints': [],
-                'descriptors': None,
-                'image_shape': (0, 0)
-            }
-        
-        # Only store essential keypoint data (reduce memory)
-        keypoints_data = []
-        for kp in keypoints[:200]:  # Limit to 200 keypoints max
-            keypoints_data.append({
-                'x': float(kp.pt[0]),
-                'y': float(kp.pt[1]),
-                'size': float(kp.size),
-                'angle': float(kp.angle)
-            })
-        
-        # Limit descriptors to match keypoints
-        if len(descriptors) > 200:
-            descriptors = descriptors[:200]
-        
-        # Convert descriptors to base64 for JSON serialization
-        descriptors_b64 = base64.b64encode(descriptors.tobytes()).decode('utf-8')
-        
-        result = {
-            'keypoints_count': len(keypoints_data),
-            'keypoints': keypoints_data,
-            'descriptors': descriptors_b64,
-            'descriptors_shape': descriptors.shape,
-            'image_shape': img.shape if img is not None else (0, 0)
-        }
+        image_data = read_image_bytes(image)
+        cache_key = content_hash(
+            image_data,
+            f'{extractor.cache_key()}:{MAX_DIMENSION}:{CODEBOOK_ID}:{STORED_FORMAT}'
+        )
+        cached = feature_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        if extraction_pool is not None:
+            # Decode + detection run in a pool process holding its own detector instance
+            result = extraction_pool.extract(image_data, MAX_DIMENSION, extractor.max_keypoints)
+        else:
+            # Decode in memory; large JPEGs are decoded at reduced resolution
+            # and everything is resized to max 1024px to reduce memory usage
+            result = compute_features(image_data, extractor.create(), MAX_DIMENSION, extractor.max_keypoints)
+        image_data = None
+        
+        if codebook is not None and result['descriptors'] is not None:
+            with metrics.timed('signature'):
+                result['global_signature'] = vlad_signature(result['descriptors'], codebook)
+        
+        if codec is not None and result['descriptors'] is not None:
+            with metrics.timed('compress'):
+                result['descriptors'] = codec.encode(result['descriptors'])
+        result['descriptor_format'] = STORED_FORMAT
         
-        # Clean up
-        keypoints = None
-        descriptors = None
-        keypoints_data = None
-        gc.collect()
+        result['keypoints'].flags.writeable = False
+        if result['descriptors'] is not None:
+            result['descriptors'].flags.writeable = False
         
+        feature_cache.put(cache_key, result)
         return result
         
+    except PoolSaturated:
+        raise
     except Exception as e:
-        # Force cleanup on error
-        gc.collect()
         raise Exception(f"Feature extraction failed: {str(e)}")
 
-def compare_features(features1, features2, ratio_threshold=0.7):
+def features_to_json(raw_features):
     """
-    Compare two sets of SIFT features with memory optimization
+    Convert detect_sift_features output to the JSON-serializable format stored by clients
+    """
+    descriptors = raw_features['descriptors']
+    if descriptors is None:
+        return {
+            'keypoints_count': 0,
+            'keypoints': [],
+            'descriptors': None,
+            'image_shape': (0, 0)
+        }
+    
+    keypoints_data = [
+        {'x': float(x), 'y': float(y), 'size': float(size), 'angle': float(angle)}
+        for x, y, size, angle in raw_features['keypoints'].tolist()
+    ]
+    
+    # Convert descriptors to base64 for JSON serialization
+    features = {
+        'keypoints_count': len(keypoints_data),
+        'keypoints': keypoints_data,
+        'descriptors': base64.b64encode(descriptors.tobytes()).decode('utf-8'),
+        'descriptors_shape': descriptors.shape,
+        'descriptor_format': raw_features.get('descriptor_format', RAW_FORMAT),
+        'image_shape': raw_features['image_shape']
+    }
+    if raw_features.get('global_signature') is not None:
+        # float16 halves the stored size; the shortlist only needs the ranking order
+        signature = raw_features['global_signature'].astype(np.float16)
+        features['global_signature'] = base64.b64encode(signature.tobytes()).decode('utf-8')
+        features['signature_codebook'] = CODEBOOK_ID
+    return features
+
+def extract_sift_features(image):
+    """
+    Extract SIFT features from an image (bytes, file-like object or path)
+    Returns keypoints and descriptors in a serializable format
+    """
+    raw_features = detect_sift_features(image)
+    with metrics.timed('serialize'):
+        return features_to_json(raw_features)
+
+def _empty_comparison():
+    return {
+        'similarity_score': 0.0,
+        'good_matches': 0,
+        'total_matches': 0,
+        'match_ratio': 0.0,
+        'confidence': 'low'
+    }
+
+def has_descriptors(features):
+    """
+    True if a feature set (JSON or binary wire format) carries descriptors
+    """
+    descriptors = features.get('descriptors')
+    if isinstance(descriptors, np.ndarray):
+        return descriptors.size > 0
+    return bool(descriptors)
+
+def descriptor_format_of(features):
+    """
+    descriptor_format tag of a feature set; features stored before the tag existed are raw SIFT
+    """
+    return features.get('descriptor_format') or RAW_FORMAT
+
+def decode_descriptors(features, name='features'):
+    """
+    Decode the base64 descriptors of a feature set into a float32 array
+    Binary wire-format features already hold an array and are not copied
+    Compressed descriptors are dequantized into the PCA space they are matched in
+    Returns None when the feature set has no descriptors
+    """
+    if not has_descriptors(features):
+        return None
+    
+    descriptor_format = descriptor_format_of(features)
+    if isinstance(features['descriptors'], np.ndarray):
+        stored = features['descriptors']
+    else:
+        shape = tuple(features['descriptors_shape'])
+        dtype = storage_dtype(descriptor_format)
+        with metrics.timed('base64_decode'):
+            desc_bytes = base64.b64decode(features['descriptors'])
+        
+        # Validate byte length matches expected shape
+        expected_size = int(np.prod(shape)) * dtype.itemsize
+        if len(desc_bytes) != expected_size:
+            raise Exception(f"{name} descriptor byte size mismatch: got {len(desc_bytes)}, expected {expected_size}")
+        stored = np.frombuffer(desc_bytes, dtype=dtype).reshape(shape)
+    
+    if codec is not None and descriptor_format == codec.format:
+        return codec.decode(stored)
+    if parse_format(descriptor_format)[0] in EXTRACTORS:
+        return stored
+    raise ValueError(f'{name} descriptors use format {descriptor_format}, this server uses {STORED_FORMAT}')
+
+def comparison_result(good_match_count, features1_count, features2_count):
+    """
+    Build the compare_features response fields from a ratio-test match count
+    """
+    # One nearest-neighbour pair per query descriptor, as knnMatch(k=2) returns
+    total_matches = features1_count
+    match_ratio = good_match_count / max(features1_count, features2_count) if max(features1_count, features2_count) > 0 else 0
+    
+    # Calculate similarity score (0-100) with more conservative scoring
+    similarity_score = min(100, match_ratio * 80)  # Reduced multiplier
+    
+    # Determine confidence level
+    if good_match_count < 5:
+        confidence = 'low'
+    elif good_match_count < 15:
+        confidence = 'medium'
+    else:
+        confidence = 'high'
+    
+    return {
+        'similarity_score': round(similarity_score, 2),
+        'good_matches': int(good_match_count),
+        'total_matches': total_matches,
+        'match_ratio': round(match_ratio, 4),
+        'confidence': confidence,
+        'features1_count': features1_count,
+        'features2_count': features2_count
+    }
+
+def matching_spec(features, ratio_threshold=None):
+    """
+    Extractor registry entry whose norm and thresholds match a feature set's descriptors,
+    and the ratio threshold to use (the extractor's default unless one is given)
+    """
+    spec = extractor_for_format(descriptor_format_of(features))
+    return spec, ratio_threshold or spec.ratio_threshold
+
+def score_descriptors(desc1, desc2, ratio_threshold=0.7, spec=extractor):
+    """
+    Score two decoded descriptor arrays with the vectorized ratio test
+    """
+    if len(desc1) < 2 or len(desc2) < 2:
+        return _empty_comparison()
+    
+    good_match_count = good_match_counts(desc1, [desc2], ratio_threshold, spec.norm, spec.max_distance)[0]
+    return comparison_result(good_match_count, len(desc1), len(desc2))
+
+def descriptor_mismatch_error(features1, features2):
+    """
+    Return an error message if two feature sets cannot be matched
+    """
+    format1 = descriptor_format_of(features1)
+    format2 = descriptor_format_of(features2)
+    if format1 != format2:
+        return f'Descriptor format mismatch: {format1} vs {format2}. Features were extracted with different descriptor settings.'
+    shape1 = features1['descriptors_shape']
+    shape2 = features2['descriptors_shape']
+    if len(shape1) != len(shape2) or (len(shape1) > 1 and shape1[1] != shape2[1]):
+        return f'Descriptor dimension mismatch: {shape1} vs {shape2}. Features were likely extracted using different algorithms.'
+    return None
+
+def keypoint_points(features, rows):
+    """
+    (rows, 2) keypoint coordinates aligned with the descriptor rows, None if unavailable
+    """
+    keypoints = features.get('keypoints')
+    if keypoints is None or len(keypoints) != rows:
+        return None
+    return wire_format.keypoints_to_array(keypoints)[:, :2]
+
+def verify_descriptors(features1, desc1, features2, desc2, ratio_threshold=0.7, model=VERIFY_MODEL,
+                       spec=extractor):
+    """
+    Fit a geometric model with RANSAC to the ratio-test matches of two decoded feature sets
+    Returns the verification fields added to a comparison result
+    """
+    points1 = keypoint_points(features1, len(desc1))
+    points2 = keypoint_points(features2, len(desc2))
+    if points1 is None or points2 is None:
+        return {'verification': 'skipped'}
+    
+    rows1, rows2 = good_match_pairs(desc1, desc2, ratio_threshold, spec.norm, spec.max_distance)
+    inliers, found = verify_matches(points1[rows1], points2[rows2], model)
+    inlier_ratio = inliers / len(rows1) if len(rows1) > 0 else 0
+    # Same scale as similarity_score, counting only the geometrically consistent matches
+    verified_score = min(100, inliers / max(len(desc1), len(desc2)) * 80)
+    return {
+        'verification': 'verified' if found and inliers >= VERIFY_MIN_INLIERS else 'failed',
+        'verification_model': model,
+        'inlier_matches': inliers,
+        'inlier_ratio': round(inlier_ratio, 4),
+        'verified_score': round(verified_score, 2)
+    }
+
+def add_verification(comparison, features1, desc1, features2, desc2, ratio_threshold=0.7,
+                     model=VERIFY_MODEL, pair_key=None, spec=extractor):
+    """
+    Second stage of the comparison cascade: RANSAC, unless too few matches survived the ratio test
+    """
+    if comparison['good_matches'] < VERIFY_MIN_MATCHES:
+        comparison['verification'] = 'rejected'
+        return comparison
+    
+    verify_key = pair_key + (model,) if pair_key is not None else None
+    fields = pair_cache.get(verify_key) if verify_key is not None else None
+    if fields is None:
+        fields = verify_descriptors(features1, desc1, features2, desc2, ratio_threshold, model, spec)
+        if verify_key is not None:
+            pair_cache.put(verify_key, fields)
+    comparison.update(fields)
+    return comparison
+
+def compare_features(features1, features2, ratio_threshold=None, verify=False, verify_model=VERIFY_MODEL):
+    """
+    Compare two sets of features with memory optimization
+    ratio_threshold defaults to the one of the extractor the descriptors come from
+    With verify, matches are also checked for geometric consistency with RANSAC
     """
-    import gc
     try:
         # Check for valid descriptors
-        if not features1.get('descriptors') or not features2.get('descriptors'):
-            return {
-                'similarity_score': 0.0,
-                'good_matches': 0,
-                'total_matches': 0,
-                'match_ratio': 0.0,
-                'confidence': 'low'
-            }
-        
-        # Validate descriptor shapes
-        shape1 = features1['descriptors_shape']
-        shape2 = features2['descriptors_shape']
+        if not has_descriptors(features1) or not has_descriptors(features2):
+            return _empty_comparison()
         
         # Check if descriptor dimensions match
-        if len(shape1) != len(shape2) or (len(shape1) > 1 and shape1[1] != shape2[1]):
-            return {
-                'similarity_score': 0.0,
-                'good_matches': 0,
-                'total_matches': 0,
-                'match_ratio': 0.0,
-                'confidence': 'low',
-                'error': f'Descriptor dimension mismatch: {shape1} vs {shape2}. Features were likely extracted using different algorithms.'
-            }
-        
-        # Decode descriptors from base64
-        desc1_bytes = base64.b64decode(features1['descriptors'])
-        desc2_bytes = base64.b64decode(features2['descriptors'])
+        mismatch = descriptor_mismatch_error(features1, features2)
+        if mismatch:
+            result = _empty_comparison()
+            result['error'] = mismatch
+            return result
         
-        # Validate byte length matches expected shape
-        expected_size1 = np.prod(shape1) * 4  # 4 bytes per float32
-        expected_size2 = np.prod(shape2) * 4
-        
-        if len(desc1_bytes) != expected_size1:
-            raise Exception(f"Descriptor 1 byte size mismatch: got {len(desc1_bytes)}, expected {expected_size1}")
-        if len(desc2_bytes) != expected_size2:
-            raise Exception(f"Descriptor 2 byte size mismatch: got {len(desc2_bytes)}, expected {expected_size2}")
+        spec, ratio_threshold = matching_spec(features1, ratio_threshold)
         
         # Reconstruct descriptor arrays
-        desc1 = np.frombuffer(desc1_bytes, dtype=np.float32).reshape(shape1)
-        desc2 = np.frombuffer(desc2_bytes, dtype=np.float32).reshape(shape2)
-        
-        # Clear base64 data from memory
-        desc1_bytes = None
-        desc2_bytes = None
-        gc.collect()
-        
-        if len(desc1) < 2 or len(desc2) < 2:
-            return {
-                'similarity_score': 0.0,
-                'good_matches': 0,
-                'total_matches': 0,
-                'match_ratio': 0.0,
-                'confidence': 'low'
-            }
-        
-        # Use BruteForce matcher instead of FLANN for better memory efficiency
-        matcher = cv2.BFMatcher()
-        
-        # Find matches with reduced k value
-        matches = matcher.knnMatch(desc1, desc2, k=2)
-        
-        # Apply Lowe's ratio test
-        good_matches = []
-        for match_pair in matches:
-            if len(match_pair) == 2:
-                m, n = match_pair
-                if m.distance < ratio_threshold * n.distance:
-                    good_matches.append(m)
-        
-        # Calculate similarity metrics
-        total_matches = len(matches)
-        good_match_count = len(good_matches)
-        match_ratio = good_match_count / max(len(desc1), len(desc2)) if max(len(desc1), len(desc2)) > 0 else 0
-        
-        # Calculate similarity score (0-100) with more conservative scoring
-        similarity_score = min(100, match_ratio * 80)  # Reduced multiplier
-        
-        # Determine confidence level
-        if good_match_count < 5:
-            confidence = 'low'
-        elif good_match_count < 15:
-            confidence = 'medium'
+        desc1 = decode_descriptors(features1, 'Descriptor 1')
+        desc2 = decode_descriptors(features2, 'Descriptor 2')
+        
+        pair_key = None
+        if pair_cache.enabled:
+            pair_key = (content_hash(desc1), content_hash(desc2), ratio_threshold)
+            result = pair_cache.get(pair_key)
         else:
-            confidence = 'high'
-        
-        result = {
-            'similarity_score': round(similarity_score, 2),
-            'good_matches': good_match_count,
-            'total_matches': total_matches,
-            'match_ratio': round(match_ratio, 4),
-            'confidence': confidence,
-            'features1_count': len(desc1),
-            'features2_count': len(desc2)
-        }
+            result = None
+        
+        if result is None:
+            result = score_descriptors(desc1, desc2, ratio_threshold, spec)
+            if pair_key is not None:
+                pair_cache.put(pair_key, dict(result))
+        result = dict(result)
         
-        # Clean up large arrays
-        desc1 = None
-        desc2 = None
-        matches = None
-        good_matches = None
-        matcher = None
-        gc.collect()
+        if verify:
+            add_verification(result, features1, desc1, features2, desc2, ratio_threshold, verify_model, pair_key,
+                             spec)
         
         return result
         
     except Exception as e:
-        # Force cleanup on error
-        gc.collect()
         raise Exception(f"Feature comparison failed: {str(e)}")
 
+def verification_params(params):
+    """
+    Read the verify flag and verify_model of a comparison request
+    Form and query-string values are strings, JSON values may be booleans
+    Returns (verify, verify_model, error_message)
+    """
+    verify = params.get('verify', False)
+    if isinstance(verify, str):
+        verify = verify.lower() in ('1', 'true', 'yes')
+    verify_model = params.get('verify_model', VERIFY_MODEL)
+    if verify_model not in MIN_MATCHES:
+        return False, verify_model, f'verify_model must be one of: {", ".join(MIN_MATCHES)}'
+    return bool(verify), verify_model, None
+
+def signature_of(features):
+    """
+    Global signature of a feature set: the stored one if it was built with the
+    loaded codebook, otherwise computed from its descriptors
+    """
+    signature = features.get('global_signature')
+    if signature is not None and features.get('signature_codebook') == CODEBOOK_ID:
+        with metrics.timed('base64_decode'):
+            signature = np.frombuffer(base64.b64decode(signature), dtype=np.float16)
+        if len(signature) == codebook.size:
+            return signature.astype(np.float32)
+    if descriptor_format_of(features) != RAW_FORMAT:
+        raise ValueError(f'{descriptor_format_of(features)} features without a global signature cannot be shortlisted')
+    with metrics.timed('signature'):
+        return vlad_signature(decode_descriptors(features), codebook)
+
+def shortlist_candidates(query_features, candidates, shortlist):
+    """
+    Keep the candidates whose global signatures have the highest dot product with the query's
+    Returns ({'id', 'features'} candidates in their original order, per-candidate errors)
+    """
+    query_signature = signature_of(query_features)
+    kept = []
+    signatures = []
+    errors = []
+    for index, candidate in enumerate(candidates):
+        candidate_id = candidate.get('id', index) if isinstance(candidate, dict) else index
+        try:
+            features = candidate.get('features', candidate)
+            if 'features' in features:
+                features = features['features']
+            signatures.append(signature_of(features))
+            kept.append({'id': candidate_id, 'features': features})
+        except Exception as e:
+            errors.append({'id': candidate_id, 'error': str(e)})
+    
+    if len(kept) <= shortlist:
+        return kept, errors
+    with metrics.timed('prefilter'):
+        scores = np.stack(signatures) @ query_signature
+        top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+    return [kept[i] for i in np.sort(top)], errors
+
+def rank_candidates(query_features, candidates, top_k=10, ratio_threshold=None, verify=0, verify_model=VERIFY_MODEL):
+    """
+    Score one query feature set against many candidate feature sets
+    The query is decoded once and all candidates are scored together in stacked batches
+    With verify > 0, the verify candidates with the most good matches (and at least
+    VERIFY_MIN_MATCHES) are checked with RANSAC and ranked ahead of the others by verified_score
+    Returns (ranked top_k results, number of candidates scored, per-candidate errors)
+    """
+    spec, ratio_threshold = matching_spec(query_features, ratio_threshold)
+    query_desc = decode_descriptors(query_features, 'Query')
+    query_hash = content_hash(query_desc) if query_desc is not None and pair_cache.enabled else None
+    
+    results = []
+    errors = []
+    # Candidates with descriptors, kept with their features for the verification stage
+    scored = []
+    batch = []
+    for index, candidate in enumerate(candidates):
+        candidate_id = candidate.get('id', index) if isinstance(candidate, dict) else index
+        try:
+            features = candidate.get('features', candidate)
+            if 'features' in features:
+                features = features['features']
+            
+            if query_desc is None or len(query_desc) < 2 or not has_descriptors(features):
+                comparison = _empty_comparison()
+                comparison['id'] = candidate_id
+                results.append(comparison)
+                continue
+            
+            mismatch = descriptor_mismatch_error(query_features, features)
+            if mismatch:
+                errors.append({'id': candidate_id, 'error': mismatch})
+                continue
+            
+            desc = decode_descriptors(features, f'Candidate {candidate_id}')
+            if len(desc) < 2:
+                comparison = _empty_comparison()
+                comparison['id'] = candidate_id
+                results.append(comparison)
+                continue
+            
+            pair_key = None
+            if query_hash is not None:
+                pair_key = (query_hash, content_hash(desc), ratio_threshold)
+                cached = pair_cache.get(pair_key)
+                if cached is not None:
+                    comparison = dict(cached)
+                    comparison['id'] = candidate_id
+                    scored.append((comparison, features, desc, pair_key))
+                    continue
+            
+            batch.append((candidate_id, features, desc, pair_key))
+        except Exception as e:
+            errors.append({'id': candidate_id, 'error': str(e)})
+    
+    if batch:
+        counts = good_match_counts(
+            query_desc, [desc for _, _, desc, _ in batch], ratio_threshold, spec.norm, spec.max_distance
+        )
+        for (candidate_id, features, desc, pair_key), good_match_count in zip(batch, counts):
+            comparison = comparison_result(good_match_count, len(query_desc), len(desc))
+            if pair_key is not None:
+                pair_cache.put(pair_key, dict(comparison))
+            comparison['id'] = candidate_id
+            scored.append((comparison, features, desc, pair_key))
+    
+    if verify > 0:
+        # Cheap stage first: only the best few candidates by ratio-test count reach RANSAC
+        scored.sort(key=lambda entry: entry[0]['good_matches'], reverse=True)
+        for position, (comparison, features, desc, pair_key) in enumerate(scored):
+            if position < verify:
+                add_verification(comparison, query_features, query_desc, features, desc,
+                                 ratio_threshold, verify_model, pair_key, spec)
+            else:
+                comparison['verification'] = 'skipped'
+    results.extend(comparison for comparison, _, _, _ in scored)
+    
+    if verify > 0:
+        results.sort(key=lambda r: (r.get('verification') == 'verified', r.get('verified_score', 0),
+                                    r['similarity_score'], r['good_matches']), reverse=True)
+    else:
+        results.sort(key=lambda r: (r['similarity_score'], r['good_matches']), reverse=True)
+    return results[:top_k], len(results), errors
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+    # The bulk endpoint streams its body instead
+    if request.method == 'POST' and request.endpoint != 'bulk_extract_route':
+        # Receive and parse the body up front so its cost shows up as one stage
+        with metrics.timed('upload_read'):
+            if request.mimetype == 'multipart/form-data':
+                request.files
+            else:
+                request.get_data()
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = metrics.request_elapsed()
+    if elapsed is None:
+        return response
+    # Route patterns, not paths, so report IDs do not create new series
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.registry.observe('lostmatch_request_seconds', {'endpoint': endpoint}, elapsed)
+    metrics.registry.inc('lostmatch_requests_total', {'endpoint': endpoint, 'status': response.status_code})
+    response.headers['Server-Timing'] = metrics.server_timing_header(metrics.request_timings(), elapsed)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Stage latency histograms, request counters and memory gauges in Prometheus text format"""
+    extra = []
+    caches = {'features': feature_cache, 'pairs': pair_cache}
+    for field, kind in [('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                        ('entries', 'gauge'), ('bytes', 'gauge')]:
+        name = f'lostmatch_cache_{field}_total' if kind == 'counter' else f'lostmatch_cache_{field}'
+        samples = [({'cache': cache_name}, cache.stats()[field]) for cache_name, cache in caches.items()]
+        extra.append((name, kind, f'Cache {field}', samples))
+    if extraction_pool is not None:
+        pool_stats = extraction_pool.stats()
+        extra.append(('lostmatch_extraction_pool_in_flight', 'gauge', 'Extractions queued or running',
+                      [({}, pool_stats['in_flight'])]))
+        extra.append(('lostmatch_extraction_pool_rejected_total', 'counter', 'Extractions rejected with 503',
+                      [({}, pool_stats['rejected'])]))
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -224,7 +610,16 @@ def health():
         'status': 'healthy',
         'service': 'robust-image-matcher-simple',
         'timestamp': datetime.now().isoformat(),
-        'version': '2.0.0'
+        'version': '2.0.0',
+        'gallery': gallery.stats(),
+        'codebook': CODEBOOK_ID,
+        'extractor': EXTRACTOR,
+        'descriptor_format': STORED_FORMAT,
+        'cache': {
+            'features': feature_cache.stats(),
+            'pairs': pair_cache.stats()
+        },
+        'extraction_pool': extraction_pool.stats() if extraction_pool is not None else None
     }), 200
 
 @app.route('/extract-features', methods=['POST'])
@@ -233,8 +628,6 @@ def extract_features():
     Extract SIFT features from an uploaded image with memory management
     Returns keypoints and descriptors for database storage
     """
-    import gc
-    filepath = None
     try:
         # Check if image was uploaded
         if 'image' not in request.files:
@@ -256,64 +649,157 @@ def extract_features():
                 'error': 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff'
             }), 400
         
-        # Save uploaded file temporarily
+        # Decode straight from the request buffer, no temporary file
         filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(filepath)
-        
-        # Clear file object from memory
+        image_data = file.read()
         file = None
-        gc.collect()
         
-        try:
-            # Extract features
-            features = extract_sift_features(filepath)
-            
-            response_data = {
-                'success': True,
-                'filename': filename,
-                'features': features,
-                'extraction_timestamp': datetime.now().isoformat(),
-                'message': f'Extracted {features["keypoints_count"]} keypoints'
-            }
-            
-            return jsonify(response_data), 200
-            
-        except Exception as e:
-            raise e
-        finally:
-            # Always clean up temporary file
-            if filepath and os.path.exists(filepath):
-                os.remove(filepath)
-            gc.collect()
+        # Extract features
+        raw_features = detect_sift_features(image_data)
+        image_data = None
+        
+        # Clients sending 'Accept: application/x-lostmatch-features' get the binary format
+        if wire_format.wants_binary(request):
+            with metrics.timed('serialize'):
+                blob = wire_format.pack_features(
+                    raw_features['keypoints'],
+                    raw_features['descriptors'],
+                    raw_features['image_shape'],
+                    raw_features['descriptor_format']
+                )
+            return Response(blob, status=200, mimetype=wire_format.MEDIA_TYPE)
+        
+        with metrics.timed('serialize'):
+            features = features_to_json(raw_features)
+        response_data = {
+            'success': True,
+            'filename': filename,
+            'features': features,
+            'extraction_timestamp': datetime.now().isoformat(),
+            'message': f'Extracted {features["keypoints_count"]} keypoints'
+        }
+        
+        return jsonify(response_data), 200
             
+    except PoolSaturated as e:
+        return pool_saturated_response(e)
     except Exception as e:
-        # Clean up on error
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        gc.collect()
         return jsonify({
             'success': False,
             'error': f'Feature extraction failed: {str(e)}'
         }), 500
 
+def bulk_extract_item(index, name, image_data):
+    """
+    Extract and serialize the features of one image of a bulk upload
+    A saturated extraction pool is retried instead of failing the item
+    """
+    if not allowed_file(name):
+        raise ValueError('Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff')
+    for attempt in range(5):
+        try:
+            raw_features = detect_sift_features(image_data)
+            break
+        except PoolSaturated:
+            if attempt == 4:
+                raise
+            time.sleep(0.2 * (attempt + 1))
+    with metrics.timed('serialize'):
+        return features_to_json(raw_features)
+
+@app.route('/extract-features/bulk', methods=['POST'])
+def bulk_extract_route():
+    """
+    Extract features from many images in one streamed request
+    Input: a tar archive (Content-Type application/x-tar, optionally gzip-compressed)
+    or multipart/form-data with any number of file parts
+    Returns: NDJSON, one line per image as soon as it is done (completion order):
+    {"index": 0, "name": "a.jpg", "success": true, "features": {...}}
+    {"index": 1, "name": "b.png", "success": false, "error": "..."}
+    and a last line {"done": true, "processed": 2, "failed": 1}
+    A failed image does not stop the batch; a malformed upload ends it with
+    {"done": false, "error": "..."}
+    """
+    stream = get_input_stream(request.environ, max_content_length=BULK_MAX_CONTENT_LENGTH)
+    max_image_bytes = app.config['MAX_CONTENT_LENGTH']
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return jsonify({
+                'success': False,
+                'error': 'Multipart body without a boundary'
+            }), 400
+        images = iter_multipart_images(stream, boundary, max_image_bytes)
+    elif request.mimetype in TAR_MIMETYPES:
+        images = iter_tar_images(stream, max_image_bytes)
+    else:
+        return jsonify({
+            'success': False,
+            'error': 'Send a tar archive (application/x-tar) or multipart/form-data'
+        }), 400
+    
+    def generate():
+        processed = 0
+        failed = 0
+        try:
+            for index, name, result in bounded_map(bulk_extract_item, images, BULK_CONCURRENCY):
+                processed += 1
+                line = {'index': index, 'name': name}
+                if isinstance(result, Exception):
+                    failed += 1
+                    line.update(success=False, error=str(result))
+                else:
+                    line.update(success=True, features=result)
+                yield json.dumps(line) + '\n'
+        except Exception as e:
+            yield json.dumps({
+                'done': False,
+                'error': f'Bulk upload failed: {str(e)}',
+                'processed': processed,
+                'failed': failed
+            }) + '\n'
+            return
+        yield json.dumps({'done': True, 'processed': processed, 'failed': failed}) + '\n'
+    
+    return Response(stream_with_context(generate()), status=200, mimetype='application/x-ndjson')
+
 @app.route('/compare-features', methods=['POST'])
 def compare_features_route():
     """
     Compare two sets of features (from extract-features endpoint)
-    Input: JSON with 'features1' and 'features2' objects
+    Input: JSON with 'features1' and 'features2' objects, or two concatenated
+    binary feature blobs with Content-Type application/x-lostmatch-features
     Returns: Similarity metrics
     
     Expected input format:
     {
         "features1": {output from /extract-features for first image},
-        "features2": {output from /extract-features for second image}
+        "features2": {output from /extract-features for second image},
+        "verify": false
     }
+    
+    With verify, the ratio-test matches are also checked with RANSAC
+    (verify_model: homography or fundamental) and inlier fields are added
     """
-    import gc
     try:
-        data = request.get_json()
+        if wire_format.is_binary_request(request):
+            try:
+                blobs = wire_format.unpack_all(request.get_data())
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid feature blob: {str(e)}'
+                }), 400
+            if len(blobs) != 2:
+                return jsonify({
+                    'success': False,
+                    'error': f'Expected 2 feature blobs, got {len(blobs)}'
+                }), 400
+            data = dict(request.args)
+            data['features1'] = blobs[0]
+            data['features2'] = blobs[1]
+        else:
+            data = request.get_json()
         
         if not data:
             return jsonify({
@@ -367,8 +853,15 @@ def compare_features_route():
                 'comparison_timestamp': datetime.now().isoformat()
             }), 200
         
+        verify, verify_model, error = verification_params(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
         # Perform comparison
-        comparison_result = compare_features(features1, features2)
+        comparison_result = compare_features(features1, features2, verify=verify, verify_model=verify_model)
         
         response_data = {
             'success': True,
@@ -378,27 +871,348 @@ def compare_features_route():
             'input_features2_count': features2.get('keypoints_count', 0)
         }
         
-        # Clean up input data
-        data = None
-        features1 = None
-        features2 = None
-        gc.collect()
-        
         return jsonify(response_data), 200
         
     except Exception as e:
-        # Force cleanup on error
-        gc.collect()
         return jsonify({
             'success': False,
             'error': f'Feature comparison failed: {str(e)}'
         }), 500
 
+@app.route('/match-candidates', methods=['POST'])
+def match_candidates_route():
+    """
+    Rank many stored feature sets against one query feature set in a single request
+    Input: JSON with 'query' features and a 'candidates' list
+    Returns: Top-k comparison results sorted by similarity_score
+    
+    Expected input format:
+    {
+        "query": {output from /extract-features},
+        "candidates": [
+            {"id": "report-id", "features": {output from /extract-features}},
+            ...
+        ],
+        "top_k": 10,
+        "ratio_threshold": 0.7 (default: the extractor's),
+        "shortlist": 300,
+        "verify": 20,
+        "verify_model": "homography"
+    }
+    
+    With shortlist > 0 (and a codebook loaded), candidates are first ranked by
+    global signature dot product and only the top shortlist get the full
+    ratio-test comparison. With verify > 0, the verify candidates with the most
+    good matches are also checked with RANSAC and verified matches rank first.
+    
+    Binary input: the query blob followed by the candidate blobs, with
+    Content-Type application/x-lostmatch-features and candidate IDs, top_k and
+    ratio_threshold passed as query parameters (?ids=a,b,c&top_k=10)
+    """
+    try:
+        if wire_format.is_binary_request(request):
+            try:
+                blobs = wire_format.unpack_all(request.get_data())
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid feature blob: {str(e)}'
+                }), 400
+            if not blobs:
+                return jsonify({
+                    'success': False,
+                    'error': 'No feature blobs provided'
+                }), 400
+            ids = request.args.get('ids')
+            ids = ids.split(',') if ids else list(range(len(blobs) - 1))
+            if len(ids) != len(blobs) - 1:
+                return jsonify({
+                    'success': False,
+                    'error': f'Got {len(ids)} ids for {len(blobs) - 1} candidate blobs'
+                }), 400
+            data = dict(request.args)
+            data['query'] = blobs[0]
+            data['candidates'] = [{'id': i, 'features': f} for i, f in zip(ids, blobs[1:])]
+        else:
+            data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                'success': False,
+                'error': 'No JSON data provided'
+            }), 400
+        
+        if 'query' not in data or 'candidates' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'Both query and candidates are required'
+            }), 400
+        
+        query = data['query']
+        candidates = data['candidates']
+        
+        # Extract the actual features from the response structure if needed
+        if query and 'features' in query:
+            query = query['features']
+        
+        if not query:
+            return jsonify({
+                'success': False,
+                'error': 'query is empty or invalid'
+            }), 400
+        
+        for field in ['descriptors', 'descriptors_shape', 'keypoints_count']:
+            if field not in query:
+                return jsonify({
+                    'success': False,
+                    'error': f'Missing {field} in query'
+                }), 400
+        
+        if not isinstance(candidates, list):
+            return jsonify({
+                'success': False,
+                'error': 'candidates must be a list'
+            }), 400
+        
+        try:
+            top_k = int(data.get('top_k', 10))
+            ratio_threshold = data.get('ratio_threshold')
+            ratio_threshold = float(ratio_threshold) if ratio_threshold is not None else None
+            shortlist = int(data.get('shortlist', 0))
+            verify = int(data.get('verify', 0))
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'top_k, ratio_threshold, shortlist and verify must be numbers'
+            }), 400
+        
+        _, verify_model, error = verification_params(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        shortlisted = len(candidates)
+        errors = []
+        if shortlist > 0:
+            if codebook is None:
+                return jsonify({
+                    'success': False,
+                    'error': f'shortlist requires a codebook; none found at {CODEBOOK_PATH}'
+                }), 400
+            ranked, errors = shortlist_candidates(query, candidates, shortlist)
+            shortlisted = len(ranked)
+        else:
+            ranked = candidates
+        
+        matches, scored_count, rank_errors = rank_candidates(
+            query, ranked, top_k, ratio_threshold, verify, verify_model
+        )
+        
+        return jsonify({
+            'success': True,
+            'matches': matches,
+            'candidates_count': len(candidates),
+            'candidates_shortlisted': shortlisted,
+            'candidates_scored': scored_count,
+            'errors': errors + rank_errors,
+            'comparison_timestamp': datetime.now().isoformat()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Candidate matching failed: {str(e)}'
+        }), 500
+
+def request_params():
+    """Parameters of a features request: query string (binary blobs), form fields (uploads) or JSON body"""
+    if wire_format.is_binary_request(request):
+        return request.args
+    if request.files:
+        return request.form
+    return request.get_json(silent=True) or {}
+
+def features_from_request(image_field='image'):
+    """
+    Read features from an uploaded image, a binary feature blob or a JSON 'features' object
+    Returns (features, params, error_message)
+    """
+    if wire_format.is_binary_request(request):
+        features, _ = wire_format.unpack_features(request.get_data())
+        return features, request.args, None
+    
+    if request.files:
+        file = request.files.get(image_field)
+        if file is None or file.filename == '':
+            return None, request.form, f'No {image_field} file provided'
+        if not allowed_file(file.filename):
+            return None, request.form, 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff'
+        return extract_sift_features(file.read()), request.form, None
+    
+    data = request.get_json(silent=True)
+    if not data or not data.get('features'):
+        return None, data or {}, 'Provide an image file or a JSON features object'
+    features = data['features']
+    if 'features' in features:
+        features = features['features']
+    for field in ['descriptors', 'descriptors_shape']:
+        if field not in features:
+            return None, data, f'Missing {field} in features'
+    return features, data, None
+
+@app.route('/gallery/reports', methods=['POST'])
+def register_report_route():
+    """
+    Register the descriptors of a report in the server-side gallery
+    Input: multipart 'image' + 'report_id', or JSON {"report_id": ..., "features": {...}}
+    Optional: metadata {"category", "report_type", "date_from", "date_to"} used by search filters
+    Registering an existing report_id replaces its descriptors and metadata
+    """
+    try:
+        # Validate the form fields before paying for an extraction
+        params = request_params()
+        report_id = params.get('report_id')
+        if not report_id:
+            return jsonify({
+                'success': False,
+                'error': 'report_id is required'
+            }), 400
+        metadata = parse_metadata(params.get('metadata'))
+        
+        features, _, error = features_from_request()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        if descriptor_format_of(features) != STORED_FORMAT:
+            return jsonify({
+                'success': False,
+                'error': f'Gallery stores {STORED_FORMAT} descriptors, got {descriptor_format_of(features)}'
+            }), 400
+        
+        descriptors = decode_descriptors(features)
+        if descriptors is None or len(descriptors) == 0:
+            return jsonify({
+                'success': False,
+                'error': 'Image has no detectable features'
+            }), 400
+        
+        gallery.add(report_id, descriptors, metadata)
+        
+        return jsonify({
+            'success': True,
+            'report_id': str(report_id),
+            'descriptors_count': len(descriptors),
+            'gallery': gallery.stats()
+        }), 200
+        
+    except PoolSaturated as e:
+        return pool_saturated_response(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Gallery registration failed: {str(e)}'
+        }), 500
+
+@app.route('/gallery/reports/<report_id>', methods=['DELETE'])
+def remove_report_route(report_id):
+    """
+    Remove a report from the server-side gallery
+    """
+    try:
+        if not gallery.remove(report_id):
+            return jsonify({
+                'success': False,
+                'error': f'Report {report_id} is not registered'
+            }), 404
+        return jsonify({
+            'success': True,
+            'report_id': report_id,
+            'gallery': gallery.stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Gallery removal failed: {str(e)}'
+        }), 500
+
+@app.route('/search', methods=['POST'])
+def search_route():
+    """
+    Search the gallery for the reports most similar to a query
+    Input: multipart 'image', or JSON {"features": {...}}
+    Optional: top_k (default 10), ratio_threshold (default 0.75),
+              filter {"category", "report_type", "date_from", "date_to"} restricting the reports searched
+    Returns: report IDs ranked by the number of descriptor votes they received
+    """
+    try:
+        # Validate the parameters before paying for an extraction
+        params = request_params()
+        try:
+            top_k = int(params.get('top_k', 10))
+            ratio_threshold = float(params.get('ratio_threshold', 0.75))
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'top_k and ratio_threshold must be numbers'
+            }), 400
+        report_filter = ReportFilter.parse(params.get('filter'))
+        
+        features, _, error = features_from_request()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        if descriptor_format_of(features) != STORED_FORMAT:
+            return jsonify({
+                'success': False,
+                'error': f'Gallery stores {STORED_FORMAT} descriptors, got {descriptor_format_of(features)}'
+            }), 400
+        
+        descriptors = decode_descriptors(features)
+        matches = []
+        if descriptors is not None:
+            with metrics.timed('gallery_search'):
+                matches = gallery.search(descriptors, top_k, ratio_threshold, report_filter=report_filter)
+        
+        return jsonify({
+            'success': True,
+            'matches': matches,
+            'query_descriptors': 0 if descriptors is None else len(descriptors),
+            'gallery': gallery.stats(),
+            'search_timestamp': datetime.now().isoformat()
+        }), 200
+        
+    except PoolSaturated as e:
+        return pool_saturated_response(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Gallery search failed: {str(e)}'
+        }), 500
+
 @app.route('/compare-images', methods=['POST'])
 def compare_images():
     """
     Quick comparison of two uploaded images
     Combines feature extraction and comparison in one step
+    Form field verify=true adds RANSAC geometric verification
     """
     try:
         # Check if both images were uploaded
@@ -423,45 +1237,38 @@ def compare_images():
                 'error': 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff'
             }), 400
         
-        # Save files temporarily
-        filepaths = []
-        try:
-            for i, file in enumerate([file1, file2], 1):
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(filepath)
-                filepaths.append(filepath)
-            
-            # Extract features from both images
-            features1 = extract_sift_features(filepaths[0])
-            features2 = extract_sift_features(filepaths[1])
-            
-            # Compare features
-            comparison_result = compare_features(features1, features2)
-            
+        verify, verify_model, error = verification_params(request.form)
+        if error:
             return jsonify({
-                'success': True,
-                'image1_filename': file1.filename,
-                'image2_filename': file2.filename,
-                'image1_features': {
-                    'keypoints_count': features1['keypoints_count'],
-                    'image_shape': features1['image_shape']
-                },
-                'image2_features': {
-                    'keypoints_count': features2['keypoints_count'],
-                    'image_shape': features2['image_shape']
-                },
-                'comparison': comparison_result,
-                'processing_timestamp': datetime.now().isoformat()
-            }), 200
-            
-        finally:
-            # Clean up temporary files
-            for filepath in filepaths:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+                'success': False,
+                'error': error
+            }), 400
+        
+        # Extract features from both images, decoded in memory
+        features1 = extract_sift_features(file1.read())
+        features2 = extract_sift_features(file2.read())
+        
+        # Compare features
+        comparison_result = compare_features(features1, features2, verify=verify, verify_model=verify_model)
+        
+        return jsonify({
+            'success': True,
+            'image1_filename': file1.filename,
+            'image2_filename': file2.filename,
+            'image1_features': {
+                'keypoints_count': features1['keypoints_count'],
+                'image_shape': features1['image_shape']
+            },
+            'image2_features': {
+                'keypoints_count': features2['keypoints_count'],
+                'image_shape': features2['image_shape']
+            },
+            'comparison': comparison_result,
+            'processing_timestamp': datetime.now().isoformat()
+        }), 200
             
+    except PoolSaturated as e:
+        return pool_saturated_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -470,8 +1277,6 @@ def compare_images():
 
 @app.errorhandler(413)
 def too_large(e):
-    import gc
-    gc.collect()
     return jsonify({
         'success': False,
         'error': 'File too large. Maximum size is 8MB.'
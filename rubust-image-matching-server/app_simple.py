@@ -4,39 +4,34 @@ import cv2
 import numpy as np
 import base64
 import os
-import tempfile
 import json
 from werkzeug.utils import secure_filename
-import uuid
 from datetime import datetime
+from detectors import get_detector
+from image_io import load_image
+from vector_matching import good_match_counts
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 
-# Create upload directory
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_sift_features(image_path):
+def extract_sift_features(image):
     """
-    Extract SIFT features from an image
+    Extract SIFT features from an image (encoded bytes, file-like object or path)
     Returns keypoints and descriptors in a serializable format
     """
     try:
-        # Read image
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            raise ValueError("Could not load image")
+        # Decode image in memory
+        img = load_image(image)
         
-        # Initialize SIFT detector
-        sift = cv2.SIFT_create(nfeatures=500)  # Limit features to prevent memory issues
+        # Reuse this thread's SIFT detector
+        sift = get_detector('sift', nfeatures=500)  # Limit features to prevent memory issues
         
         # Detect keypoints and compute descriptors
         keypoints, descriptors = sift.detectAndCompute(img, None)
@@ -98,26 +93,11 @@ def compare_features(features1, features2, ratio_threshold=0.7):
                 'confidence': 'low'
             }
         
-        # Use FLANN matcher for fast approximate matching
-        FLANN_INDEX_KDTREE = 1
-        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-        search_params = dict(checks=50)
-        flann = cv2.FlannBasedMatcher(index_params, search_params)
-        
-        # Find matches
-        matches = flann.knnMatch(desc1, desc2, k=2)
-        
-        # Apply Lowe's ratio test
-        good_matches = []
-        for match_pair in matches:
-            if len(match_pair) == 2:
-                m, n = match_pair
-                if m.distance < ratio_threshold * n.distance:
-                    good_matches.append(m)
-        
-        # Calculate similarity metrics
-        total_matches = len(matches)
-        good_match_count = len(good_matches)
+        # Nearest/second-nearest distances and Lowe's ratio test as array operations
+        good_match_count = int(good_match_counts(desc1, [desc2], ratio_threshold)[0])
+        
+        # Calculate similarity metrics (one nearest-neighbour pair per query descriptor)
+        total_matches = len(desc1)
         match_ratio = good_match_count / max(len(desc1), len(desc2)) if max(len(desc1), len(desc2)) > 0 else 0
         
         # Calculate similarity score (0-100)
@@ -181,32 +161,17 @@ def extract_features():
                 'error': 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff'
             }), 400
         
-        # Save uploaded file temporarily
+        # Extract features straight from the request buffer
         filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(filepath)
+        features = extract_sift_features(file.read())
         
-        try:
-            # Extract features
-            features = extract_sift_features(filepath)
-            
-            # Clean up temporary file
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'features': features,
-                'extraction_timestamp': datetime.now().isoformat(),
-                'message': f'Extracted {features["keypoints_count"]} keypoints'
-            }), 200
-            
-        except Exception as e:
-            # Clean up on error
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            raise e
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'features': features,
+            'extraction_timestamp': datetime.now().isoformat(),
+            'message': f'Extracted {features["keypoints_count"]} keypoints'
+        }), 200
             
     except Exception as e:
         return jsonify({
@@ -293,44 +258,28 @@ def compare_images():
                 'error': 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff'
             }), 400
         
-        # Save files temporarily
-        filepaths = []
-        try:
-            for i, file in enumerate([file1, file2], 1):
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(filepath)
-                filepaths.append(filepath)
-            
-            # Extract features from both images
-            features1 = extract_sift_features(filepaths[0])
-            features2 = extract_sift_features(filepaths[1])
-            
-            # Compare features
-            comparison_result = compare_features(features1, features2)
-            
-            return jsonify({
-                'success': True,
-                'image1_filename': file1.filename,
-                'image2_filename': file2.filename,
-                'image1_features': {
-                    'keypoints_count': features1['keypoints_count'],
-                    'image_shape': features1['image_shape']
-                },
-                'image2_features': {
-                    'keypoints_count': features2['keypoints_count'],
-                    'image_shape': features2['image_shape']
-                },
-                'comparison': comparison_result,
-                'processing_timestamp': datetime.now().isoformat()
-            }), 200
-            
-        finally:
-            # Clean up temporary files
-            for filepath in filepaths:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+        # Extract features from both images, decoded in memory
+        features1 = extract_sift_features(file1.read())
+        features2 = extract_sift_features(file2.read())
+        
+        # Compare features
+        comparison_result = compare_features(features1, features2)
+        
+        return jsonify({
+            'success': True,
+            'image1_filename': file1.filename,
+            'image2_filename': file2.filename,
+            'image1_features': {
+                'keypoints_count': features1['keypoints_count'],
+                'image_shape': features1['image_shape']
+            },
+            'image2_features': {
+                'keypoints_count': features2['keypoints_count'],
+                'image_shape': features2['image_shape']
+            },
+            'comparison': comparison_result,
+            'processing_timestamp': datetime.now().isoformat()
+        }), 200
             
     except Exception as e:
         return jsonify({
@@ -0,0 +1,98 @@
+"""
+Microbenchmark: per-request overhead of detector construction and gc.collect()
+
+Compares the old extraction path (cv2.SIFT_create / cv2.ORB_create on every
+call, followed by gc.collect()) with the reused per-thread detectors from
+detectors.py. Run from the service directory:
+
+    python benchmarks/bench_construction.py --repeat 200
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detectors import get_detector  # noqa: E402
+
+
+def synthetic_image(width=640, height=480, seed=0):
+    """Textured grayscale image with enough corners and blobs for SIFT/ORB"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width), 128, dtype=np.uint8)
+    for _ in range(150):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = int(rng.integers(0, 256))
+        if rng.random() < 0.5:
+            cv2.circle(img, center, int(rng.integers(4, 40)), color, -1)
+        else:
+            size = rng.integers(8, 60, size=2)
+            cv2.rectangle(img, center, (center[0] + int(size[0]), center[1] + int(size[1])), color, -1)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+
+def measure(fn, repeat):
+    """Median and p95 wall time of fn() in microseconds"""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(0.95 * (len(samples) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    img = synthetic_image()
+    sift_params = {'nfeatures': 200, 'contrastThreshold': 0.08}
+    orb_params = {'nfeatures': 500}
+
+    # A heap of the size a worker carries after serving requests, so gc.collect() has something to walk
+    heap = [{'id': i, 'values': list(range(10))} for i in range(100000)]
+
+    def sift_old():
+        sift = cv2.SIFT_create(**sift_params)
+        sift.detectAndCompute(img, None)
+        gc.collect()
+
+    def sift_new():
+        get_detector('sift', **sift_params).detectAndCompute(img, None)
+
+    def orb_old():
+        cv2.ORB_create(**orb_params).detectAndCompute(img, None)
+
+    def orb_new():
+        get_detector('orb', **orb_params).detectAndCompute(img, None)
+
+    cases = [
+        ('SIFT_create()', lambda: cv2.SIFT_create(**sift_params)),
+        ('get_detector(sift)', lambda: get_detector('sift', **sift_params)),
+        ('ORB_create()', lambda: cv2.ORB_create(**orb_params)),
+        ('get_detector(orb)', lambda: get_detector('orb', **orb_params)),
+        ('gc.collect()', gc.collect),
+        ('sift extract, old path', sift_old),
+        ('sift extract, new path', sift_new),
+        ('orb extract, old path', orb_old),
+        ('orb extract, new path', orb_new),
+    ]
+
+    print(f'{"case":<26}{"median us":>12}{"p95 us":>12}')
+    for name, fn in cases:
+        median, p95 = measure(fn, args.repeat)
+        print(f'{name:<26}{median:>12.1f}{p95:>12.1f}')
+    del heap
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Seeded synthetic image corpus for the benchmarks
+
+Every base image is drawn with OpenCV primitives from its own seed, so the
+same --seed always produces byte-identical JPEGs. Each base image also gets
+transformed duplicates (rotation, scale, brightness, blur, crop, recompression)
+that play the role of a second photo of the same lost item.
+"""
+import cv2
+import numpy as np
+
+TRANSFORMS = ('rotate', 'scale', 'brightness', 'blur', 'crop', 'recompress')
+
+
+def draw_base_image(seed, width=800, height=600):
+    """Random shapes and text on a light background, as a BGR array"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 235, dtype=np.uint8)
+
+    def color():
+        return tuple(int(c) for c in rng.integers(0, 256, 3))
+
+    def point():
+        return int(rng.integers(0, width)), int(rng.integers(0, height))
+
+    for _ in range(40):
+        cv2.circle(img, point(), int(rng.integers(6, 70)), color(), -1)
+    for _ in range(30):
+        cv2.rectangle(img, point(), point(), color(), int(rng.integers(1, 4)))
+    for _ in range(20):
+        cv2.line(img, point(), point(), color(), int(rng.integers(1, 5)))
+    for _ in range(8):
+        pts = np.array([point() for _ in range(int(rng.integers(3, 7)))], dtype=np.int32)
+        cv2.fillPoly(img, [pts], color())
+    for _ in range(6):
+        text = ''.join(chr(int(c)) for c in rng.integers(65, 91, 5))
+        cv2.putText(img, text, point(), cv2.FONT_HERSHEY_SIMPLEX, float(rng.uniform(0.8, 2.0)), color(), 2)
+    return img
+
+
+def apply_transform(img, transform, rng):
+    """One photometric or geometric change of a base image"""
+    height, width = img.shape[:2]
+    if transform == 'rotate':
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), float(rng.uniform(-30, 30)), 1.0)
+        return cv2.warpAffine(img, matrix, (width, height), borderValue=(235, 235, 235))
+    if transform == 'scale':
+        factor = float(rng.uniform(0.5, 0.8))
+        return cv2.resize(img, (int(width * factor), int(height * factor)), interpolation=cv2.INTER_AREA)
+    if transform == 'brightness':
+        return cv2.convertScaleAbs(img, alpha=float(rng.uniform(0.6, 1.3)), beta=float(rng.uniform(-40, 40)))
+    if transform == 'blur':
+        return cv2.GaussianBlur(img, (5, 5), float(rng.uniform(1.0, 2.0)))
+    if transform == 'crop':
+        x = int(rng.integers(0, width // 5))
+        y = int(rng.integers(0, height // 5))
+        return img[y:y + int(height * 0.75), x:x + int(width * 0.75)]
+    if transform == 'recompress':
+        return img
+    raise ValueError(f'Unknown transform: {transform}')
+
+
+def encode_jpeg(img, quality=90):
+    ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError('JPEG encoding failed')
+    return buffer.tobytes()
+
+
+def generate_corpus(base_count=20, duplicates_per_image=2, seed=0, width=800, height=600):
+    """
+    Returns a list of items {'id', 'group', 'transform', 'data'}
+    Items with the same group show the same scene; transform is None for base images
+    """
+    rng = np.random.default_rng(seed)
+    items = []
+    for group in range(base_count):
+        base = draw_base_image(seed * 100003 + group, width, height)
+        items.append({'id': f'base-{group}', 'group': group, 'transform': None, 'data': encode_jpeg(base)})
+        for index in range(duplicates_per_image):
+            transform = TRANSFORMS[int(rng.integers(0, len(TRANSFORMS)))]
+            quality = 60 if transform == 'recompress' else 90
+            duplicate = apply_transform(base, transform, rng)
+            items.append({
+                'id': f'dup-{group}-{index}',
+                'group': group,
+                'transform': transform,
+                'data': encode_jpeg(duplicate, quality)
+            })
+    return items
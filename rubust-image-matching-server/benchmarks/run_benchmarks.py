@@ -0,0 +1,338 @@
+"""
+Offline performance benchmarks for the matching services
+
+Runs app.py, app_simple.py and ../image-matching-server/image-match-api.py
+in-process through the Flask test client against a seeded synthetic corpus
+(see corpus.py) and measures:
+
+- extraction: POST /extract-features latency per image, and the mean size
+  of the returned features as stored by clients (JSON bytes)
+- compare: POST /compare-features latency per pair (duplicate vs base and
+  unrelated pairs), plus the mean score of each kind
+- rank: one query against N stored feature sets; /match-candidates for
+  app.py, N /compare-features calls for the services without a batch route.
+  Reports candidates/s and recall@1 of the transformed duplicates
+- memory: RSS after import and corpus generation, and peak RSS
+
+Each service runs in its own subprocess so peak RSS and module state are not
+shared. Caches are disabled unless --cache is given. Results are written as
+JSON with p50/p95/p99 latencies; pass --baseline to print the p50 change
+against an earlier run:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --baseline before.json
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCHMARK_DIR)
+REPO_DIR = os.path.dirname(SERVICE_DIR)
+
+sys.path.insert(0, BENCHMARK_DIR)
+
+from corpus import generate_corpus  # noqa: E402
+
+
+class Target:
+    """How to drive one service: upload field, response layout and compare payload"""
+    name = None
+    path = None
+    image_field = 'image'
+
+    def features(self, response_json):
+        return response_json['features']
+
+    def compare_body(self, features1, features2):
+        return {'features1': features1, 'features2': features2}
+
+    def score(self, response_json):
+        return response_json['comparison']['similarity_score']
+
+    def rank(self, client, query, candidates):
+        """Scores of every (id, features) candidate against the query, one request per pair"""
+        scores = {}
+        for candidate_id, features in candidates:
+            response = client.post('/compare-features', json=self.compare_body(query, features))
+            scores[candidate_id] = self.score(response.get_json())
+        return scores
+
+
+class AppTarget(Target):
+    name = 'app'
+    path = os.path.join(SERVICE_DIR, 'app.py')
+
+    def rank(self, client, query, candidates):
+        response = client.post('/match-candidates', json={
+            'query': query,
+            'candidates': [{'id': candidate_id, 'features': features} for candidate_id, features in candidates],
+            'top_k': len(candidates)
+        })
+        return {match['id']: match['similarity_score'] for match in response.get_json()['matches']}
+
+
+class AppSimpleTarget(Target):
+    name = 'app_simple'
+    path = os.path.join(SERVICE_DIR, 'app_simple.py')
+
+
+class OrbApiTarget(Target):
+    name = 'image-match-api'
+    path = os.path.join(REPO_DIR, 'image-matching-server', 'image-match-api.py')
+    image_field = 'file'
+
+    def features(self, response_json):
+        return response_json['descriptors']
+
+    def compare_body(self, features1, features2):
+        return {'descriptors1': features1, 'descriptors2': features2}
+
+    def score(self, response_json):
+        return response_json['similarity']
+
+
+TARGETS = {target.name: target for target in (AppTarget(), AppSimpleTarget(), OrbApiTarget())}
+
+
+def latency_summary(samples):
+    """Latency percentiles in milliseconds from samples in seconds"""
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    if len(ms) == 0:
+        return {'count': 0}
+    return {
+        'count': int(len(ms)),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3)
+    }
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux), None elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2, 1)
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    divisor = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def load_service(target):
+    module_dir = os.path.dirname(target.path)
+    sys.path.insert(0, module_dir)
+    spec = importlib.util.spec_from_file_location(f'bench_{target.name.replace("-", "_")}', target.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed_post(client, url, **kwargs):
+    start = time.perf_counter()
+    response = client.post(url, **kwargs)
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f'{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+    return response.get_json(), elapsed
+
+
+def run_target(target, args):
+    """Benchmark one service in the current process"""
+    if not args.cache:
+        os.environ['FEATURE_CACHE_ENTRIES'] = '0'
+        os.environ['PAIR_CACHE_ENTRIES'] = '0'
+    os.environ['GALLERY_FOLDER'] = tempfile.mkdtemp(prefix='bench-gallery-')
+
+    corpus = generate_corpus(args.images, args.duplicates, args.seed)
+    module = load_service(target)
+    client = module.app.test_client()
+    rss_after_import = rss_mb()
+
+    # Extraction
+    features = {}
+    extraction_times = []
+    feature_sizes = []
+    for _ in range(args.rounds):
+        for item in corpus:
+            data = {target.image_field: (io.BytesIO(item['data']), f'{item["id"]}.jpg')}
+            response_json, elapsed = timed_post(client, '/extract-features', data=data,
+                                                content_type='multipart/form-data')
+            extraction_times.append(elapsed)
+            features[item['id']] = target.features(response_json)
+            feature_sizes.append(len(json.dumps(features[item['id']])))
+
+    bases = [item for item in corpus if item['transform'] is None]
+    duplicates = [item for item in corpus if item['transform'] is not None]
+
+    # Pairwise compare: each duplicate against its own base and an unrelated base
+    compare_times = []
+    positive_scores = []
+    negative_scores = []
+    for item in duplicates:
+        unrelated = bases[(item['group'] + 1) % len(bases)]
+        for base_id, scores in ((f'base-{item["group"]}', positive_scores), (unrelated['id'], negative_scores)):
+            body = target.compare_body(features[item['id']], features[base_id])
+            response_json, elapsed = timed_post(client, '/compare-features', json=body)
+            compare_times.append(elapsed)
+            scores.append(target.score(response_json))
+
+    # One-vs-N ranking of duplicates against every base image
+    candidates = [(item['id'], features[item['id']]) for item in bases]
+    queries = duplicates[:args.queries] if args.queries else duplicates
+    rank_times = []
+    hits = 0
+    for item in queries:
+        start = time.perf_counter()
+        scores = target.rank(client, features[item['id']], candidates)
+        rank_times.append(time.perf_counter() - start)
+        best = max(scores, key=scores.get)
+        hits += best == f'base-{item["group"]}'
+    rank_total = sum(rank_times)
+
+    return {
+        'extraction': dict(
+            latency_summary(extraction_times),
+            features_json_bytes=int(np.mean(feature_sizes)) if feature_sizes else None
+        ),
+        'compare': dict(
+            latency_summary(compare_times),
+            positive_mean_score=round(float(np.mean(positive_scores)), 4) if positive_scores else None,
+            negative_mean_score=round(float(np.mean(negative_scores)), 4) if negative_scores else None
+        ),
+        'rank': dict(
+            latency_summary(rank_times),
+            candidates=len(candidates),
+            candidates_per_second=round(len(candidates) * len(queries) / rank_total, 1) if rank_total else None,
+            recall_at_1=round(hits / len(queries), 4) if queries else None
+        ),
+        'memory': {
+            'rss_after_import_mb': rss_after_import,
+            'peak_rss_mb': peak_rss_mb()
+        }
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(results, baseline=None):
+    print(f'{"target":<18}{"stage":<12}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"vs baseline":>14}')
+    for name, result in results['targets'].items():
+        if 'error' in result:
+            print(f'{name:<18}error: {result["error"]}')
+            continue
+        for stage in ('extraction', 'compare', 'rank'):
+            summary = result[stage]
+            change = ''
+            previous = ((baseline or {}).get('targets', {}).get(name) or {}).get(stage)
+            if previous and previous.get('p50_ms'):
+                change = f'{(summary["p50_ms"] / previous["p50_ms"] - 1) * 100:+.1f}%'
+            print(f'{name:<18}{stage:<12}{summary["p50_ms"]:>10.2f}{summary["p95_ms"]:>10.2f}'
+                  f'{summary["p99_ms"]:>10.2f}{change:>14}')
+        rank = result['rank']
+        print(f'{name:<18}{"":<12}{rank["candidates_per_second"]} candidates/s, recall@1 {rank["recall_at_1"]}, '
+              f'peak RSS {result["memory"]["peak_rss_mb"]} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default=','.join(TARGETS), help='comma-separated services to run')
+    parser.add_argument('--images', type=int, default=20, help='base images in the corpus')
+    parser.add_argument('--duplicates', type=int, default=2, help='transformed duplicates per base image')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rounds', type=int, default=1, help='passes over the corpus for extraction timing')
+    parser.add_argument('--queries', type=int, default=0, help='duplicates used as ranking queries (0: all)')
+    parser.add_argument('--cache', action='store_true', help='keep the feature and comparison caches enabled')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare p50 latencies against')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_target(TARGETS[args.child], args)
+        with open(args.child_output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'corpus': {'images': args.images, 'duplicates': args.duplicates, 'seed': args.seed},
+            'rounds': args.rounds,
+            'cache': args.cache
+        },
+        'targets': {}
+    }
+
+    for name in args.targets.split(','):
+        name = name.strip()
+        if name not in TARGETS:
+            parser.error(f'Unknown target {name}; choose from {", ".join(TARGETS)}')
+        print(f'Running {name}...', file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+            child_output = tmp.name
+        command = [sys.executable, os.path.abspath(__file__), '--child', name, '--child-output', child_output,
+                   '--images', str(args.images), '--duplicates', str(args.duplicates), '--seed', str(args.seed),
+                   '--rounds', str(args.rounds), '--queries', str(args.queries)]
+        if args.cache:
+            command.append('--cache')
+        # Services print request logs to stdout; keep only their errors
+        completed = subprocess.run(command, cwd=SERVICE_DIR, stdout=subprocess.DEVNULL)
+        if completed.returncode == 0:
+            with open(child_output) as f:
+                results['targets'][name] = json.load(f)
+        else:
+            results['targets'][name] = {'error': f'exit code {completed.returncode}'}
+        os.remove(child_output)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(results, baseline)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
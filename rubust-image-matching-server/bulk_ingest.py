@@ -0,0 +1,112 @@
+"""
+Streaming input and bounded concurrency for the bulk extraction endpoint
+
+Uploads are read from the request stream one image at a time, either as
+members of a (optionally compressed) tar archive or as the file parts of a
+multipart/form-data body, without parsing the whole body first. Images are
+handed to a thread pool with a fixed read-ahead window, and each result is
+yielded as soon as it is ready, so memory holds at most a window of images
+and results whatever the size of the batch.
+"""
+import os
+import tarfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class ImageTooLarge(Exception):
+    """Raised for one item of a bulk upload exceeding the per-image size limit"""
+
+
+def iter_tar_images(stream, max_image_bytes):
+    """
+    Yield (name, image bytes or ImageTooLarge) for every regular file of a tar stream
+    Members are read in order, so the archive is never seeked or buffered
+    """
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            name = os.path.basename(member.name)
+            if member.size > max_image_bytes:
+                # Skipped when the next member is read
+                yield name, ImageTooLarge(f'{member.size} bytes exceeds the {max_image_bytes} byte limit')
+                continue
+            yield name, archive.extractfile(member).read()
+
+
+def iter_multipart_images(stream, boundary, max_image_bytes):
+    """
+    Yield (filename, image bytes or ImageTooLarge) for every file part of a multipart body
+    Form fields are ignored; only one part is held in memory at a time
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    finished = False
+    name = None
+    chunks = []
+    size = 0
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            if finished:
+                raise ValueError('Truncated multipart body')
+            chunk = stream.read(READ_CHUNK_BYTES)
+            finished = not chunk
+            decoder.receive_data(chunk or None)
+        elif isinstance(event, Epilogue):
+            return
+        elif isinstance(event, File):
+            name, chunks, size = event.filename, [], 0
+        elif isinstance(event, Data):
+            if name is None:
+                # Data of a form field
+                continue
+            size += len(event.data)
+            if size <= max_image_bytes:
+                chunks.append(event.data)
+            else:
+                chunks = []
+            if not event.more_data:
+                if size > max_image_bytes:
+                    yield name, ImageTooLarge(f'{size} bytes exceeds the {max_image_bytes} byte limit')
+                else:
+                    yield name, b''.join(chunks)
+                name, chunks = None, []
+        else:
+            # Preamble or a form field
+            name = None
+
+
+def bounded_map(function, items, concurrency):
+    """
+    Apply function(index, name, data) to (name, data) items from an iterator on
+    concurrency threads, holding at most 2 * concurrency items (running or waiting)
+    Yields (index, name, result or exception) in completion order
+    """
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bulk') as executor:
+        pending = {}
+        items = iter(items)
+        exhausted = False
+        index = 0
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * concurrency:
+                try:
+                    name, data = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if isinstance(data, Exception):
+                    yield index, name, data
+                else:
+                    pending[executor.submit(function, index, name, data)] = (index, name)
+                index += 1
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item_index, name = pending.pop(future)
+                error = future.exception()
+                yield item_index, name, error if error is not None else future.result()
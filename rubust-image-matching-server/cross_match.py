@@ -0,0 +1,153 @@
+"""
+Nightly all-pairs cross-matching of the registered reports' images
+
+Instead of calling /compare-features once per (lost, found) pair, this job
+searches the descriptor gallery (see gallery.py) with every query report
+against every candidate report at once, and writes the top-k candidates of
+each query report as one JSON line:
+
+    python cross_match.py --gallery ./gallery --output image_candidates.jsonl
+    python cross_match.py --gallery ./gallery --output out.jsonl --top-k 50 --workers 8 \\
+        --queries '{"report_type": "lost"}' --candidates '{"report_type": "found", "date_from": "2024-05-01"}'
+
+    {"id": "report-17", "descriptors": 200, "candidates": [{"report_id": "report-42", "votes": 89, "vote_ratio": 0.445}]}
+
+Queries and candidates are chosen by metadata filters (report_filter.py), lost
+against found reports by default; a report never matches itself. The query
+reports are processed in tiles of --tile-rows descriptors, so each segment
+index is searched once per tile and the distance blocks of exact scans stay
+bounded. Tiles run on a thread pool: OpenCV and NumPy release the GIL, and
+threads share the gallery's mapping and its FLANN indexes, built once by the
+first tile, where worker processes would each build their own copy.
+
+The output is written to a temporary file and renamed when the run completes.
+lostmatch-model-server/cross_match.py is the same job for report descriptions;
+its write_candidates is a copy of the one below.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from descriptor_codec import DescriptorCodec
+from extractors import EXTRACTORS, get_extractor
+from gallery import DescriptorGallery
+from report_filter import ReportFilter
+
+# Query descriptor rows searched together; an exact scan block is tile_rows x 16384 float32
+DEFAULT_TILE_ROWS = 1024
+PROGRESS_SECONDS = 5.0
+
+
+def write_candidates(output, tasks, total, workers):
+    """
+    Run tasks (callables returning JSON lines) on a thread pool and write their
+    lines to output in task order, reporting progress
+    Returns (reports, seconds)
+    """
+    started = last_report = time.time()
+    done = 0
+    tmp_path = output + '.tmp'
+    with open(tmp_path, 'w') as out, ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        for future in futures:
+            lines = future.result()
+            out.writelines(line + '\n' for line in lines)
+            done += len(lines)
+            if time.time() - last_report >= PROGRESS_SECONDS:
+                rate = done / (time.time() - started)
+                print(f'{done}/{total} reports, {rate:.1f} reports/s, ETA {(total - done) / rate:.0f}s', file=sys.stderr)
+                last_report = time.time()
+    os.replace(tmp_path, output)
+    return done, time.time() - started
+
+
+def open_gallery(path, extractor, descriptor_format, pca_path):
+    """DescriptorGallery opened with the settings the server uses for the same environment"""
+    codec = None
+    if descriptor_format != 'sift':
+        if extractor.name != 'sift':
+            raise ValueError(f'{descriptor_format} compresses SIFT descriptors, not {extractor.name}')
+        codec = DescriptorCodec.load(pca_path, descriptor_format.rsplit('-', 1)[1])
+    return DescriptorGallery(
+        path,
+        dim=codec.dim if codec is not None else extractor.dim,
+        descriptor_format=codec.format if codec is not None else extractor.format,
+        norm=extractor.norm,
+        search='flann'
+    )
+
+
+def query_tiles(gallery, report_filter, tile_rows):
+    """Lists of (report_id, descriptors) of query reports adding up to about tile_rows descriptors"""
+    tile, rows = [], 0
+    for report_id, descriptors in gallery.reports(report_filter):
+        tile.append((report_id, descriptors))
+        rows += len(descriptors)
+        if rows >= tile_rows:
+            yield tile
+            tile, rows = [], 0
+    if tile:
+        yield tile
+
+
+def match_tile(gallery, tile, candidate_filter, top_k, ratio_threshold):
+    """JSON lines of one tile of query reports"""
+    report_ids = [report_id for report_id, _ in tile]
+    queries = [descriptors for _, descriptors in tile]
+    results = gallery.search_many(queries, top_k, ratio_threshold, report_filter=candidate_filter, exclude=report_ids)
+    return [
+        json.dumps({'id': report_id, 'descriptors': len(query), 'candidates': candidates})
+        for report_id, query, candidates in zip(report_ids, queries, results)
+    ]
+
+
+def cross_match(gallery, output, query_filter, candidate_filter, top_k, ratio_threshold, workers, tile_rows):
+    """Write the candidates of every query report to output; returns (reports, seconds)"""
+    tiles = list(query_tiles(gallery, query_filter, tile_rows))
+    total = sum(len(tile) for tile in tiles)
+    print(f'{total} query reports in {len(tiles)} tiles against {len(gallery)} registered reports', file=sys.stderr)
+    tasks = [
+        lambda tile=tile: match_tile(gallery, tile, candidate_filter, top_k, ratio_threshold)
+        for tile in tiles
+    ]
+    return write_candidates(output, tasks, total, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-match the registered reports of a descriptor gallery')
+    parser.add_argument('--gallery', default=os.environ.get('GALLERY_FOLDER', 'gallery'))
+    parser.add_argument('--output', required=True, help='JSON lines file of top-k candidates per query report')
+    parser.add_argument('--queries', default='{"report_type": "lost"}', help='metadata filter of the query reports')
+    parser.add_argument('--candidates', default='{"report_type": "found"}',
+                        help='metadata filter of the candidate reports')
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--ratio-threshold', type=float, default=0.75)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--tile-rows', type=int, default=DEFAULT_TILE_ROWS, help='query descriptors searched together')
+    parser.add_argument('--extractor', default=os.environ.get('EXTRACTOR', 'sift'), choices=sorted(EXTRACTORS))
+    parser.add_argument('--descriptor-format', default=os.environ.get('DESCRIPTOR_FORMAT', 'sift'),
+                        choices=('sift', 'rootsift-pca-f16', 'rootsift-pca-u8'))
+    parser.add_argument('--pca', default=os.environ.get('PCA_PATH', 'pca.npz'))
+    args = parser.parse_args()
+    for name in ('top_k', 'workers', 'tile_rows'):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+
+    try:
+        query_filter = ReportFilter.parse(args.queries)
+        candidate_filter = ReportFilter.parse(args.candidates)
+        gallery = open_gallery(args.gallery, get_extractor(args.extractor), args.descriptor_format, args.pca)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    total, elapsed = cross_match(gallery, args.output, query_filter, candidate_filter, args.top_k,
+                                 args.ratio_threshold, args.workers, args.tile_rows)
+    print(f'Matched {total} reports in {elapsed:.1f}s with {args.workers} workers, '
+          f'{total / max(elapsed, 1e-9):.1f} reports/s; candidates written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Compressed SIFT descriptors: RootSIFT + PCA + float16 or 8-bit quantization
+
+RootSIFT (L1-normalize, then square root) makes Euclidean distance behave like
+the Hellinger kernel, which both improves matching and makes the descriptors
+compress well. A PCA projection learned offline reduces them to a few dozen
+dimensions, which are stored as float16 or as uint8 with a fixed scale. A
+64-dimension uint8 set is 8x smaller than raw float32 SIFT.
+
+Every feature set carries a descriptor_format tag next to descriptors_shape:
+
+    sift-128-f32                  raw SIFT (also assumed for untagged features)
+    rootsift-pca64-u8:1a2b3c4d    RootSIFT, 64 PCA dimensions, uint8, projection id
+    orb-32-u8                     raw descriptors of another extractor (see extractors.py)
+
+Feature sets are only compared when their tags are equal, so descriptors from
+different projections or precisions are never silently mixed. Compressed
+descriptors are matched directly: they are dequantized to float32 in the PCA
+space and go through the same ratio test as raw SIFT.
+
+Train a projection from a folder of report photos:
+
+    python descriptor_codec.py --images ./photos --dims 64 --output pca.npz
+"""
+import argparse
+import re
+import time
+
+import numpy as np
+
+from feature_cache import content_hash
+
+RAW_FORMAT = 'sift-128-f32'
+PRECISIONS = {
+    'f32': np.dtype(np.float32),
+    'f16': np.dtype(np.float16),
+    'u8': np.dtype(np.uint8),
+}
+PRECISION_BY_DTYPE = {dtype: precision for precision, dtype in PRECISIONS.items()}
+RAW_PATTERN = re.compile(r'^([a-z]+)-(\d+)-(f32|u8)$')
+COMPRESSED_PATTERN = re.compile(r'^rootsift-pca(\d+)-(f16|u8):([0-9a-f]{8})$')
+
+# uint8 values are stored with this offset so that zero sits mid-range
+U8_OFFSET = 128
+
+
+def format_tag(kind, dim, precision, projection_id=None):
+    if kind != 'rootsift-pca':
+        return f'{kind}-{dim}-{precision}'
+    return f'rootsift-pca{dim}-{precision}:{projection_id}'
+
+
+def parse_format(tag):
+    """Split a descriptor_format tag into (kind, dim, precision, projection id)"""
+    match = RAW_PATTERN.match(tag or '')
+    if match:
+        return match.group(1), int(match.group(2)), match.group(3), None
+    match = COMPRESSED_PATTERN.match(tag or '')
+    if match:
+        return 'rootsift-pca', int(match.group(1)), match.group(2), match.group(3)
+    raise ValueError(f'Unknown descriptor format: {tag}')
+
+
+def storage_dtype(tag):
+    """NumPy dtype of the stored descriptor bytes of a format"""
+    return PRECISIONS[parse_format(tag)[2]]
+
+
+def rootsift(descriptors, eps=1e-7):
+    descriptors = np.asarray(descriptors, dtype=np.float32)
+    descriptors = descriptors / (np.abs(descriptors).sum(axis=1, keepdims=True) + eps)
+    return np.sqrt(descriptors)
+
+
+class DescriptorCodec:
+    """Encoder from raw SIFT to one compressed format, and decoder back to float32 matching space"""
+
+    def __init__(self, mean, components, scale, precision='u8'):
+        if precision not in ('f16', 'u8'):
+            raise ValueError(f'Compressed precision must be f16 or u8, got {precision}')
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.scale = float(scale)
+        self.precision = precision
+        self.dtype = PRECISIONS[precision]
+        self.dim = self.components.shape[0]
+        self.projection_id = content_hash(self.mean, self.components, np.array([self.scale], np.float32))[:8]
+        self.format = format_tag('rootsift-pca', self.dim, precision, self.projection_id)
+
+    @classmethod
+    def load(cls, path, precision='u8'):
+        with np.load(path) as data:
+            return cls(data['mean'], data['components'], data['scale'], precision)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components, scale=np.float32(self.scale))
+
+    def encode(self, descriptors):
+        """Raw SIFT rows to stored rows of this format"""
+        projected = (rootsift(descriptors) - self.mean) @ self.components.T
+        if self.precision == 'f16':
+            return projected.astype(np.float16)
+        quantized = np.rint(projected * self.scale) + U8_OFFSET
+        return np.clip(quantized, 0, 255).astype(np.uint8)
+
+    def decode(self, stored):
+        """Stored rows of this format to float32 vectors in the PCA space"""
+        if self.precision == 'f16':
+            return stored.astype(np.float32)
+        return (stored.astype(np.float32) - U8_OFFSET) / self.scale
+
+
+def train_codec(descriptors, dims=64, precision='u8'):
+    """
+    PCA of RootSIFT descriptors, keeping the top dims components
+    The uint8 scale maps the 99.9th percentile of projected magnitudes to 127
+    """
+    roots = rootsift(descriptors)
+    mean = roots.mean(axis=0)
+    centered = roots - mean
+    # Eigenvectors of the covariance, largest eigenvalues first
+    eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered / len(centered))
+    order = np.argsort(eigenvalues)[::-1][:dims]
+    components = eigenvectors[:, order].T
+    projected = centered @ components.T
+    scale = 127.0 / max(float(np.percentile(np.abs(projected), 99.9)), 1e-6)
+    codec = DescriptorCodec(mean, components, scale, precision)
+    retained = float(eigenvalues[order].sum() / eigenvalues.sum())
+    return codec, retained
+
+
+def main():
+    from global_signature import add_extraction_arguments, sample_descriptors
+
+    parser = argparse.ArgumentParser(description='Train a RootSIFT PCA projection from a folder of images')
+    add_extraction_arguments(parser)
+    parser.add_argument('--output', default='pca.npz')
+    parser.add_argument('--dims', type=int, default=64, help='PCA dimensions kept')
+    args = parser.parse_args()
+
+    started = time.time()
+    try:
+        descriptors, image_count = sample_descriptors(
+            args.images, args.max_descriptors, args.seed,
+            args.nfeatures, args.contrast_threshold, args.max_dimension
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    codec, retained = train_codec(descriptors, args.dims)
+    codec.save(args.output)
+    print(f'Trained {args.dims}-dimension projection {codec.projection_id} from {len(descriptors)} descriptors '
+          f'of {image_count} images in {time.time() - started:.1f}s ({retained:.1%} variance retained); '
+          f'written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
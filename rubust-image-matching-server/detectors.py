@@ -0,0 +1,35 @@
+"""
+Per-thread registry of configured OpenCV feature detectors
+
+Building a detector (cv2.SIFT_create, cv2.ORB_create, cv2.AKAZE_create) on every request costs
+more than a small extraction saves, so detectors are created once and reused.
+A detector instance must not run detectAndCompute from two threads at the
+same time, so each thread keeps its own instance per parameter set; with
+gunicorn's fixed thread count this bounds the number of instances.
+"""
+import threading
+
+import cv2
+
+DETECTOR_FACTORIES = {
+    'sift': cv2.SIFT_create,
+    'orb': cv2.ORB_create,
+    'akaze': cv2.AKAZE_create,
+}
+
+_local = threading.local()
+
+
+def get_detector(kind, **params):
+    """Return this thread's detector of the given kind ('sift', 'orb', 'akaze') and parameters"""
+    registry = getattr(_local, 'detectors', None)
+    if registry is None:
+        registry = _local.detectors = {}
+    key = (kind, tuple(sorted(params.items())))
+    detector = registry.get(key)
+    if detector is None:
+        factory = DETECTOR_FACTORIES.get(kind)
+        if factory is None:
+            raise ValueError(f'Unknown detector: {kind}')
+        detector = registry[key] = factory(**params)
+    return detector
@@ -0,0 +1,168 @@
+"""
+Bounded process pool for decode + feature extraction
+
+With EXTRACTION_POOL_WORKERS > 0, request handlers hand extraction jobs to a
+pool of pre-started processes, each holding one reusable detector instance.
+At most workers + EXTRACTION_QUEUE_DEPTH jobs are admitted at a time; beyond
+that, extract() raises PoolSaturated immediately so the route can answer 503
+instead of queueing behind the gunicorn timeout. Request threads only wait on
+a future, so /health stays responsive while the pool is busy.
+
+This module is imported by the pool processes, so it must stay free of Flask
+and app-level state.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+import cv2
+import numpy as np
+
+import metrics
+from detectors import get_detector
+from image_io import decode_image
+
+_detector_config = None
+
+
+class PoolSaturated(Exception):
+    """Raised when the extraction queue is full"""
+
+
+def compute_features(image_data, detector, max_dimension, max_keypoints):
+    """
+    Decode an image and run a detector (SIFT, ORB, AKAZE) on it
+    Returns keypoints as an (n, 4) float32 array of x, y, size, angle, the
+    descriptors (None if nothing was detected) and the decoded image shape
+    Detectors without a feature limit keep their max_keypoints strongest keypoints
+    """
+    img = decode_image(image_data, max_dimension=max_dimension)
+    image_shape = img.shape
+    with metrics.timed('detect'):
+        keypoints, descriptors = detector.detectAndCompute(img, None)
+    img = None
+
+    if descriptors is None or len(keypoints) == 0:
+        return {
+            'keypoints': np.empty((0, 4), dtype=np.float32),
+            'descriptors': None,
+            'image_shape': image_shape
+        }
+
+    if len(keypoints) > max_keypoints:
+        strongest = np.sort(np.argsort([-kp.response for kp in keypoints], kind='stable')[:max_keypoints])
+        keypoints = [keypoints[i] for i in strongest]
+        descriptors = descriptors[strongest]
+    keypoints_array = np.array(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle) for kp in keypoints],
+        dtype=np.float32
+    )
+    return {
+        'keypoints': keypoints_array,
+        'descriptors': np.ascontiguousarray(descriptors[:len(keypoints_array)]),
+        'image_shape': image_shape
+    }
+
+
+def _init_worker(detector, params):
+    global _detector_config
+    # One process per core already; avoid OpenCV spawning its own threads on top
+    cv2.setNumThreads(1)
+    _detector_config = (detector, params)
+    get_detector(detector, **params)
+
+
+def _extract_in_worker(image_data, max_dimension, max_keypoints):
+    # Stage timings are returned with the result so the serving process can record them
+    metrics.start_request()
+    detector, params = _detector_config
+    features = compute_features(image_data, get_detector(detector, **params), max_dimension, max_keypoints)
+    return features, metrics.request_timings()
+
+
+def _ping():
+    return os.getpid()
+
+
+class ExtractionPool:
+    """Process pool with admission control; created lazily in each serving process"""
+
+    def __init__(self, workers, queue_depth, timeout, detector, params):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._init_args = (detector, params)
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            # A pool created before a fork (e.g. gunicorn --preload) is not usable in the child
+            if self._executor is None or self._pid != os.getpid():
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=self._init_args
+                )
+                self._pid = os.getpid()
+                # Start every process now rather than on the first requests
+                for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+                    future.result()
+            return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def extract(self, image_data, max_dimension, max_keypoints):
+        """Run one extraction in the pool, raising PoolSaturated if the queue is full"""
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolSaturated(
+                f'Extraction queue is full ({self.workers} workers, queue depth {self.queue_depth})'
+            )
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = executor.submit(_extract_in_worker, bytes(image_data), max_dimension, max_keypoints)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            with metrics.timed('pool_extract'):
+                features, timings = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f'Feature extraction timed out after {self.timeout}s')
+        for stage, seconds in timings:
+            metrics.record(stage, seconds)
+        return features
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
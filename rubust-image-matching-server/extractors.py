@@ -0,0 +1,72 @@
+"""
+Registry of feature extractors
+
+Each entry names the OpenCV detector and its parameters, the descriptor dtype
+and width, the distance used to match them and the default matching
+thresholds. The server extracts with one entry (EXTRACTOR in app.py) and tags
+every feature set with a descriptor_format such as sift-128-f32 or orb-32-u8,
+so feature sets of different extractors are never compared with each other.
+
+    sift   float32, 128 values, L2       best recall, slowest
+    orb    uint8, 32 bytes, Hamming      several times cheaper to extract and match
+    akaze  uint8, 61 bytes, Hamming      binary, more robust to scale than ORB
+"""
+import numpy as np
+
+from descriptor_codec import PRECISION_BY_DTYPE, format_tag, parse_format
+from detectors import get_detector
+from vector_matching import NORM_HAMMING, NORM_L2
+
+
+class Extractor:
+    """Detector configuration and matching defaults of one descriptor type"""
+
+    def __init__(self, name, detector, params, dtype, dim, norm, ratio_threshold, max_keypoints,
+                 max_distance=None):
+        self.name = name
+        self.detector = detector
+        self.params = params
+        self.dtype = np.dtype(dtype)
+        self.dim = dim
+        self.norm = norm
+        self.ratio_threshold = ratio_threshold
+        self.max_keypoints = max_keypoints
+        self.max_distance = max_distance
+        self.format = format_tag(name, dim, PRECISION_BY_DTYPE[self.dtype])
+
+    def create(self):
+        """This thread's detector instance"""
+        return get_detector(self.detector, **self.params)
+
+    def cache_key(self):
+        params = ','.join(f'{key}={value}' for key, value in sorted(self.params.items()))
+        return f'{self.name}:{params}:{self.max_keypoints}'
+
+
+EXTRACTORS = {
+    'sift': Extractor(
+        'sift', 'sift', {'nfeatures': 200, 'contrastThreshold': 0.08},
+        np.float32, 128, NORM_L2, ratio_threshold=0.7, max_keypoints=200
+    ),
+    'orb': Extractor(
+        'orb', 'orb', {'nfeatures': 500},
+        np.uint8, 32, NORM_HAMMING, ratio_threshold=0.75, max_keypoints=500, max_distance=64
+    ),
+    'akaze': Extractor(
+        'akaze', 'akaze', {'threshold': 0.001},
+        np.uint8, 61, NORM_HAMMING, ratio_threshold=0.8, max_keypoints=500, max_distance=120
+    ),
+}
+
+
+def get_extractor(name):
+    extractor = EXTRACTORS.get(name)
+    if extractor is None:
+        raise ValueError(f"Unknown extractor: {name} (available: {', '.join(EXTRACTORS)})")
+    return extractor
+
+
+def extractor_for_format(descriptor_format):
+    """Registry entry whose descriptors a descriptor_format tag holds; compressed RootSIFT matches like SIFT"""
+    kind = parse_format(descriptor_format)[0]
+    return get_extractor('sift' if kind == 'rootsift-pca' else kind)
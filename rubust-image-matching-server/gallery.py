@@ -0,0 +1,749 @@
+import json
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from report_filter import MetadataColumns
+from vector_matching import NORM_HAMMING, NORM_L2, hamming_distances, l2_distances
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+# FLANN KD-tree settings, same family as app_simple.compare_features
+FLANN_INDEX_KDTREE = 1
+DEFAULT_TREES = 4
+DEFAULT_CHECKS = 64
+# Multi-probe LSH for binary descriptors, as recommended by the FLANN documentation
+FLANN_INDEX_LSH = 6
+LSH_PARAMS = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+
+# 'flann' searches a per-worker FLANN index of every segment (OpenCV copies the rows it indexes);
+# 'exact' scans the shared mapping block by block and keeps no private copy
+SEARCH_MODES = ('flann', 'exact')
+EXACT_BLOCK_ROWS = 16384
+
+# Descriptor rows per segment file (128MB of SIFT); a report never spans two segments
+DEFAULT_SEGMENT_ROWS = 256 * 1024
+# Rows appended after a segment's FLANN index was built are scanned exactly; past this
+# many, the index is rebuilt in the background
+INDEX_DELTA_ROWS = 8192
+# Share of deleted rows at which a segment is rewritten by the background compaction
+DEFAULT_COMPACT_DEAD_FRACTION = 0.3
+# A metadata filter leaving at most this many rows, or needing more than FILTER_MAX_OVERFETCH
+# times the neighbours from the indexes, is searched by an exact scan of its reports only
+FILTER_SCAN_ROWS = 32768
+FILTER_MAX_OVERFETCH = 8
+
+# Single data file of galleries written before segments; still read, and appended to
+DESCRIPTORS_FILE = 'descriptors.f32'
+REPORTS_FILE = 'reports.json'
+LOCK_FILE = '.lock'
+# Segments being written by a compaction, renamed to segment-NNNNN when published
+COMPACT_PREFIX = 'compacting-'
+
+
+class _Segment:
+    """
+    Descriptor rows of one segment file, memory-mapped read-only, and its FLANN index
+    Published rows never change, so an index built over a prefix of the segment
+    stays valid as rows are appended; it is handed on to the next, longer version.
+    """
+
+    def __init__(self, name, data, base=None):
+        self.name = name
+        self.data = data
+        self.rows = len(data)
+        self._lock = threading.Lock()
+        self._index, self.indexed_rows = (base._index, base.indexed_rows) if base is not None else (None, 0)
+        self.scheduled = False
+
+    def build_index(self, params):
+        index = cv2.flann_Index(self.data, params)
+        with self._lock:
+            self._index, self.indexed_rows = index, self.rows
+
+    def index(self, params):
+        """FLANN index and the number of rows it covers, built now if there is none"""
+        with self._lock:
+            if self._index is None:
+                self._index = cv2.flann_Index(self.data, params)
+                self.indexed_rows = self.rows
+            return self._index, self.indexed_rows
+
+    def scan(self, query, k, norm, start=0, live=None):
+        """
+        Exact k nearest rows from start on for every query row, skipping rows that
+        live marks as deleted
+        Returns (indices, distances) of shape (Q, k)
+        """
+        def blocks():
+            for offset in range(start, self.rows, EXACT_BLOCK_ROWS):
+                block = self.data[offset:offset + EXACT_BLOCK_ROWS]
+                rows = np.arange(offset, offset + len(block))
+                if live is not None:
+                    rows[~live[offset:offset + len(block)]] = -1
+                yield block, rows
+
+        return _scan_blocks(query, blocks(), k, norm)
+
+
+def _scan_blocks(query, blocks, k, norm):
+    """
+    Exact k nearest rows of every query row over (rows, labels) blocks, in FLANN's
+    units (squared L2 or bit count); rows labelled -1 are skipped
+    Returns (labels, distances) of shape (Q, k)
+    """
+    best_labels = np.empty((len(query), 0), dtype=np.int64)
+    best = np.empty((len(query), 0), dtype=np.float32)
+    for block, labels in blocks:
+        block = np.asarray(block)[None]
+        if norm == NORM_HAMMING:
+            dist = hamming_distances(query, block)[0].astype(np.float32)
+        else:
+            dist = np.square(l2_distances(query, block)[0])
+        dist[:, labels < 0] = np.inf
+        dist = np.concatenate([best, dist], axis=1)
+        labels = np.concatenate([best_labels, np.broadcast_to(labels, (len(query), len(labels)))], axis=1)
+        if dist.shape[1] > k:
+            keep = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            dist = np.take_along_axis(dist, keep, axis=1)
+            labels = np.take_along_axis(labels, keep, axis=1)
+        best, best_labels = dist, labels
+    return best_labels, best
+
+
+class _Snapshot:
+    """Immutable view of the gallery at one manifest version; searches never wait for writers"""
+
+    def __init__(self, segments, reports, metadata=None, next_segment=0, version=None):
+        self.segments = segments
+        self.reports = reports  # report_id -> (segment name, start_row, row_count)
+        self.metadata = metadata or {}  # report_id -> category, report_type and date window
+        self.next_segment = next_segment
+        self.version = version
+        self.owner_ids = list(reports)
+        self.owner_index = {report_id: owner for owner, report_id in enumerate(self.owner_ids)}
+        self.counts = np.array([count for _, _, count in reports.values()], dtype=np.int64)
+        self.rows = int(self.counts.sum())
+        self.by_name = {segment.name: segment for segment in segments}
+        self._columns = None
+
+        # Report spans of each segment, sorted by first row, to map a row to its owner
+        spans = {segment.name: [] for segment in segments}
+        for owner, report_id in enumerate(self.owner_ids):
+            name, start, count = reports[report_id]
+            spans[name].append((start, start + count, owner))
+        self._spans = {}
+        # Tombstones: rows of deleted or replaced reports stay in their segment until it is
+        # compacted, and are masked out of every search
+        self.live = {}
+        for segment in segments:
+            entries = sorted(spans[segment.name])
+            columns = np.array(entries, dtype=np.int64).reshape(-1, 3)
+            self._spans[segment.name] = (columns[:, 0], columns[:, 1], columns[:, 2])
+            live = np.zeros(segment.rows, dtype=bool)
+            for start, end, _ in entries:
+                live[start:end] = True
+            self.live[segment.name] = live
+        self.dead_rows = sum(segment.rows for segment in segments) - self.rows
+
+    def dead_fraction(self, segment):
+        return 1.0 - np.count_nonzero(self.live[segment.name]) / segment.rows if segment.rows else 0.0
+
+    def filter_mask(self, report_filter):
+        """Boolean mask over the owners matching a ReportFilter; the metadata columns are built on first use"""
+        if self._columns is None:
+            self._columns = MetadataColumns([self.metadata.get(report_id) for report_id in self.owner_ids])
+        return self._columns.mask(report_filter)
+
+    def owners(self, name, rows):
+        """Owner index of each row of a segment, -1 for deleted rows"""
+        starts, ends, owners = self._spans[name]
+        if len(starts) == 0:
+            return np.full(rows.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(starts, rows, side='right') - 1
+        clipped = np.maximum(pos, 0)
+        return np.where((pos >= 0) & (rows < ends[clipped]), owners[clipped], -1)
+
+
+class DescriptorGallery:
+    """
+    Server-side store of the descriptors of every registered report
+
+    Descriptors (float32 for SIFT, uint8 for binary descriptors) live in
+    segment files of at most segment_rows rows, each report owning a run of
+    rows in one segment. Workers memory-map the segments read-only, so all of
+    them share one copy in the page cache instead of loading the matrix each.
+    Every query descriptor that passes the ratio test votes for the report
+    owning its nearest neighbour, found with a FLANN KD-tree (LSH for Hamming)
+    per segment, or by an exact scan of the mapping.
+
+    A single writer at a time (serialized by a lock file across workers)
+    appends rows past the end of the last segment, or writes a new segment,
+    then publishes them by atomically replacing the JSON manifest. Readers
+    reload when the manifest changes; rows are never modified once published,
+    so searches run on a consistent snapshot without waiting for writers.
+
+    Deleting or replacing a report only drops it from the manifest: its rows
+    become tombstones, masked at query time. Once a segment's dead fraction
+    reaches compact_dead_fraction, a background thread rewrites its live rows
+    to a new segment. Rows appended after a segment was indexed are scanned
+    exactly until a background rebuild catches up, so neither churn nor
+    compaction puts an index rebuild on the request path.
+
+    Reports may carry metadata (see report_filter.py). A search filter is
+    resolved to a mask over the reports before any distance is computed; a
+    selective one is answered by an exact scan of the matching reports' rows
+    alone, a broad one by the indexes with enough extra neighbours fetched to
+    make up for the ones it discards.
+    """
+
+    def __init__(self, storage_dir=None, dim=128, trees=DEFAULT_TREES, checks=DEFAULT_CHECKS,
+                 descriptor_format=None, norm=NORM_L2, search='flann', segment_rows=DEFAULT_SEGMENT_ROWS,
+                 compact_dead_fraction=DEFAULT_COMPACT_DEAD_FRACTION):
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Unknown gallery search mode: {search} (available: {', '.join(SEARCH_MODES)})")
+        self.storage_dir = storage_dir
+        self.dim = dim
+        self.norm = norm
+        self.dtype = np.dtype(np.uint8 if norm == NORM_HAMMING else np.float32)
+        self.descriptor_format = descriptor_format
+        self.trees = trees
+        self.checks = checks
+        self.search_mode = search
+        self.segment_rows = segment_rows
+        self.compact_dead_fraction = compact_dead_fraction
+        self.compactions = 0
+
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._memory = {}  # segment name -> rows, without storage_dir
+        self._snapshot = _Snapshot([], {})
+        self._tasks = None
+        self._maintainer_pid = None
+        self._compaction_scheduled = False
+
+        if storage_dir:
+            os.makedirs(storage_dir, exist_ok=True)
+            self.refresh()
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.storage_dir, name)
+
+    def _segment_name(self, number):
+        return f"segment-{number:05d}.{'u8' if self.norm == NORM_HAMMING else 'f32'}"
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across gunicorn workers sharing storage_dir"""
+        with self._lock:
+            if not self.storage_dir or fcntl is None:
+                yield
+                return
+            with open(self._path(LOCK_FILE), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _map(self, name, rows):
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        if not self.storage_dir:
+            return self._memory[name][:rows]
+        return np.memmap(self._path(name), dtype=self.dtype, mode='r', shape=(rows, self.dim))
+
+    def refresh(self):
+        """Switch to the latest manifest if another worker published one"""
+        if not self.storage_dir:
+            return
+        manifest_path = self._path(REPORTS_FILE)
+        for _ in range(3):
+            try:
+                stat = os.stat(manifest_path)
+            except FileNotFoundError:
+                return
+            # The manifest is replaced atomically, so a new inode means a new version
+            if (stat.st_ino, stat.st_mtime_ns) == self._snapshot.version:
+                return
+            with self._refresh_lock:
+                try:
+                    with open(manifest_path) as f:
+                        stat = os.fstat(f.fileno())
+                        version = (stat.st_ino, stat.st_mtime_ns)
+                        if version == self._snapshot.version:
+                            return
+                        manifest = json.load(f)
+                    self._snapshot = self._load(manifest, version)
+                    return
+                except FileNotFoundError:
+                    # A compaction replaced a segment between reading the manifest and mapping it
+                    continue
+
+    def _load(self, manifest, version):
+        if manifest.get('dim', self.dim) != self.dim:
+            raise ValueError(f"Gallery dimension mismatch: stored {manifest.get('dim')}, expected {self.dim}")
+        if manifest.get('descriptor_format') not in (None, self.descriptor_format):
+            raise ValueError(
+                f"Gallery format mismatch: stored {manifest['descriptor_format']}, expected {self.descriptor_format}"
+            )
+
+        if 'segments' in manifest:
+            segments = manifest['segments']
+        else:
+            # Single-file layout: descriptors.f32 is the only segment
+            segments = [{'name': DESCRIPTORS_FILE, 'rows': manifest['rows']}] if manifest['rows'] else []
+        reports = {
+            r['id']: (r.get('segment', DESCRIPTORS_FILE), r['start'], r['count'])
+            for r in manifest['reports']
+        }
+        metadata = {r['id']: r['metadata'] for r in manifest['reports'] if r.get('metadata')}
+        return self._make_snapshot(
+            [(s['name'], s['rows']) for s in segments], reports, metadata, manifest.get('next_segment', 0), version
+        )
+
+    def _make_snapshot(self, segments, reports, metadata, next_segment, version=None, prepared=None):
+        # Unchanged segments keep their mapping and index; grown ones keep the index of their prefix
+        previous = {segment.name: segment for segment in self._snapshot.segments}
+        prepared = prepared or {}
+        mapped = []
+        for name, rows in segments:
+            segment = prepared.get(name) or previous.get(name)
+            if segment is None or segment.rows != rows:
+                segment = _Segment(name, self._map(name, rows), base=segment)
+            mapped.append(segment)
+        return _Snapshot(mapped, reports, metadata, next_segment, version)
+
+    def _write_rows(self, name, start, descriptors):
+        """Write rows from start on, past the rows published so far (so no reader sees them change)"""
+        if not self.storage_dir:
+            existing = self._memory.get(name)
+            self._memory[name] = descriptors.copy() if existing is None else np.concatenate(
+                [existing[:start], descriptors]
+            )
+            return
+        path = self._path(name)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            # Overwrite any tail left behind by an interrupted append
+            f.seek(start * self.dim * self.dtype.itemsize)
+            f.write(descriptors.tobytes())
+            f.truncate()
+
+    def _publish(self, segments, reports, metadata, next_segment, obsolete=(), prepared=None):
+        """Make a new version visible: manifest first, then drop the segments it no longer uses"""
+        version = None
+        if self.storage_dir:
+            manifest = {
+                'dim': self.dim,
+                'descriptor_format': self.descriptor_format,
+                'next_segment': next_segment,
+                'segments': [{'name': name, 'rows': rows} for name, rows in segments],
+                'reports': [
+                    dict(
+                        {'id': report_id, 'segment': name, 'start': start, 'count': count},
+                        **({'metadata': metadata[report_id]} if report_id in metadata else {})
+                    )
+                    for report_id, (name, start, count) in reports.items()
+                ]
+            }
+            tmp_path = self._path(REPORTS_FILE + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._path(REPORTS_FILE))
+            stat = os.stat(self._path(REPORTS_FILE))
+            version = (stat.st_ino, stat.st_mtime_ns)
+        with self._refresh_lock:
+            self._snapshot = self._make_snapshot(segments, reports, metadata, next_segment, version, prepared)
+
+        # Workers still searching the old version keep their mapping of the unlinked files
+        for name in obsolete:
+            self._drop_segment(name)
+
+    # ------------------------------------------------------------------
+    # Mutation
+    # ------------------------------------------------------------------
+
+    def _begin(self):
+        """Latest published state as mutable (segments, reports, metadata, next_segment); call under the write lock"""
+        self.refresh()
+        snapshot = self._snapshot
+        return [(segment.name, segment.rows) for segment in snapshot.segments], dict(snapshot.reports), \
+            dict(snapshot.metadata), snapshot.next_segment
+
+    def add(self, report_id, descriptors, metadata=None):
+        """Register (or replace) the descriptors of one report, with optional metadata (see report_filter.py)"""
+        descriptors = np.ascontiguousarray(descriptors, dtype=self.dtype)
+        if descriptors.ndim != 2 or descriptors.shape[1] != self.dim:
+            raise ValueError(f"Expected descriptors of shape (n, {self.dim}), got {descriptors.shape}")
+        report_id = str(report_id)
+
+        with self._write_lock():
+            segments, reports, report_metadata, next_segment = self._begin()
+            # A replaced report's old rows become tombstones
+            rows = len(descriptors)
+            if segments and segments[-1][1] + rows <= self.segment_rows:
+                name, start = segments.pop()
+            else:
+                name, start = self._segment_name(next_segment), 0
+                next_segment += 1
+            self._write_rows(name, start, descriptors)
+            segments.append((name, start + rows))
+            reports[report_id] = (name, start, rows)
+            if metadata:
+                report_metadata[report_id] = metadata
+            else:
+                report_metadata.pop(report_id, None)
+            self._publish(segments, reports, report_metadata, next_segment)
+        self._maybe_compact()
+
+    def remove(self, report_id):
+        """Remove a report (its rows become tombstones), returns False if it was not registered"""
+        report_id = str(report_id)
+        with self._write_lock():
+            segments, reports, metadata, next_segment = self._begin()
+            if reports.pop(report_id, None) is None:
+                return False
+            metadata.pop(report_id, None)
+            self._publish(segments, reports, metadata, next_segment)
+        self._maybe_compact()
+        return True
+
+    def compact(self, min_dead_fraction=None):
+        """
+        Rewrite every segment whose dead fraction reached min_dead_fraction
+        (compact_dead_fraction by default), packing their live rows together with
+        those of sealed segments under half full into as few new segments as possible
+        The new segments are written (and in flann mode indexed) from a snapshot
+        without holding the write lock, which is only taken to publish them: reports
+        removed or replaced in the meantime keep their new location, and their
+        copied rows are tombstones of the new segments
+        Returns the number of segments rewritten
+        """
+        threshold = self.compact_dead_fraction if min_dead_fraction is None else min_dead_fraction
+        self.refresh()
+        snapshot = self._snapshot
+        victims = [
+            segment for segment in snapshot.segments
+            if segment.rows and snapshot.dead_fraction(segment) >= threshold
+        ]
+        if not victims:
+            return 0
+        victims += [
+            segment for segment in snapshot.segments[:-1]
+            if segment not in victims and segment.rows < self.segment_rows // 2
+        ]
+        names = {segment.name for segment in victims}
+        data = {segment.name: segment.data for segment in victims}
+        moved = sorted(
+            (name, start, count, report_id) for report_id, (name, start, count) in snapshot.reports.items()
+            if name in names
+        )
+
+        # Live rows are packed in order into new segments of at most segment_rows rows, under
+        # temporary names until the write lock hands out their numbers
+        packed, locations = [], {}
+        for name, start, count, report_id in moved:
+            if not packed or packed[-1][1] + count > self.segment_rows:
+                packed.append([f'{COMPACT_PREFIX}{os.getpid()}-{threading.get_ident()}-{len(packed)}', 0, []])
+            locations[report_id] = (len(packed) - 1, packed[-1][1], count)
+            packed[-1][2].append(data[name][start:start + count])
+            packed[-1][1] += count
+        built = []
+        for tmp_name, count, parts in packed:
+            self._write_rows(tmp_name, 0, np.ascontiguousarray(np.concatenate(parts)))
+            segment = _Segment(tmp_name, self._map(tmp_name, count))
+            if self.search_mode == 'flann':
+                segment.build_index(self._index_params())
+            built.append(segment)
+
+        with self._write_lock():
+            segments, reports, metadata, next_segment = self._begin()
+            if not names <= {name for name, _ in segments}:
+                # Another worker compacted these segments first
+                for segment in built:
+                    self._drop_segment(segment.name)
+                return 0
+
+            prepared, final_names = {}, []
+            for segment in built:
+                name = self._segment_name(next_segment)
+                next_segment += 1
+                self._rename_segment(segment.name, name)
+                prepared[name] = _Segment(name, segment.data, base=segment)
+                final_names.append(name)
+            # Only reports still where the snapshot found them move; later writes win
+            for name, start, count, report_id in moved:
+                if reports.get(report_id) == (name, start, count):
+                    index, new_start, _ = locations[report_id]
+                    reports[report_id] = (final_names[index], new_start, count)
+            # A victim that received appends meanwhile (the tail) is kept for its new reports
+            obsolete = names - {name for name, _, _ in reports.values()}
+
+            # The tail keeps receiving appends, so it stays last
+            new_segments = [(segment.name, segment.rows) for segment in prepared.values()]
+            kept = [(name, rows) for name, rows in segments if name not in obsolete]
+            if segments[-1][0] in obsolete or not kept:
+                segments = kept + new_segments
+            else:
+                segments = kept[:-1] + new_segments + kept[-1:]
+            self._publish(segments, reports, metadata, next_segment, sorted(obsolete), prepared)
+            self.compactions += len(obsolete)
+            return len(obsolete)
+
+    def _rename_segment(self, name, new_name):
+        if not self.storage_dir:
+            self._memory[new_name] = self._memory.pop(name)
+            return
+        # Mappings of the old path (and the index built on them) stay valid
+        os.replace(self._path(name), self._path(new_name))
+
+    def _drop_segment(self, name):
+        if not self.storage_dir:
+            self._memory.pop(name, None)
+            return
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Background maintenance
+    # ------------------------------------------------------------------
+
+    def _schedule(self, task):
+        # Threads do not survive a fork, so a forked worker starts its own
+        with self._lock:
+            if self._tasks is None or self._maintainer_pid != os.getpid():
+                self._tasks = queue.Queue()
+                self._maintainer_pid = os.getpid()
+                threading.Thread(target=self._maintain, args=(self._tasks,), name='gallery-maintenance',
+                                 daemon=True).start()
+            self._tasks.put(task)
+
+    def _maintain(self, tasks):
+        while True:
+            task = tasks.get()
+            try:
+                if task == 'compact':
+                    self._compaction_scheduled = False
+                    self.compact()
+                else:
+                    task.build_index(self._index_params())
+            except Exception as e:
+                print(f'Gallery maintenance failed: {e}', file=sys.stderr)
+
+    def _maybe_compact(self):
+        snapshot = self._snapshot
+        if self._compaction_scheduled or not any(
+            snapshot.dead_fraction(segment) >= self.compact_dead_fraction for segment in snapshot.segments
+        ):
+            return
+        self._compaction_scheduled = True
+        self._schedule('compact')
+
+    # ------------------------------------------------------------------
+    # Inspection
+    # ------------------------------------------------------------------
+
+    def __contains__(self, report_id):
+        return str(report_id) in self._snapshot.reports
+
+    def __len__(self):
+        return len(self._snapshot.reports)
+
+    def reports(self, report_filter=None):
+        """(report_id, descriptors) of every registered report matching report_filter; views of the mapping"""
+        self.refresh()
+        snapshot = self._snapshot
+        owners = range(len(snapshot.owner_ids)) if report_filter is None else \
+            snapshot.filter_mask(report_filter).nonzero()[0]
+        for owner in owners:
+            report_id = snapshot.owner_ids[owner]
+            name, start, count = snapshot.reports[report_id]
+            yield report_id, snapshot.by_name[name].data[start:start + count]
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'reports': len(snapshot.reports),
+            'descriptors': snapshot.rows,
+            'deleted_descriptors': snapshot.dead_rows,
+            'segments': len(snapshot.segments),
+            'mapped_bytes': sum(segment.data.nbytes for segment in snapshot.segments),
+            'compactions': self.compactions,
+            'search': self.search_mode,
+            'index_built': self.search_mode == 'exact' or all(
+                segment.indexed_rows == segment.rows for segment in snapshot.segments
+            )
+        }
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    def _index_params(self):
+        if self.norm == NORM_HAMMING:
+            return LSH_PARAMS
+        return dict(algorithm=FLANN_INDEX_KDTREE, trees=self.trees)
+
+    def _segment_nearest(self, snapshot, segment, query, neighbors):
+        """(indices, distances) of the nearest rows of one segment; deleted rows may appear in the indexed part"""
+        live = snapshot.live[segment.name]
+        if self.search_mode == 'exact':
+            return segment.scan(query, min(neighbors, segment.rows), self.norm, live=live)
+
+        index, indexed = segment.index(self._index_params())
+        # Ask for more neighbours when tombstones may take some of the nearest slots
+        wanted = neighbors if live[:indexed].all() else 2 * neighbors
+        indices, dists = index.knnSearch(query, min(wanted, indexed), params=dict(checks=self.checks))
+        if indexed < segment.rows:
+            delta_indices, delta_dists = segment.scan(
+                query, min(neighbors, segment.rows - indexed), self.norm, start=indexed, live=live
+            )
+            indices = np.concatenate([indices, delta_indices], axis=1)
+            dists = np.concatenate([dists.astype(np.float32), delta_dists], axis=1)
+            if segment.rows - indexed >= INDEX_DELTA_ROWS and not segment.scheduled:
+                segment.scheduled = True
+                self._schedule(segment)
+        return indices, dists
+
+    def _nearest(self, snapshot, query, neighbors, allowed=None, fetch=None):
+        """
+        Nearest live rows of each query descriptor over all segments, merged by distance
+        With an allowed mask over the owners, fetch neighbours are taken from each
+        segment and those of other owners dropped
+        Returns (distances, owner indices), (Q, k) each; owners are -1 where nothing was found
+        """
+        all_dists, all_owners = [], []
+        for segment in snapshot.segments:
+            if segment.rows == 0:
+                continue
+            indices, dists = self._segment_nearest(snapshot, segment, query, fetch or neighbors)
+            # LSH marks neighbours it could not find with -1
+            owners = snapshot.owners(segment.name, np.where(indices >= 0, indices, 0).astype(np.int64))
+            owners[indices < 0] = -1
+            if allowed is not None:
+                owners[(owners >= 0) & ~allowed[np.maximum(owners, 0)]] = -1
+            all_dists.append(np.where(owners >= 0, dists.astype(np.float64), np.inf))
+            all_owners.append(owners)
+        dists = np.concatenate(all_dists, axis=1)
+        owners = np.concatenate(all_owners, axis=1)
+        order = np.argsort(dists, axis=1, kind='stable')[:, :neighbors]
+        return np.take_along_axis(dists, order, axis=1), np.take_along_axis(owners, order, axis=1)
+
+    def _scan_reports(self, snapshot, query, neighbors, allowed):
+        """Exact nearest rows among the rows of the allowed owners only, as _nearest returns them"""
+        def blocks():
+            parts, labels, size = [], [], 0
+            for owner in np.flatnonzero(allowed):
+                name, start, count = snapshot.reports[snapshot.owner_ids[owner]]
+                parts.append(snapshot.by_name[name].data[start:start + count])
+                labels.append(np.full(count, owner, dtype=np.int64))
+                size += count
+                if size >= EXACT_BLOCK_ROWS:
+                    yield np.concatenate(parts), np.concatenate(labels)
+                    parts, labels, size = [], [], 0
+            if parts:
+                yield np.concatenate(parts), np.concatenate(labels)
+
+        owners, dists = _scan_blocks(query, blocks(), neighbors, self.norm)
+        order = np.argsort(dists, axis=1, kind='stable')
+        dists = np.take_along_axis(dists, order, axis=1).astype(np.float64)
+        owners = np.take_along_axis(owners, order, axis=1)
+        owners[np.isinf(dists)] = -1
+        return dists, owners
+
+    def search(self, query_descriptors, top_k=10, ratio_threshold=0.75, neighbors=5, report_filter=None):
+        """
+        Vote for the reports owning the nearest neighbours of each query descriptor
+        The ratio test compares the nearest neighbour with the nearest one that
+        belongs to a different report, so repeated structure inside a single
+        report does not cancel its own votes.
+        With a report_filter (report_filter.ReportFilter), only matching reports are searched.
+        Returns a list of {'report_id', 'votes', 'vote_ratio'} sorted by votes
+        """
+        return self.search_many([query_descriptors], top_k, ratio_threshold, neighbors, report_filter)[0]
+
+    def search_many(self, queries, top_k=10, ratio_threshold=0.75, neighbors=5, report_filter=None, exclude=None):
+        """
+        search() for several queries at once: their descriptors are stacked into
+        one tile, so every segment index is searched once for the whole tile
+        exclude optionally gives, per query, a report ID whose rows it must not
+        match (the query's own report when it is registered too)
+        Returns one result list per query
+        """
+        queries = [np.ascontiguousarray(query, dtype=self.dtype) for query in queries]
+        for query in queries:
+            if query.ndim != 2 or query.shape[1] != self.dim:
+                raise ValueError(f"Expected descriptors of shape (n, {self.dim}), got {query.shape}")
+        sizes = [len(query) for query in queries]
+
+        self.refresh()
+        snapshot = self._snapshot
+        if snapshot.rows == 0 or sum(sizes) == 0:
+            return [[] for _ in queries]
+        query = np.concatenate(queries)
+        if report_filter is None:
+            dists, owners = self._nearest(snapshot, query, neighbors)
+        else:
+            allowed = snapshot.filter_mask(report_filter)
+            allowed_rows = int(snapshot.counts[allowed].sum())
+            if allowed_rows == 0:
+                return [[] for _ in queries]
+            if self.search_mode == 'exact' or allowed_rows <= FILTER_SCAN_ROWS \
+                    or allowed_rows * FILTER_MAX_OVERFETCH < snapshot.rows:
+                dists, owners = self._scan_reports(snapshot, query, neighbors, allowed)
+            else:
+                fetch = int(np.ceil(neighbors * snapshot.rows / allowed_rows))
+                dists, owners = self._nearest(snapshot, query, neighbors, allowed, fetch)
+        if exclude is not None:
+            excluded = np.repeat([snapshot.owner_index.get(str(r), -1) for r in exclude], sizes)
+            dropped = (owners == excluded[:, None]) & (owners >= 0)
+            owners[dropped] = -1
+            dists[dropped] = np.inf
+            order = np.argsort(dists, axis=1, kind='stable')
+            dists = np.take_along_axis(dists, order, axis=1)
+            owners = np.take_along_axis(owners, order, axis=1)
+        found = owners >= 0
+        k = dists.shape[1]
+
+        best_owner = owners[:, 0]
+        if k > 1:
+            # First neighbour from a different report, or the farthest one if all agree
+            other = (owners != best_owner[:, None]) & found
+            second_col = np.where(other.any(axis=1), other.argmax(axis=1), k - 1)
+            second_dist = dists[np.arange(len(dists)), second_col]
+            # FLANN returns squared L2 distances, and plain bit counts for Hamming
+            ratio = ratio_threshold if self.norm == NORM_HAMMING else ratio_threshold ** 2
+            passed = dists[:, 0] < ratio * second_dist
+        else:
+            passed = np.ones(len(query), dtype=bool)
+        passed &= found[:, 0]
+
+        results = []
+        start = 0
+        for size in sizes:
+            voters, votes = np.unique(best_owner[start:start + size][passed[start:start + size]], return_counts=True)
+            ranked = np.argsort(-votes, kind='stable')[:top_k]
+            results.append([
+                {
+                    'report_id': snapshot.owner_ids[voters[i]],
+                    'votes': int(votes[i]),
+                    'vote_ratio': round(float(votes[i]) / size, 4)
+                }
+                for i in ranked
+            ])
+            start += size
+        return results
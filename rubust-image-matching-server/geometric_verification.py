@@ -0,0 +1,40 @@
+"""
+RANSAC geometric verification of ratio-test matches
+
+Matches that survive the ratio test can still be scattered at random over the
+two images. Fitting a homography (or fundamental matrix) to the matched
+keypoint coordinates with RANSAC keeps only the matches consistent with one
+camera motion, and their count is a much sharper similarity signal than the
+raw match count. It is also far more expensive, so callers run it as the last
+stage of a cascade, on the few candidates that survive the cheap stages.
+"""
+import cv2
+import numpy as np
+
+from metrics import timed
+
+# Fewer matches than this cannot give a meaningful fit
+MIN_MATCHES = {'homography': 8, 'fundamental': 12}
+RANSAC_REPROJECTION_THRESHOLD = 5.0
+
+
+def verify_matches(points1, points2, model='homography', threshold=RANSAC_REPROJECTION_THRESHOLD):
+    """
+    Number of RANSAC inliers among matched (n, 2) point arrays
+    Returns (inlier count, whether a model was found)
+    """
+    if model not in MIN_MATCHES:
+        raise ValueError(f'Unknown verification model: {model}')
+    if len(points1) < MIN_MATCHES[model]:
+        return 0, False
+
+    points1 = np.ascontiguousarray(points1, dtype=np.float32)
+    points2 = np.ascontiguousarray(points2, dtype=np.float32)
+    with timed('ransac'):
+        if model == 'homography':
+            matrix, mask = cv2.findHomography(points1, points2, cv2.RANSAC, threshold)
+        else:
+            matrix, mask = cv2.findFundamentalMat(points1, points2, cv2.FM_RANSAC, threshold, 0.99)
+    if matrix is None or mask is None:
+        return 0, False
+    return int(mask.sum()), True
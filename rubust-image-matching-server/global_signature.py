@@ -0,0 +1,151 @@
+"""
+VLAD global image signatures for shortlisting candidates before SIFT matching
+
+A codebook of k SIFT cluster centres is trained offline with k-means. An
+image's signature aggregates the residuals of its descriptors to their nearest
+centre (VLAD), with intra-normalization, signed square root and L2
+normalization, so two images are compared with a single dot product instead
+of a full nearest-neighbour ratio test.
+
+Train a codebook from a folder of report photos:
+
+    python global_signature.py --images ./photos --k 16 --output codebook.npy
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from feature_cache import content_hash
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff'}
+
+
+def load_codebook(path):
+    """(k, dim) float32 codebook from a .npy file, None if the file does not exist"""
+    if not path or not os.path.exists(path):
+        return None
+    codebook = np.load(path).astype(np.float32)
+    if codebook.ndim != 2:
+        raise ValueError(f'Codebook {path} must be a 2-D array, got shape {codebook.shape}')
+    return codebook
+
+
+def codebook_id(codebook):
+    """Short identifier stored with signatures, so signatures of different codebooks are never compared"""
+    return content_hash(codebook)[:12]
+
+
+def vlad_signature(descriptors, codebook):
+    """L2-normalized VLAD vector of length k * dim (all zeros for an image without descriptors)"""
+    k, dim = codebook.shape
+    if descriptors is None or len(descriptors) == 0:
+        return np.zeros(k * dim, dtype=np.float32)
+    descriptors = np.asarray(descriptors, dtype=np.float32)
+
+    # Nearest centre of every descriptor; |d|^2 is the same for all centres and can be dropped
+    distances = (codebook * codebook).sum(axis=1)[None, :] - 2.0 * (descriptors @ codebook.T)
+    assignment = distances.argmin(axis=1)
+
+    # Sum of residuals per centre as one matrix product with the one-hot assignment
+    one_hot = np.zeros((k, len(descriptors)), dtype=np.float32)
+    one_hot[assignment, np.arange(len(descriptors))] = 1.0
+    vlad = one_hot @ (descriptors - codebook[assignment])
+
+    # Intra-normalization keeps bursty clusters from dominating, then signed sqrt and L2
+    norms = np.linalg.norm(vlad, axis=1, keepdims=True)
+    vlad = np.divide(vlad, norms, out=np.zeros_like(vlad), where=norms > 0).ravel()
+    vlad = np.sign(vlad) * np.sqrt(np.abs(vlad))
+    norm = np.linalg.norm(vlad)
+    return vlad / norm if norm > 0 else vlad
+
+
+def train_codebook(descriptors, k=16, iterations=50, attempts=3, seed=0):
+    """k-means centres of a (n, dim) float32 descriptor sample"""
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.float32)
+    if len(descriptors) < k:
+        raise ValueError(f'Need at least {k} descriptors to train {k} clusters, got {len(descriptors)}')
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, iterations, 1e-3)
+    _, _, centres = cv2.kmeans(descriptors, k, None, criteria, attempts, cv2.KMEANS_PP_CENTERS)
+    return centres.astype(np.float32)
+
+
+def image_paths(folder):
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(root, name)
+
+
+def sample_descriptors(folder, max_descriptors, seed=0, nfeatures=200, contrast_threshold=0.08, max_dimension=1024):
+    """
+    Raw SIFT descriptors of every image under folder, randomly subsampled to max_descriptors
+    The extraction parameters must match the SIFT entry of extractors.py
+    Returns (descriptors, number of images)
+    """
+    from detectors import get_detector
+    from extraction_pool import compute_features
+
+    sift = get_detector('sift', nfeatures=nfeatures, contrastThreshold=contrast_threshold)
+    samples = []
+    paths = list(image_paths(folder))
+    for count, path in enumerate(paths, 1):
+        try:
+            with open(path, 'rb') as f:
+                features = compute_features(f.read(), sift, max_dimension, nfeatures)
+        except Exception as e:
+            print(f'Skipping {path}: {e}', file=sys.stderr)
+            continue
+        if features['descriptors'] is not None:
+            samples.append(features['descriptors'])
+        if count % 100 == 0:
+            print(f'{count}/{len(paths)} images', file=sys.stderr)
+
+    if not samples:
+        raise ValueError(f'No descriptors extracted from {folder}')
+    descriptors = np.concatenate(samples)
+    if len(descriptors) > max_descriptors:
+        rng = np.random.default_rng(seed)
+        descriptors = descriptors[rng.choice(len(descriptors), max_descriptors, replace=False)]
+    return descriptors, len(paths)
+
+
+def add_extraction_arguments(parser):
+    """Training image options shared by the offline training commands"""
+    parser.add_argument('--images', required=True, help='folder searched recursively for images')
+    parser.add_argument('--max-descriptors', type=int, default=200000, help='random sample size for training')
+    parser.add_argument('--seed', type=int, default=0)
+    # Must match the SIFT entry of extractors.py
+    parser.add_argument('--nfeatures', type=int, default=200)
+    parser.add_argument('--contrast-threshold', type=float, default=0.08)
+    parser.add_argument('--max-dimension', type=int, default=1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a VLAD codebook from a folder of images')
+    add_extraction_arguments(parser)
+    parser.add_argument('--output', default='codebook.npy')
+    parser.add_argument('--k', type=int, default=16, help='number of visual words')
+    args = parser.parse_args()
+
+    started = time.time()
+    try:
+        descriptors, image_count = sample_descriptors(
+            args.images, args.max_descriptors, args.seed,
+            args.nfeatures, args.contrast_threshold, args.max_dimension
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    codebook = train_codebook(descriptors, args.k, seed=args.seed)
+    np.save(args.output, codebook)
+    print(f'Trained {args.k} words from {len(descriptors)} descriptors of {image_count} images '
+          f'in {time.time() - started:.1f}s; codebook {codebook_id(codebook)} written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
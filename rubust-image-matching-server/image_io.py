@@ -0,0 +1,103 @@
+"""
+In-memory image decoding for uploads
+
+Uploads are decoded straight from the request bytes with cv2.imdecode instead
+of being written to disk and read back. JPEGs larger than the target size are
+decoded with libjpeg's DCT scaling (IMREAD_REDUCED_GRAYSCALE_2/4/8), so the
+full-resolution bitmap is never materialised before the final downscale.
+"""
+import struct
+
+import cv2
+import numpy as np
+
+from metrics import timed
+
+REDUCED_GRAYSCALE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# JPEG start-of-frame markers carrying the image size (excludes DHT, JPG and DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_dimensions(data):
+    """
+    Read (height, width) from a JPEG header without decoding it
+    Returns None if data is not a JPEG or the header cannot be parsed
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length field
+            offset += 2
+            continue
+        length = struct.unpack_from('>H', data, offset + 2)[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from('>HH', data, offset + 5)
+            return height, width
+        offset += 2 + length
+    return None
+
+
+def decode_image(data, max_dimension=None):
+    """
+    Decode encoded image bytes to a grayscale array
+    When max_dimension is given, large JPEGs are decoded at the largest
+    power-of-two reduction that still leaves at least max_dimension pixels
+    on the long side, and the result is then resized to max_dimension.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    flag = cv2.IMREAD_GRAYSCALE
+
+    if max_dimension:
+        dimensions = jpeg_dimensions(data)
+        if dimensions:
+            longest = max(dimensions)
+            for factor, reduced_flag in REDUCED_GRAYSCALE_FLAGS:
+                if longest // factor >= max_dimension:
+                    flag = reduced_flag
+                    break
+
+    with timed('decode'):
+        img = cv2.imdecode(buffer, flag)
+    if img is None:
+        raise ValueError("Could not load image")
+
+    if max_dimension and max(img.shape) > max_dimension:
+        scale = max_dimension / max(img.shape)
+        new_width = int(img.shape[1] * scale)
+        new_height = int(img.shape[0] * scale)
+        with timed('resize'):
+            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def read_image_bytes(source):
+    """
+    Return the encoded bytes of an image given as bytes, a file-like object or a file path
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def load_image(source, max_dimension=None):
+    """
+    Decode an image from bytes, a file-like object or a file path
+    """
+    return decode_image(read_image_bytes(source), max_dimension)
@@ -0,0 +1,208 @@
+"""
+Per-stage timing and memory metrics
+
+Pipeline stages (upload read, decode, resize, detectAndCompute, serialization,
+base64 decode, nearest-neighbour search, ratio test) are wrapped in
+timed(stage). Each measurement goes into a process-wide histogram, exposed in
+Prometheus text format by render(), and into the timings of the current
+request, which app.py returns in a Server-Timing header.
+
+Histograms are per process: with several gunicorn workers each one reports its
+own series, labelled with its pid.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds in seconds, up to the 120s gunicorn timeout
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe histograms keyed by (metric name, labels) and labelled counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {
+                key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()
+            }
+            return histograms, dict(self._counters)
+
+
+registry = MetricsRegistry()
+_request = threading.local()
+
+HELP = {
+    'lostmatch_stage_seconds': 'Time spent in each pipeline stage',
+    'lostmatch_request_seconds': 'Request duration by endpoint',
+    'lostmatch_requests_total': 'Requests by endpoint and status code',
+}
+
+
+def start_request():
+    """Start collecting the stage timings of the current request in this thread"""
+    _request.timings = []
+    _request.started = time.perf_counter()
+
+
+def request_timings():
+    """(stage, seconds) pairs recorded by this thread since start_request()"""
+    return list(getattr(_request, 'timings', None) or [])
+
+
+def request_elapsed():
+    started = getattr(_request, 'started', None)
+    return None if started is None else time.perf_counter() - started
+
+
+def record(stage, seconds):
+    registry.observe('lostmatch_stage_seconds', {'stage': stage}, seconds)
+    timings = getattr(_request, 'timings', None)
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    """Record the wall time of the enclosed block under the given stage name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings, total=None):
+    """Server-Timing value with the time of repeated stages summed, in milliseconds"""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    if total is not None:
+        totals['total'] = total
+    return ', '.join(f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in totals.items())
+
+
+def rss_bytes():
+    """Current resident set size (Linux), None elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def render(extra=None):
+    """
+    Prometheus text exposition of all histograms, counters and memory gauges
+    extra: optional [(name, 'counter' or 'gauge', help, [(labels dict, value), ...])]
+    for values owned by other components, such as cache statistics
+    """
+    pid = str(os.getpid())
+    histograms, counters = registry.snapshot()
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for name in sorted({key[0] for key in histograms}):
+        header(name, 'histogram', HELP.get(name, name))
+        for (metric, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            labels = labels + (('pid', pid),)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    for name in sorted({key[0] for key in counters}):
+        header(name, 'counter', HELP.get(name, name))
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels + (("pid", pid),))} {value}')
+
+    rss = rss_bytes()
+    peak = peak_rss_bytes()
+    if rss is not None and peak is not None:
+        # ru_maxrss is only updated periodically and can trail the current value
+        peak = max(peak, rss)
+    memory = {
+        'lostmatch_process_resident_memory_bytes': ('Resident set size of this worker', rss),
+        'lostmatch_process_peak_resident_memory_bytes': ('Peak resident set size of this worker', peak),
+    }
+    for name, (help_text, value) in memory.items():
+        if value is not None:
+            header(name, 'gauge', help_text)
+            lines.append(f'{name}{_format_labels((("pid", pid),))} {value}')
+
+    for name, kind, help_text, samples in extra or []:
+        header(name, kind, help_text)
+        for labels, value in samples:
+            lines.append(f'{name}{_format_labels(tuple(sorted(labels.items())) + (("pid", pid),))} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,191 @@
+"""
+Offline re-indexing of a whole image corpus
+
+When the extractor settings change (nfeatures, contrastThreshold,
+max_dimension, descriptor format), every stored feature set goes stale. This
+command re-extracts a local corpus on all cores and writes the features to a
+sharded index directory (see shard_store.py) instead of pushing every image
+through HTTP:
+
+    python reindex.py --images ./photos --output ./index
+    python reindex.py --manifest images.txt --output ./index --workers 8 --nfeatures 300
+
+A manifest has one image per line, either a path or "id<TAB>path"; relative
+paths are resolved against the manifest's directory. Images found under
+--images are identified by their path relative to it.
+
+Shards are committed as they fill up, and on Ctrl-C. Running the same command
+again skips every image of the committed shards, so an interrupted run resumes
+where it stopped. Failed images are recorded in the shard manifests and not
+retried.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+
+from descriptor_codec import DescriptorCodec
+from detectors import get_detector
+from extraction_pool import compute_features
+from extractors import EXTRACTORS, get_extractor
+from global_signature import image_paths
+from shard_store import ShardWriter
+
+# Descriptor rows per shard (128MB of raw SIFT)
+DEFAULT_SHARD_ROWS = 256 * 1024
+PROGRESS_SECONDS = 5.0
+
+_worker = None
+
+
+def _init_worker(detector, params, max_dimension, max_keypoints, pca_path, precision):
+    global _worker
+    # One process per core; avoid OpenCV spawning its own threads on top
+    cv2.setNumThreads(1)
+    codec = DescriptorCodec.load(pca_path, precision) if pca_path else None
+    _worker = (get_detector(detector, **params), max_dimension, max_keypoints, codec)
+
+
+def _extract(task):
+    """(id, path, features or None, error or None) of one image, run in a pool process"""
+    image_id, path = task
+    detector, max_dimension, max_keypoints, codec = _worker
+    try:
+        with open(path, 'rb') as f:
+            features = compute_features(f.read(), detector, max_dimension, max_keypoints)
+        if codec is not None and features['descriptors'] is not None:
+            features['descriptors'] = codec.encode(features['descriptors'])
+        return image_id, path, features, None
+    except Exception as e:
+        return image_id, path, None, str(e)
+
+
+def list_images(images_dir=None, manifest=None):
+    """(id, path) of every image to index, from a directory walk or a manifest file"""
+    if images_dir:
+        for path in image_paths(images_dir):
+            yield os.path.relpath(path, images_dir).replace(os.sep, '/'), path
+        return
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            image_id, _, path = line.partition('\t') if '\t' in line else (line, '', line)
+            yield image_id, os.path.join(base, path)
+
+
+def index_config(args, extractor, params, max_keypoints, codec):
+    """Settings stored in index.json; resuming with different ones is refused"""
+    return {
+        'extractor': extractor.name,
+        'params': params,
+        'max_keypoints': max_keypoints,
+        'max_dimension': args.max_dimension,
+        'descriptor_format': codec.format if codec is not None else extractor.format,
+        'dim': codec.dim if codec is not None else extractor.dim,
+        'dtype': str(codec.dtype if codec is not None else extractor.dtype)
+    }
+
+
+def reindex(tasks, writer, workers, init_args, total):
+    """Extract tasks on a process pool and append the results to writer, reporting throughput"""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    started = last_report = time.time()
+    processed = failed = 0
+
+    def report(final=False):
+        elapsed = max(time.time() - started, 1e-9)
+        rate = processed / elapsed
+        eta = (total - processed) / rate if rate > 0 and not final else 0
+        print(f'{processed}/{total} images, {failed} failed, {rate:.1f} images/s'
+              + ('' if final else f', ETA {eta:.0f}s'), file=sys.stderr)
+
+    pool = context.Pool(workers, initializer=_init_worker, initargs=init_args)
+    try:
+        for image_id, path, features, error in pool.imap_unordered(_extract, tasks, chunksize=4):
+            if error is None:
+                writer.add(image_id, path, features)
+            else:
+                writer.add_failure(image_id, path, error)
+                failed += 1
+            processed += 1
+            if time.time() - last_report >= PROGRESS_SECONDS:
+                report()
+                last_report = time.time()
+        pool.close()
+    except KeyboardInterrupt:
+        print('Interrupted; committing the images done so far', file=sys.stderr)
+        pool.terminate()
+        raise
+    finally:
+        # Everything received so far is kept for the next run
+        writer.close()
+        pool.join()
+        report(final=True)
+    return processed, failed, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-extract the features of an image corpus into a sharded index')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--images', help='folder searched recursively for images')
+    source.add_argument('--manifest', help='file with one path, or id<TAB>path, per line')
+    parser.add_argument('--output', required=True, help='index directory, resumed if it exists')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS, help='descriptor rows per shard')
+    parser.add_argument('--extractor', default='sift', choices=sorted(EXTRACTORS))
+    parser.add_argument('--nfeatures', type=int, help="detector feature limit (default: the extractor's)")
+    parser.add_argument('--contrast-threshold', type=float, help='SIFT contrastThreshold')
+    parser.add_argument('--max-dimension', type=int, default=1024)
+    parser.add_argument('--descriptor-format', default='sift', choices=('sift', 'rootsift-pca-f16', 'rootsift-pca-u8'))
+    parser.add_argument('--pca', default='pca.npz', help='projection of the rootsift-pca formats')
+    args = parser.parse_args()
+
+    extractor = get_extractor(args.extractor)
+    params = dict(extractor.params)
+    max_keypoints = extractor.max_keypoints
+    if args.nfeatures is not None:
+        if 'nfeatures' not in params:
+            parser.error(f'{extractor.name} has no nfeatures parameter')
+        params['nfeatures'] = max_keypoints = args.nfeatures
+    if args.contrast_threshold is not None:
+        if extractor.name != 'sift':
+            parser.error('--contrast-threshold applies to sift only')
+        params['contrastThreshold'] = args.contrast_threshold
+
+    codec = None
+    pca_path = precision = None
+    if args.descriptor_format != 'sift':
+        if extractor.name != 'sift':
+            parser.error(f'{args.descriptor_format} compresses SIFT descriptors, not {extractor.name}')
+        precision = args.descriptor_format.rsplit('-', 1)[1]
+        pca_path = args.pca
+        codec = DescriptorCodec.load(pca_path, precision)
+
+    try:
+        writer = ShardWriter(args.output, index_config(args, extractor, params, max_keypoints, codec), args.shard_rows)
+        images = list(list_images(args.images, args.manifest))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    tasks = [(image_id, path) for image_id, path in dict(images).items() if image_id not in writer.done]
+    print(f'{len(images)} images, {len(images) - len(tasks)} already indexed in {args.output}', file=sys.stderr)
+    if not tasks:
+        return
+
+    init_args = (extractor.detector, params, args.max_dimension, max_keypoints, pca_path, precision)
+    try:
+        processed, failed, elapsed = reindex(tasks, writer, args.workers, init_args, len(tasks))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    print(f'Indexed {processed - failed} images ({failed} failed) in {elapsed:.1f}s with {args.workers} workers, '
+          f'{processed / max(elapsed, 1e-9):.1f} images/s; {writer.committed} shards written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Sharded, memory-mappable feature files written by reindex.py
+
+An index directory holds an index.json describing how the features were
+extracted, and any number of shards:
+
+    index.json          extractor, detector parameters, max_dimension, descriptor_format, dim, dtype
+    shard-00000.desc    raw descriptor rows (dtype and dim from index.json)
+    shard-00000.kp      (rows, 4) float32 keypoints x, y, size, angle, aligned with the descriptors
+    shard-00000.json    ID manifest: for each image its id, source path, first row, row count and
+                        image shape, plus the images that failed to extract
+
+A shard's data files are written under temporary names and renamed into place
+before its manifest, and the manifest is itself replaced atomically, so a
+shard exists only once it is complete. Data files without a manifest belong to
+an interrupted run and are discarded when the index is opened for writing.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+SHARD_PATTERN = re.compile(r'^shard-(\d{5})\.json$')
+KEYPOINT_COLUMNS = 4
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def shard_name(number):
+    return f'shard-{number:05d}'
+
+
+def shard_numbers(index_dir):
+    """Numbers of the committed shards of an index directory, in order"""
+    if not os.path.isdir(index_dir):
+        return []
+    return sorted(int(m.group(1)) for m in map(SHARD_PATTERN.match, os.listdir(index_dir)) if m)
+
+
+def read_config(index_dir):
+    """index.json of an index directory, None if there is none yet"""
+    path = os.path.join(index_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class Shard:
+    """One committed shard, with its descriptors and keypoints memory-mapped read-only"""
+
+    def __init__(self, index_dir, number, config):
+        self.name = shard_name(number)
+        with open(os.path.join(index_dir, self.name + '.json')) as f:
+            manifest = json.load(f)
+        self.images = manifest['images']
+        self.failed = manifest['failed']
+        self.rows = manifest['rows']
+        self.descriptor_format = config['descriptor_format']
+        dim = config['dim']
+        if self.rows:
+            self.descriptors = np.memmap(
+                os.path.join(index_dir, self.name + '.desc'), dtype=config['dtype'], mode='r',
+                shape=(self.rows, dim)
+            )
+            self.keypoints = np.memmap(
+                os.path.join(index_dir, self.name + '.kp'), dtype=np.float32, mode='r',
+                shape=(self.rows, KEYPOINT_COLUMNS)
+            )
+        else:
+            self.descriptors = np.empty((0, dim), dtype=config['dtype'])
+            self.keypoints = np.empty((0, KEYPOINT_COLUMNS), dtype=np.float32)
+
+    def features(self, entry):
+        """Features of one manifest entry in the layout of detect_sift_features (views into the shard)"""
+        start, count = entry['start'], entry['count']
+        return {
+            'keypoints': self.keypoints[start:start + count],
+            'descriptors': self.descriptors[start:start + count] if count else None,
+            'image_shape': tuple(entry['image_shape']),
+            'descriptor_format': self.descriptor_format
+        }
+
+
+def open_shards(index_dir):
+    """Config and committed shards of an index directory"""
+    config = read_config(index_dir)
+    if config is None:
+        raise FileNotFoundError(f'No {INDEX_FILE} in {index_dir}')
+    return config, [Shard(index_dir, number, config) for number in shard_numbers(index_dir)]
+
+
+class ShardWriter:
+    """
+    Appends extracted features to an index directory, one shard at a time
+
+    Rows are streamed to the data files of the open shard, so memory holds only
+    its ID manifest. A shard is committed once it reaches shard_rows
+    descriptors, and on close().
+    """
+
+    def __init__(self, index_dir, config, shard_rows):
+        self.index_dir = index_dir
+        self.config = config
+        self.dtype = np.dtype(config['dtype'])
+        self.dim = config['dim']
+        self.shard_rows = shard_rows
+        os.makedirs(index_dir, exist_ok=True)
+
+        stored = read_config(index_dir)
+        if stored is not None and stored != config:
+            changed = sorted(key for key in set(stored) | set(config) if stored.get(key) != config.get(key))
+            raise ValueError(
+                f"{index_dir} was indexed with different settings ({', '.join(changed)}); "
+                'use a new output directory'
+            )
+        _write_json(os.path.join(index_dir, INDEX_FILE), config)
+
+        numbers = shard_numbers(index_dir)
+        self.done = set()
+        for number in numbers:
+            with open(self._path(number, '.json')) as f:
+                manifest = json.load(f)
+            self.done.update(entry['id'] for entry in manifest['images'])
+            self.done.update(entry['id'] for entry in manifest['failed'])
+        self._number = numbers[-1] + 1 if numbers else 0
+        self._discard_uncommitted()
+        self._files = None
+        self.committed = 0
+
+    def _path(self, number, suffix):
+        return os.path.join(self.index_dir, shard_name(number) + suffix)
+
+    def _discard_uncommitted(self):
+        committed = {shard_name(number) for number in shard_numbers(self.index_dir)}
+        for name in os.listdir(self.index_dir):
+            if name.startswith('shard-') and name.split('.', 1)[0] not in committed:
+                os.remove(os.path.join(self.index_dir, name))
+
+    def _open(self):
+        self._files = (
+            open(self._path(self._number, '.desc.tmp'), 'wb'),
+            open(self._path(self._number, '.kp.tmp'), 'wb')
+        )
+        self._images = []
+        self._failed = []
+        self._rows = 0
+
+    def add(self, image_id, path, features):
+        """Append the features of one image (as returned by compute_features)"""
+        if self._files is None:
+            self._open()
+        descriptors = features['descriptors']
+        count = 0 if descriptors is None else len(descriptors)
+        if count:
+            descriptors = np.ascontiguousarray(descriptors, dtype=self.dtype)
+            if descriptors.shape[1] != self.dim:
+                raise ValueError(f'Expected descriptors of shape (n, {self.dim}), got {descriptors.shape}')
+            self._files[0].write(descriptors.tobytes())
+            self._files[1].write(np.ascontiguousarray(features['keypoints'][:count], dtype=np.float32).tobytes())
+        self._images.append({
+            'id': image_id,
+            'path': path,
+            'start': self._rows,
+            'count': count,
+            'image_shape': [int(v) for v in features['image_shape'][:2]]
+        })
+        self._rows += count
+        self.done.add(image_id)
+        if self._rows >= self.shard_rows:
+            self.commit()
+
+    def add_failure(self, image_id, path, error):
+        if self._files is None:
+            self._open()
+        self._failed.append({'id': image_id, 'path': path, 'error': error})
+        self.done.add(image_id)
+
+    def commit(self):
+        """Publish the open shard: data files first, then its manifest"""
+        if self._files is None:
+            return
+        for f in self._files:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self._files = None
+        for suffix in ('.desc', '.kp'):
+            os.replace(self._path(self._number, suffix + '.tmp'), self._path(self._number, suffix))
+        _write_json(self._path(self._number, '.json'), {
+            'rows': self._rows,
+            'images': self._images,
+            'failed': self._failed
+        })
+        self.committed += 1
+        self._number += 1
+
+    def close(self):
+        self.commit()
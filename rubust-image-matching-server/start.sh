@@ -7,4 +7,10 @@ PORT=${PORT:-5000}
 echo "Starting application on port $PORT..."
 
 # Start with gunicorn
-exec gunicorn --bind 0.0.0.0:$PORT --workers 2 --timeout 120 --log-level info --access-logfile - --error-logfile - app:app
+if [ "${EXTRACTION_POOL_WORKERS:-0}" -gt 0 ]; then
+    # SIFT runs in the extraction pool; one HTTP worker with threads only waits on it,
+    # so /health is still answered while the pool is busy
+    exec gunicorn --bind 0.0.0.0:$PORT --workers 1 --threads ${GUNICORN_THREADS:-8} --timeout 120 --log-level info --access-logfile - --error-logfile - app:app
+else
+    exec gunicorn --bind 0.0.0.0:$PORT --workers 2 --timeout 120 --log-level info --access-logfile - --error-logfile - app:app
+fi
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The server modules are flat files next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing app opens its gallery; keep it out of the working tree
+os.environ.setdefault('GALLERY_FOLDER', tempfile.mkdtemp(prefix='gallery-'))
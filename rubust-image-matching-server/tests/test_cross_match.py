@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+import cross_match
+from gallery import DescriptorGallery
+from report_filter import ReportFilter
+
+
+def test_cross_match_images(tmp_path):
+    gallery = DescriptorGallery(str(tmp_path / 'gallery'), dim=16, search='exact')
+    rng = np.random.default_rng(1)
+    descriptors = {f'report-{i}': rng.random((20, 16), dtype=np.float32) * 100 for i in range(6)}
+    for i, (report_id, rows) in enumerate(descriptors.items()):
+        gallery.add(report_id, rows, {'report_type': 'lost' if i < 2 else 'found'})
+    # Each lost report has a found near-duplicate
+    gallery.add('found-0', descriptors['report-0'] + 0.5, {'report_type': 'found'})
+    gallery.add('found-1', descriptors['report-1'] + 0.5, {'report_type': 'found'})
+
+    output = str(tmp_path / 'images.jsonl')
+    total, _ = cross_match.cross_match(
+        gallery, output, ReportFilter.parse({'report_type': 'lost'}), ReportFilter.parse({'report_type': 'found'}),
+        top_k=3, ratio_threshold=0.75, workers=2, tile_rows=10
+    )
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+    assert total == 2
+    assert [line['id'] for line in lines] == ['report-0', 'report-1']
+    assert [line['candidates'][0]['report_id'] for line in lines] == ['found-0', 'found-1']
+    assert all(line['descriptors'] == 20 for line in lines)
+
+
+def test_cli_rejects_tile_rows_below_one(tmp_path):
+    result = subprocess.run(
+        [sys.executable, cross_match.__file__, '--gallery', str(tmp_path), '--output', str(tmp_path / 'out'),
+         '--tile-rows', '0'],
+        capture_output=True, text=True
+    )
+    assert result.returncode == 2
+    assert '--tile-rows must be at least 1' in result.stderr
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pytest
+
+from gallery import DescriptorGallery
+from report_filter import ReportFilter
+
+DIM = 16
+
+
+def descriptors(seed, rows=30):
+    return np.random.default_rng(seed).random((rows, DIM), dtype=np.float32) * 100
+
+
+def noisy(seed, rows=30):
+    return descriptors(seed, rows) + np.random.default_rng(1000 + seed).normal(0, 0.5, (rows, DIM)).astype(np.float32)
+
+
+def open_gallery(storage_dir, search='exact', segment_rows=100):
+    # Background compaction never triggers; the tests call compact() themselves
+    return DescriptorGallery(storage_dir, dim=DIM, search=search, segment_rows=segment_rows, compact_dead_fraction=2.0)
+
+
+def best_match(gallery, seed):
+    results = gallery.search(noisy(seed), top_k=3)
+    return results[0]['report_id'] if results else None
+
+
+def votes(gallery, seed):
+    """report_id -> votes of the noisy copy of descriptors(seed)"""
+    return {r['report_id']: r['votes'] for r in gallery.search(noisy(seed), top_k=10)}
+
+
+@pytest.fixture(params=['disk', 'memory'])
+def storage_dir(request, tmp_path):
+    return str(tmp_path) if request.param == 'disk' else None
+
+
+@pytest.mark.parametrize('search', ['exact', 'flann'])
+def test_add_and_search(storage_dir, search):
+    gallery = open_gallery(storage_dir, search)
+    for seed in range(5):
+        gallery.add(f'report-{seed}', descriptors(seed))
+
+    assert len(gallery) == 5
+    for seed in range(5):
+        assert best_match(gallery, seed) == f'report-{seed}'
+    assert gallery.stats()['segments'] == 2
+
+
+def test_removed_and_replaced_reports_are_tombstones(storage_dir):
+    gallery = open_gallery(storage_dir)
+    for seed in range(3):
+        gallery.add(f'report-{seed}', descriptors(seed))
+    assert gallery.remove('report-0')
+    assert not gallery.remove('report-0')
+    gallery.add('report-1', descriptors(7))
+
+    assert 'report-0' not in gallery
+    assert gallery.stats()['deleted_descriptors'] == 60
+    # The old rows no longer vote: what is left is the odd chance match
+    assert max(votes(gallery, 0).values(), default=0) < 10
+    assert max(votes(gallery, 1).values(), default=0) < 10
+    assert votes(gallery, 7) == {'report-1': 30}
+
+
+def test_compact_then_search(storage_dir):
+    gallery = open_gallery(storage_dir)
+    for seed in range(6):
+        gallery.add(f'report-{seed}', descriptors(seed))
+    for seed in (0, 1, 3):
+        gallery.remove(f'report-{seed}')
+
+    assert gallery.compact(min_dead_fraction=0.3) == 2
+    stats = gallery.stats()
+    assert stats['deleted_descriptors'] == 0
+    assert stats['descriptors'] == 90
+    for seed in (2, 4, 5):
+        assert best_match(gallery, seed) == f'report-{seed}'
+    np.testing.assert_array_equal(dict(gallery.reports())['report-4'], descriptors(4))
+    assert gallery.compact(min_dead_fraction=0.3) == 0
+
+    if storage_dir:
+        assert sorted(os.listdir(storage_dir)) == ['.lock', 'reports.json', 'segment-00002.f32']
+        reopened = open_gallery(storage_dir)
+        assert sorted(report_id for report_id, _ in reopened.reports()) == ['report-2', 'report-4', 'report-5']
+        assert best_match(reopened, 5) == 'report-5'
+
+
+@pytest.mark.parametrize('search', ['exact', 'flann'])
+def test_compact_keeps_writes_made_while_it_copies(storage_dir, search):
+    gallery = open_gallery(storage_dir, search)
+    for seed in range(4):
+        gallery.add(f'report-{seed}', descriptors(seed))
+    gallery.remove('report-0')
+
+    write_rows = gallery._write_rows
+
+    def write_during_compaction(name, start, rows):
+        write_rows(name, start, rows)
+        if name.startswith('compacting-'):
+            # The writer lock is free while the new segment is prepared
+            gallery.remove('report-1')
+            gallery.add('report-2', descriptors(8))
+            gallery.add('report-9', descriptors(9))
+
+    gallery._write_rows = write_during_compaction
+    assert gallery.compact(min_dead_fraction=0.3) == 1
+
+    assert sorted(report_id for report_id, _ in gallery.reports()) == ['report-2', 'report-3', 'report-9']
+    for seed, report_id in ((8, 'report-2'), (3, 'report-3'), (9, 'report-9')):
+        assert best_match(gallery, seed) == report_id
+    assert max(votes(gallery, 1).values(), default=0) < 10
+    # The copies of report-1 and of the replaced report-2 are tombstones of the new segment
+    assert gallery.stats()['deleted_descriptors'] == 60
+    if storage_dir:
+        assert not [name for name in os.listdir(storage_dir) if name.startswith('compacting-')]
+
+
+def test_search_with_a_filter(storage_dir):
+    gallery = open_gallery(storage_dir)
+    gallery.add('lost-phone', descriptors(0), {'category': 'phone', 'report_type': 'lost'})
+    gallery.add('found-phone', descriptors(1), {'category': 'phone', 'report_type': 'found'})
+    gallery.add('found-bag', descriptors(2), {'category': 'bag', 'report_type': 'found'})
+
+    found = ReportFilter.parse({'report_type': 'found'})
+    results = gallery.search(noisy(0), top_k=5, report_filter=found)
+    assert 'lost-phone' not in [r['report_id'] for r in results]
+    assert gallery.search(noisy(1), top_k=1, report_filter=found)[0]['report_id'] == 'found-phone'
+    assert [report_id for report_id, _ in gallery.reports(ReportFilter.parse({'category': 'bag'}))] == ['found-bag']
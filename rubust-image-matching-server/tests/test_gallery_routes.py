@@ -0,0 +1,44 @@
+import io
+import json
+
+import pytest
+
+import app as server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'gallery', server.DescriptorGallery(
+        str(tmp_path), dim=server.gallery.dim, descriptor_format=server.STORED_FORMAT, norm=server.gallery.norm
+    ))
+    calls = []
+    monkeypatch.setattr(server, 'extract_sift_features', lambda data: calls.append(data))
+    server.app.config['TESTING'] = True
+    with server.app.test_client() as client:
+        client.extractions = calls
+        yield client
+
+
+def upload(**fields):
+    return dict(fields, image=(io.BytesIO(b'not really an image'), 'photo.png'))
+
+
+def test_register_rejects_missing_report_id_before_extraction(client):
+    response = client.post('/gallery/reports', data=upload(), content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'report_id is required'
+    assert client.extractions == []
+
+
+def test_register_rejects_bad_metadata_before_extraction(client):
+    data = upload(report_id='r1', metadata=json.dumps({'report_type': 'stolen'}))
+    response = client.post('/gallery/reports', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert client.extractions == []
+
+
+def test_search_rejects_bad_parameters_before_extraction(client):
+    for fields in ({'top_k': 'many'}, {'filter': '{"colour": "red"}'}):
+        response = client.post('/search', data=upload(**fields), content_type='multipart/form-data')
+        assert response.status_code == 400
+    assert client.extractions == []
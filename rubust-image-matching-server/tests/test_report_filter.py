@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from report_filter import MetadataColumns, ReportFilter, parse_metadata
+
+
+def test_parse_metadata():
+    metadata = parse_metadata('{"category": " Phone ", "report_type": "lost", "date_from": "2024-05-01"}')
+    assert metadata == {'category': 'phone', 'report_type': 'lost', 'date_from': '2024-05-01'}
+    assert parse_metadata(None) is None
+    assert parse_metadata({}) is None
+    assert parse_metadata({'category': None, 'date_to': ''}) is None
+
+
+@pytest.mark.parametrize('value, message', [
+    ('not json', 'metadata must be a JSON object'),
+    ('["phone"]', 'metadata must be a JSON object'),
+    ({'colour': 'red'}, 'Unknown metadata fields: colour'),
+    ({'category': 3}, 'category must be a string'),
+    ({'report_type': 'stolen'}, 'report_type must be one of: lost, found'),
+    ({'date_from': '01/05/2024'}, 'date_from must be a date formatted YYYY-MM-DD'),
+    ({'date_from': '2024-05-03', 'date_to': '2024-05-01'}, 'date_from is after date_to'),
+])
+def test_parse_metadata_rejects(value, message):
+    with pytest.raises(ValueError, match=message):
+        parse_metadata(value)
+
+
+def test_parse_filter():
+    report_filter = ReportFilter.parse({'category': ['Phone', 'tablet'], 'report_type': 'found',
+                                        'date_to': '2024-05-03'})
+    assert report_filter.categories == {'phone', 'tablet'}
+    assert report_filter.report_types == {'found'}
+    assert report_filter.start is None
+    assert report_filter.end is not None
+    assert ReportFilter.parse('{"category": "bag"}').categories == {'bag'}
+    for empty in (None, '', {}, '{}'):
+        assert ReportFilter.parse(empty) is None
+
+
+@pytest.mark.parametrize('value, message', [
+    ('{', 'filter must be a JSON object'),
+    ({'owner': 'me'}, 'Unknown filter fields: owner'),
+    ({'category': ['phone', 3]}, 'filter category must be a string or a list of strings'),
+    ({'report_type': ['lost', 'stolen']}, 'report_type must be one of'),
+    ({'date_to': 'yesterday'}, 'date_to must be a date'),
+    ({'date_from': '2024-06-01', 'date_to': '2024-05-01'}, 'filter date_from is after date_to'),
+])
+def test_parse_filter_rejects(value, message):
+    with pytest.raises(ValueError, match=message):
+        ReportFilter.parse(value)
+
+
+def test_mask():
+    columns = MetadataColumns([
+        {'category': 'phone', 'report_type': 'lost', 'date_from': '2024-05-01', 'date_to': '2024-05-02'},
+        {'category': 'phone', 'report_type': 'found', 'date_from': '2024-05-04'},
+        {'category': 'bag', 'report_type': 'found', 'date_to': '2024-04-30'},
+        None,
+    ])
+
+    def mask(value):
+        return columns.mask(ReportFilter.parse(value)).tolist()
+
+    assert mask({'category': 'phone'}) == [True, True, False, False]
+    assert mask({'category': 'wallet'}) == [False, False, False, False]
+    assert mask({'report_type': 'found'}) == [False, True, True, False]
+    # Windows overlap; missing bounds are open on both sides
+    assert mask({'date_from': '2024-05-02'}) == [True, True, False, True]
+    assert mask({'date_to': '2024-05-01'}) == [True, False, True, True]
+    assert mask({'date_from': '2024-05-03', 'date_to': '2024-05-03'}) == [False, False, False, True]
+    assert mask({'category': ['phone', 'bag'], 'report_type': 'found', 'date_from': '2024-05-01'}) == \
+        [False, True, False, False]
+    assert isinstance(columns.mask(ReportFilter.parse({'category': 'phone'})), np.ndarray)
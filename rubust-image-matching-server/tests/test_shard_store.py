@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from shard_store import ShardWriter, open_shards
+
+CONFIG = {'extractor': 'sift', 'descriptor_format': 'sift-128-f32', 'dim': 128, 'dtype': 'float32'}
+
+
+def features(seed, rows):
+    rng = np.random.default_rng(seed)
+    return {
+        'keypoints': rng.random((rows, 4), dtype=np.float32),
+        'descriptors': rng.random((rows, 128), dtype=np.float32) if rows else None,
+        'image_shape': (480, 640)
+    }
+
+
+def test_shards_are_committed_by_row_count(tmp_path):
+    writer = ShardWriter(str(tmp_path), CONFIG, shard_rows=10)
+    for i in range(5):
+        writer.add(f'img-{i}', f'/images/{i}.jpg', features(i, 4))
+    writer.add_failure('broken', '/images/broken.jpg', 'cannot decode')
+    writer.close()
+
+    config, shards = open_shards(str(tmp_path))
+    assert config == CONFIG
+    # 4 + 4 + 4 rows fill the first shard, the last two images and the failure make the second
+    assert [shard.rows for shard in shards] == [12, 8]
+    assert shards[1].failed == [{'id': 'broken', 'path': '/images/broken.jpg', 'error': 'cannot decode'}]
+    entry = shards[1].images[1]
+    assert entry['id'] == 'img-4'
+    stored = shards[1].features(entry)
+    np.testing.assert_array_equal(stored['descriptors'], features(4, 4)['descriptors'])
+    np.testing.assert_array_equal(stored['keypoints'], features(4, 4)['keypoints'])
+
+
+def test_resume_discards_an_interrupted_shard(tmp_path):
+    writer = ShardWriter(str(tmp_path), CONFIG, shard_rows=8)
+    for i in range(3):
+        writer.add(f'img-{i}', f'/images/{i}.jpg', features(i, 4))
+    writer.add_failure('broken', '/images/broken.jpg', 'cannot decode')
+    # Killed with shard 1 open: its rows are only in the temporary data files
+    for f in writer._files:
+        f.flush()
+    assert os.path.exists(tmp_path / 'shard-00001.desc.tmp')
+    # A crash between the data file renames and the manifest leaves data without a manifest
+    (tmp_path / 'shard-00002.desc').write_bytes(b'partial')
+
+    resumed = ShardWriter(str(tmp_path), CONFIG, shard_rows=8)
+    assert resumed.done == {'img-0', 'img-1'}
+    assert sorted(os.listdir(tmp_path)) == ['index.json', 'shard-00000.desc', 'shard-00000.json', 'shard-00000.kp']
+
+    for i in range(2, 4):
+        if f'img-{i}' not in resumed.done:
+            resumed.add(f'img-{i}', f'/images/{i}.jpg', features(i, 4))
+    resumed.close()
+
+    _, shards = open_shards(str(tmp_path))
+    assert [[entry['id'] for entry in shard.images] for shard in shards] == [['img-0', 'img-1'], ['img-2', 'img-3']]
+    assert all(not shard.failed for shard in shards)
+    np.testing.assert_array_equal(shards[1].features(shards[1].images[0])['descriptors'], features(2, 4)['descriptors'])
+
+
+def test_images_without_descriptors(tmp_path):
+    writer = ShardWriter(str(tmp_path), CONFIG, shard_rows=8)
+    writer.add('blank', '/images/blank.jpg', features(0, 0))
+    writer.close()
+
+    _, shards = open_shards(str(tmp_path))
+    assert shards[0].rows == 0
+    assert shards[0].features(shards[0].images[0])['descriptors'] is None
+    assert ShardWriter(str(tmp_path), CONFIG, shard_rows=8).done == {'blank'}
+
+
+def test_resume_with_other_settings_is_refused(tmp_path):
+    ShardWriter(str(tmp_path), CONFIG, shard_rows=8).close()
+    with pytest.raises(ValueError, match='descriptor_format, dim'):
+        ShardWriter(str(tmp_path), dict(CONFIG, descriptor_format='sift-64-f32', dim=64), shard_rows=8)
+
+
+def test_open_shards_without_an_index(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_shards(str(tmp_path))
@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+import pytest
+
+from vector_matching import NORM_HAMMING, NORM_L2, good_match_counts, good_match_pairs
+
+
+def knn_match_count(query, candidate, norm, ratio_threshold, max_distance=None):
+    """Ratio-test survivors as compare_features counted them with cv2.BFMatcher"""
+    matches = cv2.BFMatcher(norm).knnMatch(query, candidate, k=2)
+    return sum(
+        1 for pair in matches
+        if len(pair) == 2 and pair[0].distance < ratio_threshold * pair[1].distance
+        and (max_distance is None or pair[0].distance < max_distance)
+    )
+
+
+def sift_like(rng, rows):
+    return (rng.random((rows, 128)) * 255).astype(np.float32)
+
+
+@pytest.mark.parametrize('rows', [1, 2, 3, 50, 300])
+def test_l2_counts_match_knn_match(rows):
+    rng = np.random.default_rng(rows)
+    query = sift_like(rng, 120)
+    # Half of the candidate rows are noisy copies of query rows, so some matches pass
+    candidate = sift_like(rng, rows)
+    copies = min(rows, 60) // 2
+    candidate[:copies] = query[:copies] + rng.normal(0, 4, (copies, 128)).astype(np.float32)
+
+    counts = good_match_counts(query, [candidate], ratio_threshold=0.7, norm=NORM_L2)
+    assert counts[0] == knn_match_count(query, candidate, cv2.NORM_L2, 0.7)
+
+
+def binary_like(rng, rows, width):
+    return rng.integers(0, 256, (rows, width), dtype=np.uint8)
+
+
+def flip_bits(rng, descriptors, bits):
+    """Copies of descriptors with a few random bits flipped"""
+    noisy = descriptors.copy()
+    for row in noisy:
+        for bit in rng.choice(row.size * 8, bits, replace=False):
+            row[bit // 8] ^= np.uint8(1 << (bit % 8))
+    return noisy
+
+
+# ORB descriptors are 32 bytes, AKAZE 61 (not a multiple of the 8-byte words)
+@pytest.mark.parametrize('width', [32, 61])
+@pytest.mark.parametrize('rows', [1, 2, 3, 50, 300])
+def test_hamming_counts_match_knn_match(rows, width):
+    rng = np.random.default_rng(rows * width)
+    query = binary_like(rng, 120, width)
+    candidate = binary_like(rng, rows, width)
+    copies = min(rows, 60) // 2
+    candidate[:copies] = flip_bits(rng, query[:copies], 10)
+
+    counts = good_match_counts(query, [candidate], ratio_threshold=0.75, norm=NORM_HAMMING)
+    assert counts[0] == knn_match_count(query, candidate, cv2.NORM_HAMMING, 0.75)
+
+
+def test_hamming_counts_with_max_distance():
+    rng = np.random.default_rng(11)
+    query = binary_like(rng, 100, 32)
+    candidates = [binary_like(rng, rows, 32) for rows in (1, 2, 80)]
+    candidates[1][:1] = flip_bits(rng, query[:1], 5)
+    # Copies spread around the distance limit
+    candidates[2][:40] = np.concatenate([flip_bits(rng, query[i:i + 1], 10 + i) for i in range(40)])
+
+    counts = good_match_counts(query, candidates, ratio_threshold=0.75, norm=NORM_HAMMING, max_distance=35)
+    expected = [knn_match_count(query, c, cv2.NORM_HAMMING, 0.75, max_distance=35) for c in candidates]
+    assert counts.tolist() == expected
+    assert 0 < counts[2] < 40
+
+
+def test_l2_counts_of_a_mixed_batch():
+    rng = np.random.default_rng(7)
+    query = sift_like(rng, 80)
+    candidates = [sift_like(rng, rows) for rows in (1, 2, 40, 5, 200)]
+    candidates[2][:20] = query[:20] + 1.0
+
+    counts = good_match_counts(query, candidates, ratio_threshold=0.75, norm=NORM_L2)
+    expected = [knn_match_count(query, c, cv2.NORM_L2, 0.75) for c in candidates]
+    assert counts.tolist() == expected
+    # One-row candidates have no second neighbour and never pass
+    assert counts[0] == 0
+
+
+def test_pairs_match_knn_match():
+    rng = np.random.default_rng(3)
+    query = sift_like(rng, 60)
+    candidate = sift_like(rng, 90)
+    candidate[10:40] = query[:30] + 2.0
+
+    query_rows, candidate_rows = good_match_pairs(query, candidate, ratio_threshold=0.7)
+    matches = cv2.BFMatcher(cv2.NORM_L2).knnMatch(query, candidate, k=2)
+    expected = sorted(
+        (pair[0].queryIdx, pair[0].trainIdx) for pair in matches
+        if len(pair) == 2 and pair[0].distance < 0.7 * pair[1].distance
+    )
+    assert sorted(zip(query_rows.tolist(), candidate_rows.tolist())) == expected
+
+
+def test_empty_inputs():
+    query = np.zeros((0, 128), dtype=np.float32)
+    assert good_match_counts(query, [np.ones((3, 128), dtype=np.float32)]).tolist() == [0]
+    assert good_match_counts(np.ones((3, 128), dtype=np.float32), []).tolist() == []
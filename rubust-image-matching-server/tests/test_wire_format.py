@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import wire_format
+from descriptor_codec import train_codec
+
+
+def keypoints(rows):
+    return np.arange(rows * 4, dtype=np.float32).reshape(rows, 4)
+
+
+def round_trip(descriptors, descriptor_format=None, image_shape=(480, 640)):
+    blob = wire_format.pack_features(keypoints(len(descriptors)), descriptors, image_shape, descriptor_format)
+    features, offset = wire_format.unpack_features(blob)
+    assert offset == len(blob)
+    return features
+
+
+def test_raw_sift_round_trip():
+    descriptors = np.random.default_rng(0).random((25, 128), dtype=np.float32)
+    features = round_trip(descriptors)
+    assert features['descriptor_format'] == 'sift-128-f32'
+    assert features['image_shape'] == (480, 640)
+    np.testing.assert_array_equal(features['descriptors'], descriptors)
+    np.testing.assert_array_equal(features['keypoints'], keypoints(25))
+
+
+@pytest.mark.parametrize('precision', ['u8', 'f16'])
+def test_rootsift_pca_round_trip(precision):
+    rng = np.random.default_rng(1)
+    codec, _ = train_codec(rng.random((2000, 128), dtype=np.float32) * 255, dims=32, precision=precision)
+    stored = codec.encode(rng.random((40, 128), dtype=np.float32) * 255)
+    features = round_trip(stored, codec.format)
+    assert features['descriptor_format'] == codec.format
+    assert features['descriptors'].dtype == stored.dtype
+    np.testing.assert_array_equal(features['descriptors'], stored)
+
+
+@pytest.mark.parametrize('kind, dim', [('orb', 32), ('akaze', 61)])
+def test_binary_descriptors_round_trip(kind, dim):
+    descriptors = np.random.default_rng(2).integers(0, 256, (30, dim), dtype=np.uint8)
+    features = round_trip(descriptors, f'{kind}-{dim}-u8')
+    assert features['descriptor_format'] == f'{kind}-{dim}-u8'
+    np.testing.assert_array_equal(features['descriptors'], descriptors)
+
+
+def test_empty_descriptors_round_trip():
+    features = round_trip(np.empty((0, 128), dtype=np.float32))
+    assert features['descriptors'] is None
+    assert features['descriptors_shape'] == (0, 128)
+
+
+def test_concatenated_blobs():
+    rng = np.random.default_rng(2)
+    sets = [rng.random((rows, 128), dtype=np.float32) for rows in (3, 0, 7)]
+    body = b''.join(wire_format.pack_features(keypoints(len(d)), d) for d in sets)
+    decoded = wire_format.unpack_all(body)
+    assert [f['descriptors_shape'][0] for f in decoded] == [3, 0, 7]
+    np.testing.assert_array_equal(decoded[2]['descriptors'], sets[2])
+
+
+def test_float16_is_rejected_for_raw_kinds():
+    blob = bytearray(wire_format.pack_features(keypoints(2), np.zeros((2, 128), dtype=np.float32)))
+    blob[5] = 3  # dtype code of float16
+    with pytest.raises(ValueError, match='cannot be float16'):
+        wire_format.unpack_features(bytes(blob))
+
+
+def test_corrupt_blobs_are_rejected():
+    blob = wire_format.pack_features(keypoints(4), np.zeros((4, 128), dtype=np.float32))
+    with pytest.raises(ValueError, match='bad magic'):
+        wire_format.unpack_features(b'XXXX' + blob[4:])
+    with pytest.raises(ValueError, match='Truncated'):
+        wire_format.unpack_features(blob[:-1])
+    with pytest.raises(ValueError, match='Truncated'):
+        wire_format.unpack_features(blob[:10])
@@ -0,0 +1,171 @@
+"""
+NumPy implementation of the knnMatch(k=2) + Lowe ratio test used by compare_features
+
+Distances for a whole candidate batch are computed at once instead of
+building cv2.DMatch objects and looping over them in Python:
+
+    L2:      |q - c|^2 = |q|^2 + |c|^2 - 2 q.c, one matrix product per batch
+    Hamming: popcount(q ^ c), summed over the descriptors' 64-bit words
+
+The Hamming kernel works on blocks of query rows small enough for the XOR
+temporaries to stay in cache, and keeps distances as uint16.
+"""
+import numpy as np
+
+from metrics import timed
+
+NORM_L2 = 'l2'
+NORM_HAMMING = 'hamming'
+
+# Upper bound on the (batch x query x candidate) distance tensor, in float32 cells
+MAX_BATCH_CELLS = 8 * 1024 * 1024
+
+
+# Query rows per block of the Hamming kernel
+HAMMING_BLOCK_ROWS = 128
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:  # NumPy < 2.0
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def _as_words(descriptors):
+    """View binary descriptors as uint64 words, zero-padding rows to a multiple of 8 bytes"""
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+    padding = -descriptors.shape[-1] % 8
+    if padding:
+        zeros = np.zeros(descriptors.shape[:-1] + (padding,), dtype=np.uint8)
+        descriptors = np.concatenate([descriptors, zeros], axis=-1)
+    return descriptors.view(np.uint64)
+
+
+def hamming_distances(query, batch):
+    """
+    Bit distances from every query row to every row of every candidate
+    query: (Q, bytes) uint8, batch: (B, N, bytes) uint8
+    Returns a (B, Q, N) uint16 array
+    """
+    q = _as_words(query)
+    # (B, words, N): each word of all candidate rows is contiguous
+    c = np.ascontiguousarray(np.moveaxis(_as_words(batch), -1, 1))
+    dist = np.zeros((c.shape[0], len(q), c.shape[2]), dtype=np.uint16)
+    for b in range(c.shape[0]):
+        for start in range(0, len(q), HAMMING_BLOCK_ROWS):
+            rows = q[start:start + HAMMING_BLOCK_ROWS]
+            block = dist[b, start:start + HAMMING_BLOCK_ROWS]
+            for word in range(q.shape[1]):
+                block += _popcount(rows[:, word, None] ^ c[b, word, None, :])
+    return dist
+
+
+def l2_distances(query, batch):
+    """Euclidean distances, (B, Q, N) float32"""
+    q = np.asarray(query, dtype=np.float32)
+    c = np.asarray(batch, dtype=np.float32)
+    q_sq = np.einsum('ij,ij->i', q, q)
+    c_sq = np.einsum('bij,bij->bi', c, c)
+    dist = q_sq[None, :, None] + c_sq[:, None, :] - 2.0 * np.matmul(q[None], c.transpose(0, 2, 1))
+    np.maximum(dist, 0, out=dist)
+    return np.sqrt(dist, out=dist)
+
+
+def stack_descriptors(descriptor_list):
+    """
+    Stack candidate descriptor matrices of different lengths into one padded batch
+    Returns (batch of shape (B, max_rows, dim), row counts of shape (B,))
+    """
+    counts = np.array([len(d) for d in descriptor_list], dtype=np.int64)
+    max_rows = int(counts.max()) if len(counts) else 0
+    dim = descriptor_list[0].shape[1] if len(descriptor_list) else 0
+    dtype = descriptor_list[0].dtype if len(descriptor_list) else np.float32
+    batch = np.zeros((len(descriptor_list), max_rows, dim), dtype=dtype)
+    for i, descriptors in enumerate(descriptor_list):
+        batch[i, :len(descriptors)] = descriptors
+    return batch, counts
+
+
+def two_nearest(query, batch, counts, norm=NORM_L2):
+    """
+    Nearest and second-nearest distance from each query row to each candidate
+    query: (Q, dim), batch: (B, N, dim) padded with rows beyond counts[b]
+    Returns (d1, d2, idx1), each of shape (B, Q). Distances use the same units
+    as cv2.BFMatcher (Euclidean for L2, bit count for Hamming); d2 is inf when a
+    candidate has fewer than two rows.
+    """
+    n_batch, n_rows = batch.shape[0], batch.shape[1]
+    if n_rows == 0:
+        d1 = np.full((n_batch, len(query)), np.inf, dtype=np.float32)
+        return d1, d1.copy(), np.zeros((n_batch, len(query)), dtype=np.int64)
+
+    if norm == NORM_HAMMING:
+        dist = hamming_distances(query, batch)
+        far = np.iinfo(dist.dtype).max
+    else:
+        dist = l2_distances(query, batch)
+        far = np.inf
+
+    # Padding rows must never be selected
+    padding = np.arange(n_rows)[None, :] >= counts[:, None]
+    dist[np.broadcast_to(padding[:, None, :], dist.shape)] = far
+
+    idx1 = np.argmin(dist, axis=2)
+    d1 = np.take_along_axis(dist, idx1[..., None], axis=2)[..., 0]
+    # Mask the nearest neighbour out in place to find the second one
+    np.put_along_axis(dist, idx1[..., None], far, axis=2)
+    d2 = dist.min(axis=2)
+    if norm == NORM_HAMMING:
+        d1 = np.where(d1 == far, np.inf, d1).astype(np.float32)
+        d2 = np.where(d2 == far, np.inf, d2).astype(np.float32)
+    return d1, d2, idx1
+
+
+def ratio_test(d1, d2, ratio_threshold=0.7, max_distance=None):
+    """
+    Boolean mask of matches passing Lowe's ratio test (and an optional absolute threshold)
+    """
+    # A candidate with a single row has no second neighbour, as with knnMatch
+    passed = (d1 < ratio_threshold * d2) & np.isfinite(d2)
+    if max_distance is not None:
+        passed &= d1 < max_distance
+    return passed
+
+
+def good_match_counts(query, descriptor_list, ratio_threshold=0.7, norm=NORM_L2, max_distance=None):
+    """
+    Number of ratio-test survivors of query against every candidate in descriptor_list
+    Candidates are scored in padded batches bounded by MAX_BATCH_CELLS
+    """
+    counts = np.zeros(len(descriptor_list), dtype=np.int64)
+    if len(descriptor_list) == 0 or len(query) == 0:
+        return counts
+
+    max_rows = max(len(d) for d in descriptor_list)
+    per_batch = max(1, MAX_BATCH_CELLS // max(1, len(query) * max_rows))
+    for start in range(0, len(descriptor_list), per_batch):
+        chunk = descriptor_list[start:start + per_batch]
+        with timed('knn_match'):
+            batch, rows = stack_descriptors(chunk)
+            d1, d2, _ = two_nearest(query, batch, rows, norm)
+        with timed('ratio_test'):
+            counts[start:start + len(chunk)] = ratio_test(d1, d2, ratio_threshold, max_distance).sum(axis=1)
+    return counts
+
+
+def good_match_pairs(query, candidate, ratio_threshold=0.7, norm=NORM_L2, max_distance=None):
+    """
+    Row indices of the ratio-test survivors between two descriptor sets
+    Returns (query rows, candidate rows), the matched pairs used for geometric verification
+    """
+    if len(query) == 0 or len(candidate) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    with timed('knn_match'):
+        batch, rows = stack_descriptors([candidate])
+        d1, d2, idx1 = two_nearest(query, batch, rows, norm)
+    with timed('ratio_test'):
+        query_rows = np.nonzero(ratio_test(d1[0], d2[0], ratio_threshold, max_distance))[0]
+    return query_rows, idx1[0, query_rows]
@@ -0,0 +1,147 @@
+"""
+Compact binary encoding of extracted features
+
+Selected with the 'application/x-lostmatch-features' media type, either in the
+Accept header of /extract-features or as the Content-Type of comparison requests.
+A blob is a fixed 32-byte little-endian header followed by raw arrays:
+
+    magic 'LMF1' | version u8 | dtype u8 | descriptor kind u16
+    rows u32 | dim u32 | keypoints u32 | image_height u32 | image_width u32 | projection id u32
+    keypoints  float32[keypoints, 4]   (x, y, size, angle)
+    descriptors dtype[rows, dim]
+
+The descriptor kind (0 raw SIFT, 1 RootSIFT + PCA, 2 ORB, 3 AKAZE), dtype, dim
+and projection id carry the descriptor_format tag of descriptor_codec.py; blobs written
+before compressed descriptors existed have zeros there and read as raw SIFT.
+
+Blobs are self-delimiting, so a request carrying several feature sets is just
+their concatenation. Decoding returns NumPy views into the request buffer
+without copying the arrays.
+"""
+import struct
+
+import numpy as np
+
+from descriptor_codec import PRECISION_BY_DTYPE, RAW_FORMAT, format_tag, parse_format
+
+MEDIA_TYPE = 'application/x-lostmatch-features'
+MAGIC = b'LMF1'
+VERSION = 1
+
+HEADER = struct.Struct('<4sBBHIIIIII')
+KEYPOINT_FIELDS = 4
+
+DTYPE_CODES = {
+    1: np.dtype(np.float32),
+    2: np.dtype(np.uint8),
+    3: np.dtype(np.float16),
+}
+CODES_BY_DTYPE = {dtype: code for code, dtype in DTYPE_CODES.items()}
+
+KIND_CODES = {0: 'sift', 1: 'rootsift-pca', 2: 'orb', 3: 'akaze'}
+CODES_BY_KIND = {kind: code for code, kind in KIND_CODES.items()}
+
+
+def keypoints_to_array(keypoints):
+    """Convert the JSON keypoint dicts returned by /extract-features to an (n, 4) array"""
+    if isinstance(keypoints, np.ndarray):
+        return keypoints
+    return np.array(
+        [[kp['x'], kp['y'], kp['size'], kp['angle']] for kp in keypoints],
+        dtype=np.float32
+    ).reshape(-1, KEYPOINT_FIELDS)
+
+
+def pack_features(keypoints, descriptors, image_shape=(0, 0), descriptor_format=None):
+    """
+    Encode keypoints (n x 4 array or list of dicts) and a descriptor array into one blob
+    descriptor_format defaults to raw SIFT
+    """
+    keypoints = np.ascontiguousarray(keypoints_to_array(keypoints), dtype=np.float32)
+    if descriptors is None:
+        descriptors = np.empty((0, 0), dtype=np.float32)
+    descriptors = np.ascontiguousarray(descriptors)
+    if descriptors.dtype not in CODES_BY_DTYPE:
+        raise ValueError(f"Unsupported descriptor dtype: {descriptors.dtype}")
+
+    rows, dim = descriptors.shape if descriptors.ndim == 2 else (0, 0)
+    height, width = (tuple(image_shape) + (0, 0))[:2]
+    kind, _, _, projection_id = parse_format(descriptor_format or RAW_FORMAT)
+    header = HEADER.pack(
+        MAGIC, VERSION, CODES_BY_DTYPE[descriptors.dtype], CODES_BY_KIND[kind],
+        rows, dim, len(keypoints), int(height), int(width), int(projection_id or '0', 16)
+    )
+    return header + keypoints.tobytes() + descriptors.tobytes()
+
+
+def unpack_features(buffer, offset=0):
+    """
+    Decode one blob starting at offset
+    Returns (features, next_offset). features has the same keys as the JSON
+    format, but 'descriptors' and 'keypoints' are read-only NumPy views.
+    """
+    if len(buffer) - offset < HEADER.size:
+        raise ValueError('Truncated feature blob header')
+    (magic, version, dtype_code, kind_code, rows, dim, keypoint_count,
+     height, width, projection_id) = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError('Not a feature blob (bad magic)')
+    if version != VERSION:
+        raise ValueError(f'Unsupported feature blob version: {version}')
+    if dtype_code not in DTYPE_CODES:
+        raise ValueError(f'Unknown descriptor dtype code: {dtype_code}')
+    if kind_code not in KIND_CODES:
+        raise ValueError(f'Unknown descriptor kind code: {kind_code}')
+
+    dtype = DTYPE_CODES[dtype_code]
+    kind = KIND_CODES[kind_code]
+    if dtype == np.float16 and kind != 'rootsift-pca':
+        # Only the compressed format has a float16 variant
+        raise ValueError(f'{kind} descriptors cannot be float16')
+    if kind == 'sift':
+        descriptor_format = format_tag(kind, dim or 128, PRECISION_BY_DTYPE[dtype])
+    elif kind != 'rootsift-pca':
+        descriptor_format = format_tag(kind, dim, PRECISION_BY_DTYPE[dtype])
+    else:
+        descriptor_format = format_tag(kind, dim, PRECISION_BY_DTYPE[dtype], f'{projection_id:08x}')
+    offset += HEADER.size
+    keypoints_size = keypoint_count * KEYPOINT_FIELDS * 4
+    descriptors_size = rows * dim * dtype.itemsize
+    if len(buffer) - offset < keypoints_size + descriptors_size:
+        raise ValueError('Truncated feature blob body')
+
+    keypoints = np.frombuffer(buffer, dtype=np.float32, count=keypoint_count * KEYPOINT_FIELDS, offset=offset)
+    offset += keypoints_size
+    descriptors = None
+    if rows:
+        descriptors = np.frombuffer(buffer, dtype=dtype, count=rows * dim, offset=offset).reshape(rows, dim)
+    offset += descriptors_size
+
+    features = {
+        'keypoints_count': keypoint_count,
+        'keypoints': keypoints.reshape(keypoint_count, KEYPOINT_FIELDS),
+        'descriptors': descriptors,
+        'descriptors_shape': (rows, dim),
+        'descriptor_format': descriptor_format,
+        'image_shape': (height, width)
+    }
+    return features, offset
+
+
+def unpack_all(buffer):
+    """Decode every blob of a concatenated request body"""
+    features = []
+    offset = 0
+    while offset < len(buffer):
+        item, offset = unpack_features(buffer, offset)
+        features.append(item)
+    return features
+
+
+def is_binary_request(request):
+    return request.mimetype == MEDIA_TYPE
+
+
+def wants_binary(request):
+    """Content negotiation: JSON stays the default unless the client prefers the binary type"""
+    return request.accept_mimetypes.best_match(['application/json', MEDIA_TYPE]) == MEDIA_TYPE